@@ -1,32 +1,28 @@
+import argparse
 import tkinter as tk
 from tkinter import ttk, scrolledtext, messagebox
-import meshtastic
-import meshtastic.serial_interface
-from pubsub import pub
 import threading
-import serial.tools.list_ports
-import pyaudio
 import wave
 import os
-import time
-import base64
-import json
-import zlib
-import audioop
-import struct
-import uuid
-import math
-import numpy as np
 from datetime import datetime
 
+import codec
+import encodecache
+import engine
+import fec
+import meshlink
+import metrics
+import profiling
+import recorder
+import uiqueue
+
 class MeshtasticVoiceMessenger:
-    def __init__(self, master):
+    def __init__(self, master, profile_dir=None):
         self.master = master
         master.title("Meshtastic Voice Messenger")
         master.geometry("700x700")
         master.minsize(600, 600)
 
-        self.cancel_send_event = threading.Event()
         self.stop_send_button = None  # will hold the Stop Sending button
         
         # Configure the grid to expand properly
@@ -47,11 +43,12 @@ class MeshtasticVoiceMessenger:
         
         # Audio settings - improved quality
         self.chunk = 1024
-        self.format = pyaudio.paInt16
+        self.sample_width = 2  # 16-bit recording
         self.channels = 1
         self.rate = 8000  # Default sample rate - better quality
         self.record_seconds = 3  # Default recording length
-        self.p = pyaudio.PyAudio()
+        self.p = None  # pyaudio.PyAudio, opened on first record or play (see audio())
+        self.audio_lock = threading.Lock()
         
         # Meshtastic connection
         self.interface = None
@@ -60,25 +57,81 @@ class MeshtasticVoiceMessenger:
         # Voice message storage
         self.voice_messages = []
         self.recording = False
+        self.streaming = False  # Sending while recording
         self.playing = False
         self.current_recording_path = None
-        
-        # Message chunking
-        self.chunk_sizes = {
-            "Small": 150,    # More reliable, more chunks
-            "Medium": 180,   # Balance between reliability and speed
-            "Large": 200     # Faster transfer, less reliable
-        }
-        self.max_chunk_size = self.chunk_sizes["Medium"]  # Default
-        self.message_chunks = {}  # To store incoming chunks
-        self.sending_chunks = False
-        self.chunk_retry_count = 2  # Number of times to retry sending a chunk
-        self.chunk_retry_delay = 1  # Seconds between retries
-        
-        # Create directory for voice messages
-        os.makedirs("voice_messages", exist_ok=True)
+        self.current_recording = None  # recorder.RecordBuffer of the last recording
+        
+        # Message chunking presets, whole packet bytes including the binary frame header
+        self.chunk_sizes = engine.CHUNK_SIZES
+        
+        # Partial messages are NACKed from the main loop when they stall
+        self.repair_check_interval = 1000  # Milliseconds between stall checks
+        self.stall_check_job = None
+        self.duplicates_logged = 0  # Duplicate packets already reported in the log
+        
+        # UI updates from worker threads are queued and applied in batches
+        self.ui_updates = uiqueue.UIUpdateQueue()
+        self.ui_update_interval = 100  # Milliseconds between batches
+        self.max_log_lines = 500  # Oldest log lines are dropped beyond this
+        self.progress_lines = {}  # Active transfer progress shown under the status bar
+        
+        # Metrics shown in the stats panel, served to Prometheus and written to a file
+        self.metrics = metrics.Registry()
+        self.record_timer = metrics.stage_timer(self.metrics, "record")
+        self.metrics_port = metrics.DEFAULT_PORT  # http://127.0.0.1:9464/metrics; None disables the server
+        self.metrics_file = os.path.join("voice_messages", "metrics.prom")  # None disables the file
+        self.metrics_server = None
+        self.stats_interval = 2000  # Milliseconds between stats panel refreshes and metrics file writes
+        
+        # Sending, receiving and reassembly (creates the voice_messages directory)
+        self.engine = engine.VoiceEngine(output_dir="voice_messages",
+                                         log=self.log,
+                                         progress=self.progress,
+                                         add_message=self.add_message_to_list,
+                                         update_message=self.update_message_entry,
+                                         on_test_message=self.show_test_message,
+                                         on_send_finished=self.send_finished,
+                                         registry=self.metrics)
+        self.engine.max_chunk_size = self.chunk_sizes["Medium"]  # Default
+        # Received packets are decoded on worker threads, not the meshtastic reader thread
+        self.engine.start_receive_workers()
+        self.receive_drops_logged = 0  # Packets dropped by full receive queues already reported
+        
+        # Recordings are encoded in the background as soon as they are finished
+        self.encode_cache = encodecache.EncodeCache(registry=self.metrics)
+        
+        # Opt-in profiling of the hot paths (--profile DIR or VOICE_PROFILE=DIR); nothing is wrapped otherwise
+        self.profiler = profiling.from_environment(profile_dir, log=self.log)
+        if self.profiler is not None:
+            self.profiler.instrument(self, ("ultra_compress_audio", "play_audio", "process_ui_updates"))
+            self.profiler.instrument(self.engine, engine.VoiceEngine.PROFILED)
+            self.profiler.instrument(self.encode_cache, ("encode",))
+            self.log(f"Profiling enabled, writing reports to {self.profiler.directory} on exit")
         
         self.create_widgets()
+        self.master.after(self.ui_update_interval, self.process_ui_updates)
+        self.master.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.master.after(self.stats_interval, self.refresh_stats)
+        
+        # Slow setup waits until the window is on screen
+        self.startup_delay = 100  # Milliseconds after the first frame
+        self.master.after(self.startup_delay, self.finish_startup)
+        self.refresh_ports()
+
+    def finish_startup(self):
+        """Setup deferred so it does not hold up the first frame"""
+        self.start_metrics_server()
+        # Unfinished transfers are kept on disk and resumed after a restart or reconnect
+        self.engine.open_store(os.path.join("voice_messages", "transfers.db"))
+
+    def audio(self):
+        """The PyAudio instance, created on first use since it probes every audio device (any thread)"""
+        with self.audio_lock:
+            if self.p is None:
+                import pyaudio
+                self.p = pyaudio.PyAudio()
+            return self.p
 
     def create_widgets(self):
         main_frame = ttk.Frame(self.master, padding="20", style="TFrame")
@@ -100,10 +153,8 @@ class MeshtasticVoiceMessenger:
         port_frame.columnconfigure(0, weight=1)
         
         ttk.Label(settings_frame, text="COM Port:").grid(row=0, column=0, sticky=tk.W, padx=5, pady=5)
-        self.com_ports = self.get_available_ports()
+        self.com_ports = []  # Filled in by a background scan, see refresh_ports
         self.com_port = ttk.Combobox(port_frame, values=self.com_ports, width=40)
-        if self.com_ports:
-            self.com_port.set(self.com_ports[0])
         self.com_port.grid(row=0, column=0, sticky=(tk.W, tk.E))
         
         refresh_button = ttk.Button(port_frame, text="⟳", width=3, command=self.refresh_ports)
@@ -128,17 +179,46 @@ class MeshtasticVoiceMessenger:
         ttk.Label(recording_frame, text="Compression Quality:").grid(row=1, column=0, sticky=tk.W, padx=5, pady=5)
         self.compression_quality_var = tk.StringVar(value="Low")  # Changed default to Low
         self.compression_quality = ttk.Combobox(recording_frame, textvariable=self.compression_quality_var, 
-                                               values=["Ultra Low", "Very Low", "Low"], width=10)
+                                               values=list(codec.QUALITY_PRESETS), width=10)
         self.compression_quality.grid(row=1, column=1, sticky=tk.W, padx=5, pady=5)
+        self.compression_quality.bind("<<ComboboxSelected>>", self.pre_encode)
         
         # Chunk Size
         ttk.Label(recording_frame, text="Chunk Size:").grid(row=2, column=0, sticky=tk.W, padx=5, pady=5)
         self.chunk_size_var = tk.StringVar(value="Medium")
         self.chunk_size = ttk.Combobox(recording_frame, textvariable=self.chunk_size_var, 
-                                      values=["Small", "Medium", "Large"], width=10)
+                                      values=list(self.chunk_sizes), width=10)
         self.chunk_size.grid(row=2, column=1, sticky=tk.W, padx=5, pady=5)
         self.chunk_size.bind("<<ComboboxSelected>>", self.update_chunk_size)
         
+        # Forward Error Correction
+        ttk.Label(recording_frame, text="FEC Overhead:").grid(row=3, column=0, sticky=tk.W, padx=5, pady=5)
+        self.fec_overhead_var = tk.StringVar(value="Off")
+        self.fec_overhead_box = ttk.Combobox(recording_frame, textvariable=self.fec_overhead_var,
+                                             values=list(fec.OVERHEADS), width=10)
+        self.fec_overhead_box.grid(row=3, column=1, sticky=tk.W, padx=5, pady=5)
+        self.fec_overhead_box.bind("<<ComboboxSelected>>", self.update_fec_overhead)
+        
+        # Streaming send
+        self.stream_send_var = tk.BooleanVar(value=False)
+        stream_check = ttk.Checkbutton(recording_frame, text="Send while recording", variable=self.stream_send_var)
+        stream_check.grid(row=4, column=1, sticky=tk.W, padx=5, pady=5)
+        self.add_tooltip(stream_check, "Encode and transmit chunks as soon as they are recorded (no FEC)")
+        
+        # Progressive playback
+        self.progressive_var = tk.BooleanVar(value=False)
+        progressive_check = ttk.Checkbutton(recording_frame, text="Progressive playback", variable=self.progressive_var,
+                                            command=self.pre_encode)
+        progressive_check.grid(row=5, column=1, sticky=tk.W, padx=5, pady=5)
+        self.add_tooltip(progressive_check, "Send audio in ~1 s segments that receivers can play before the whole message arrives")
+        
+        # Silence trimming
+        self.trim_silence_var = tk.BooleanVar(value=True)
+        trim_check = ttk.Checkbutton(recording_frame, text="Trim silence", variable=self.trim_silence_var,
+                                     command=self.pre_encode)
+        trim_check.grid(row=6, column=1, sticky=tk.W, padx=5, pady=5)
+        self.add_tooltip(trim_check, "Drop silence before and after speech and send long pauses as short markers")
+        
         # Voice Controls Frame
         voice_frame = ttk.LabelFrame(main_frame, text="Voice Controls", padding="10")
         voice_frame.grid(row=3, column=0, sticky=(tk.W, tk.E), pady=(0, 10))
@@ -200,13 +280,27 @@ class MeshtasticVoiceMessenger:
         status_bar = ttk.Label(main_frame, textvariable=self.status_var, relief=tk.SUNKEN, anchor=tk.W)
         status_bar.grid(row=6, column=0, sticky=(tk.W, tk.E))
         
+        # Transfer progress (coalesced per message)
+        self.progress_var = tk.StringVar(value="")
+        progress_label = ttk.Label(main_frame, textvariable=self.progress_var, anchor=tk.W)
+        progress_label.grid(row=7, column=0, sticky=(tk.W, tk.E))
+        
+        # Stats panel, refreshed from the metrics registry
+        self.stats_var = tk.StringVar(value="")
+        stats_label = ttk.Label(main_frame, textvariable=self.stats_var, anchor=tk.W, justify=tk.LEFT,
+                                font=("Arial", 9))
+        stats_label.grid(row=8, column=0, sticky=(tk.W, tk.E))
+        self.add_tooltip(stats_label, f"Full metrics: http://127.0.0.1:{self.metrics_port}/metrics "
+                                      f"and {self.metrics_file}")
+        
         # Configure main frame to expand
         main_frame.rowconfigure(4, weight=1)
         main_frame.rowconfigure(5, weight=1)
         
         # Add tooltips
-        self.add_tooltip(self.chunk_size, "Small: More reliable but slower\nMedium: Balanced\nLarge: Faster but less reliable")
-        self.add_tooltip(self.compression_quality, "Ultra Low: Smallest size, lowest quality\nVery Low: Better quality, larger size\nLow: Best quality, largest size")
+        self.add_tooltip(self.chunk_size, "Small: More reliable but slower\nMedium: Balanced\nLarge: Faster but less reliable\nMax: Largest packet the radio accepts")
+        self.add_tooltip(self.compression_quality, "Vocoder: 2400 bit/s synthetic speech, a few packets per second\nUltra Low: Smallest size, lowest quality\nADPCM: 4-bit 8 kHz speech, about a quarter of Very Low\nVery Low: Better quality, larger size\nLow: Best quality, largest size")
+        self.add_tooltip(self.fec_overhead_box, "Extra parity chunks sent with each message.\nThe receiver can rebuild the message if up to\nthis share of chunks is lost.")
 
     def add_tooltip(self, widget, text):
         """Add a tooltip to a widget"""
@@ -236,26 +330,78 @@ class MeshtasticVoiceMessenger:
         """Update the chunk size based on the dropdown selection"""
         selected = self.chunk_size_var.get()
         if selected in self.chunk_sizes:
-            self.max_chunk_size = self.chunk_sizes[selected]
-            self.log(f"Chunk size set to {selected} ({self.max_chunk_size} bytes)")
+            self.engine.max_chunk_size = self.chunk_sizes[selected]
+            self.log(f"Chunk size set to {selected} ({self.engine.frame_size()} bytes)")
+
+    def update_fec_overhead(self, event=None):
+        """Update the FEC overhead based on the dropdown selection"""
+        selected = self.fec_overhead_var.get()
+        if selected in fec.OVERHEADS:
+            self.engine.fec_overhead = fec.OVERHEADS[selected]
+            self.log(f"FEC overhead set to {selected}")
 
     def refresh_ports(self):
-        """Refresh the list of available COM ports"""
-        self.com_ports = self.get_available_ports()
-        self.com_port['values'] = self.com_ports
-        if self.com_ports:
-            self.com_port.set(self.com_ports[0])
+        """Scan for COM ports on a background thread and fill the list when done"""
+        def scan():
+            try:
+                ports = self.get_available_ports()
+            except Exception as e:
+                self.log(f"Error listing COM ports: {str(e)}")
+                return
+            self.ui_updates.call(self.set_ports, ports)
+        threading.Thread(target=scan, name="port-scan", daemon=True).start()
+
+    def set_ports(self, ports):
+        """Show scanned COM ports, keeping the selection if it is still there; main loop only"""
+        self.com_ports = ports
+        self.com_port['values'] = ports
+        if ports and self.com_port.get() not in ports:
+            self.com_port.set(ports[0])
         self.log("COM ports refreshed")
 
     def get_available_ports(self):
-        """Get a list of available COM ports"""
-        return [port.device for port in serial.tools.list_ports.comports()]
+        """Get a list of available COM ports, plus the built-in simulator"""
+        return meshlink.list_ports()
 
     def log(self, message):
-        """Add a timestamped message to the log display"""
+        """Queue a timestamped message for the log display (safe from any thread)"""
         timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        self.log_display.insert(tk.END, f"[{timestamp}] {message}\n")
-        self.log_display.see(tk.END)
+        self.ui_updates.log(f"[{timestamp}] {message}\n")
+
+    def progress(self, key, text):
+        """Show coalesced progress for a transfer; None removes it (safe from any thread)"""
+        self.ui_updates.set_progress(key, text)
+
+    def process_ui_updates(self):
+        """Apply queued log lines, progress and callbacks on the Tk main loop"""
+        try:
+            logs, dropped, progress, calls = self.ui_updates.drain()
+            
+            if dropped:
+                logs.insert(0, f"... {dropped} log lines dropped ...\n")
+            if logs:
+                # One insert per batch, then trim the widget to a bounded ring
+                self.log_display.insert(tk.END, "".join(logs))
+                line_count = int(self.log_display.index('end-1c').split('.')[0])
+                if line_count > self.max_log_lines:
+                    self.log_display.delete("1.0", f"{line_count - self.max_log_lines + 1}.0")
+                self.log_display.see(tk.END)
+            
+            if progress:
+                for key, text in progress.items():
+                    if text is None:
+                        self.progress_lines.pop(key, None)
+                    else:
+                        self.progress_lines[key] = text
+                self.progress_var.set(" | ".join(self.progress_lines.values()))
+            
+            for fn, args in calls:
+                try:
+                    fn(*args)
+                except Exception as e:
+                    self.log(f"Error updating UI: {str(e)}")
+        finally:
+            self.master.after(self.ui_update_interval, self.process_ui_updates)
 
     def toggle_connection(self):
         """Toggle connection to Meshtastic device"""
@@ -272,208 +418,139 @@ class MeshtasticVoiceMessenger:
             
         try:
             self.log(f"Connecting to Meshtastic device on {self.com_port.get()}...")
-            self.interface = meshtastic.serial_interface.SerialInterface(devPath=self.com_port.get())
+            # The simulator port opens a one-node mesh that hears its own packets, for trying the app without a radio
+            self.interface = meshlink.connect(self.com_port.get(), self.engine.on_receive, self.connection_lost)
+            self.engine.interface = self.interface
             self.log("Connected to Meshtastic device successfully")
-            
-            # Subscribe to receive messages
-            pub.subscribe(self.on_receive, "meshtastic.receive")
             self.log("Subscribed to Meshtastic messages")
             
             # Get device info
-            myinfo = self.interface.myInfo
-            if myinfo:
-                self.log(f"Connected to node: {myinfo.my_node_num}")
+            node_num = meshlink.node_number(self.interface)
+            if node_num is not None:
+                self.log(f"Connected to node: {node_num}")
                 
             self.is_connected = True
             self.connect_button.config(text="Disconnect")
             self.status_var.set("Connected")
             
+            # Start watching partial messages for stalls
+            if self.stall_check_job is None:
+                self.stall_check_job = self.master.after(self.repair_check_interval, self.check_stalled_messages)
+            
+            # Carry on with messages interrupted by a disconnect or restart
+            if self.engine.resume_transfers():
+                self.stop_send_button.config(state=tk.NORMAL)
+            
         except Exception as e:
             self.log(f"Error connecting to Meshtastic device: {str(e)}")
             messagebox.showerror("Connection Error", f"Failed to connect to Meshtastic device: {str(e)}")
 
     def disconnect_from_device(self):
         """Disconnect from Meshtastic device"""
+        self.engine.suspend_transfers()
         if self.interface:
             try:
-                # pub.unsubscribe(self.on_receive, "meshtastic.receive")
+                # pub.unsubscribe(self.engine.on_receive, "meshtastic.receive")
                 self.interface.close()
                 self.log("Meshtastic interface closed")
             except Exception as e:
                 self.log(f"Error closing interface: {str(e)}")
             finally:
                 self.interface = None
+                self.engine.interface = None
                 
         self.is_connected = False
         self.connect_button.config(text="Connect")
         self.status_var.set("Disconnected")
 
-    def on_receive(self, packet, interface):
-        """Handle received messages from the mesh network"""
-        try:
-            from_id = packet.get('fromId', 'unknown')
-            self.log(f"Received packet: {packet.get('id')} from {from_id}")
-            
-            if packet.get('decoded', {}).get('portnum') == 'TEXT_MESSAGE_APP':
-                self.log(f"Received text message from {from_id}")
-                self.process_text_message(packet)
-            elif packet.get('decoded', {}).get('portnum') == 'PRIVATE_APP':
-                self.log(f"Received private app data from {from_id}")
-                self.process_voice_message(packet)
-        except Exception as e:
-            self.log(f"Error processing received packet: {str(e)}")
-
-    def process_text_message(self, packet):
-        """Process a received text message"""
+    def connection_lost(self, interface=None):
+        """Handle the serial link dropping (called from the meshtastic thread)"""
+        def lost():
+            if self.is_connected and interface in (None, self.interface):
+                self.log("Connection to the Meshtastic device was lost")
+                self.disconnect_from_device()
+        self.ui_updates.call(lost)
+
+    def on_close(self):
+        """Keep unfinished transfers in the store and close the window"""
+        if self.is_connected:
+            self.disconnect_from_device()
+        self.engine.close()
+        self.encode_cache.close()
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+        if self.profiler is not None:
+            self.profiler.close()
+        if self.p is not None:
+            self.p.terminate()
+        self.master.destroy()
+
+    def show_test_message(self, from_node, text):
+        """Pop up a received test message (safe from any thread)"""
+        self.ui_updates.call(messagebox.showinfo, "Test Message", f"Received test message from {from_node}: {text}")
+
+    def start_metrics_server(self):
+        """Serve the metrics to Prometheus; the app works without it"""
+        if self.metrics_port is None:
+            return
         try:
-            message = packet.get('decoded', {}).get('text', '')
-            from_node = packet.get('fromId', 'Unknown')
-            self.log(f"Text message from {from_node}: {message}")
-            
-            # Add to messages list
-            self.add_message_to_list(f"Text from {from_node}: {message}", None)
-            
-        except Exception as e:
-            self.log(f"Error processing text message: {str(e)}")
+            self.metrics_server = metrics.MetricsServer(self.metrics, self.metrics_port)
+            self.log(f"Serving metrics on http://127.0.0.1:{self.metrics_server.port}/metrics")
+        except OSError as e:
+            self.log(f"Metrics server not started: {str(e)}")
 
-    def process_voice_message(self, packet):
-        """Process a received voice message"""
+    def refresh_stats(self):
+        """Periodically update the stats panel and write the metrics file"""
         try:
-            data = packet.get('decoded', {}).get('payload')
-            from_node = packet.get('fromId', 'Unknown')
-            
-            if not data:
-                self.log("Received empty voice message payload")
-                return
-                
-            try:
-                # Try to decode as JSON
-                json_data = json.loads(data.decode('utf-8'))
-                
-                # Check if this is a chunked message
-                if 'chunk_id' in json_data and 'chunk_num' in json_data and 'total_chunks' in json_data:
-                    self.log(f"Received chunk {json_data['chunk_num']}/{json_data['total_chunks']} of message {json_data['chunk_id']} from {from_node}")
-                    self.process_message_chunk(json_data, from_node)
-                elif 'voice_data' in json_data and 'timestamp' in json_data:
-                    # This is a complete voice message
-                    voice_data = base64.b64decode(json_data['voice_data'])
-                    timestamp = json_data['timestamp']
-                    
-                    # Save the voice message
-                    filename = f"voice_messages/received_{from_node}_{timestamp}.wav"
-                    with open(filename, 'wb') as f:
-                        f.write(voice_data)
-                    
-                    self.log(f"Received voice message from {from_node}")
-                    self.add_message_to_list(f"Voice from {from_node} at {timestamp}", filename)
-                elif 'test' in json_data:
-                    # This is a test message
-                    self.log(f"Received test message from {from_node}: {json_data['test']}")
-                    messagebox.showinfo("Test Message", f"Received test message from {from_node}: {json_data['test']}")
-            except json.JSONDecodeError:
-                self.log("Received data is not in JSON format")
-                
+            self.stats_var.set(self.stats_summary())
+            if self.metrics_file:
+                metrics.write_file(self.metrics, self.metrics_file)
         except Exception as e:
-            self.log(f"Error processing voice message: {str(e)}")
-
-    def process_message_chunk(self, chunk_data, from_node):
-        """Process a chunk of a multi-part voice message"""
-        chunk_id = chunk_data['chunk_id']
-        chunk_num = chunk_data['chunk_num']
-        total_chunks = chunk_data['total_chunks']
-        chunk_content = chunk_data['data']
-        
-        # Initialize storage for this message if needed
-        if chunk_id not in self.message_chunks:
-            self.message_chunks[chunk_id] = {
-                'chunks': {},
-                'total_chunks': total_chunks,
-                'from_node': from_node,
-                'timestamp': datetime.now().strftime('%Y%m%d_%H%M%S'),
-                'last_chunk_time': time.time()
-            }
-        else:
-            # Update last chunk time
-            self.message_chunks[chunk_id]['last_chunk_time'] = time.time()
-        
-        # Store this chunk
-        self.message_chunks[chunk_id]['chunks'][chunk_num] = chunk_content
-        
-        # Check if we have all chunks
-        received_chunks = len(self.message_chunks[chunk_id]['chunks'])
-        if received_chunks == total_chunks:
-            self.log(f"Received all {total_chunks} chunks for message {chunk_id}")
-            self.reassemble_message(chunk_id)
-        else:
-            # Log how many chunks we have so far
-            self.log(f"Have {received_chunks}/{total_chunks} chunks for message {chunk_id}")
-
-    def reassemble_message(self, chunk_id):
-        """Reassemble a complete message from chunks"""
-        message_data = self.message_chunks[chunk_id]
-        from_node = message_data['from_node']
-        timestamp = message_data['timestamp']
-        
-        # Combine chunks in order
-        combined_data = ""
-        missing_chunks = []
-        
-        for i in range(1, message_data['total_chunks'] + 1):
-            if i in message_data['chunks']:
-                combined_data += message_data['chunks'][i]
-            else:
-                missing_chunks.append(i)
-        
-        if missing_chunks:
-            self.log(f"Missing chunks {missing_chunks} for message {chunk_id}, cannot reassemble")
+            self.log(f"Error updating statistics: {str(e)}")
+        finally:
+            self.master.after(self.stats_interval, self.refresh_stats)
+
+    def stats_summary(self):
+        """Two lines of counters and mean stage times for the stats panel"""
+        def total(name):
+            metric = self.metrics.get(name)
+            return sum(sample[2] for sample in metric.samples()) if metric is not None else 0
+        
+        traffic = (f"Sent {total('voice_packets_sent_total')} packets "
+                   f"({total('voice_bytes_sent_total') / 1024:.1f} KiB), "
+                   f"{total('voice_retransmissions_total')} retries, {total('voice_chunks_failed_total')} failed | "
+                   f"Received {total('voice_packets_received_total')} packets, "
+                   f"{total('voice_packets_dropped_total')} dropped | "
+                   f"Reassembling {total('voice_reassembly_messages')} "
+                   f"({total('voice_reassembly_bytes') / 1024:.1f} KiB)")
+        timings = []
+        for stage in metrics.STAGES:
+            timer = metrics.stage_timer(self.metrics, stage)
+            if timer.count:
+                timings.append(f"{stage} {timer.mean() * 1000:.1f}")
+        return traffic + "\nMean ms: " + (", ".join(timings) if timings else "-")
+
+    def check_stalled_messages(self):
+        """Periodically NACK binary messages that stopped receiving chunks"""
+        self.stall_check_job = None
+        if not self.is_connected:
             return
-        
         try:
-            # Decode the base64 data
-            voice_data = base64.b64decode(combined_data)
-            
-            # Decompress the data
-            decompressed_data = zlib.decompress(voice_data)
-            
-            # Save as WAV file
-            filename = f"voice_messages/received_{from_node}_{timestamp}.wav"
-            
-            # Create WAV file with the decompressed data
-            self.create_wav_from_compressed(decompressed_data, filename)
-            
-            self.log(f"Reassembled and saved voice message from {from_node}")
-            self.add_message_to_list(f"Voice from {from_node} at {timestamp}", filename)
-            
-            # Clean up
-            del self.message_chunks[chunk_id]
-            
-        except Exception as e:
-            self.log(f"Error reassembling message: {str(e)}")
-
-    def create_wav_from_compressed(self, compressed_data, filename):
-        """Create a WAV file from compressed audio data"""
-        try:
-            # Parse the header (first few bytes contain sample rate and other info)
-            header_size = struct.unpack('!B', compressed_data[0:1])[0]
-            header_data = compressed_data[1:1+header_size]
-            audio_data = compressed_data[1+header_size:]
-            
-            # Parse header
-            header_parts = header_data.split(b',')
-            sample_rate = int(header_parts[0])
-            channels = int(header_parts[1])
-            sample_width = int(header_parts[2])
-            
-            # Create WAV file
-            with wave.open(filename, 'wb') as wf:
-                wf.setnchannels(channels)
-                wf.setsampwidth(sample_width)
-                wf.setframerate(sample_rate)
-                wf.writeframes(audio_data)
-                
-            self.log(f"Created WAV file: {filename}")
-        except Exception as e:
-            self.log(f"Error creating WAV file: {str(e)}")
+            self.engine.check_stalled_messages()
+            
+            # Report dropped duplicates once per check instead of once per packet
+            dropped = self.engine.duplicates_dropped()
+            if dropped > self.duplicates_logged:
+                self.log(f"Dropped {dropped - self.duplicates_logged} duplicate packets ({dropped} in total)")
+                self.duplicates_logged = dropped
+            receive = self.engine.receive_stats()
+            if receive and receive['dropped'] > self.receive_drops_logged:
+                self.log(f"Receive queue full: dropped {receive['dropped'] - self.receive_drops_logged} packets "
+                         f"(peak {receive['peak']} waiting)")
+                self.receive_drops_logged = receive['dropped']
+        finally:
+            if self.is_connected:
+                self.stall_check_job = self.master.after(self.repair_check_interval, self.check_stalled_messages)
 
     def toggle_recording(self):
         """Toggle recording state"""
@@ -499,6 +576,12 @@ class MeshtasticVoiceMessenger:
             
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
             self.current_recording_path = f"voice_messages/recording_{timestamp}.wav"
+            self.current_recording = None
+            
+            # Optionally start sending before the recording is finished
+            self.streaming = False
+            if self.stream_send_var.get():
+                self.streaming = self.start_stream_send()
             
             self.recording = True
             self.record_button.config(text="Stop Recording")
@@ -514,18 +597,14 @@ class MeshtasticVoiceMessenger:
             self.status_var.set("Ready")
 
     def record_audio(self):
-        """Record audio to a WAV file"""
+        """Record audio into an in-memory buffer"""
         try:
             # Set sample rate based on quality setting
             quality = self.compression_quality_var.get()
-            if quality == "Ultra Low":
-                self.rate = 4000  # Increased from 2000 for better quality
-            elif quality == "Very Low":
-                self.rate = 8000  # Increased from 4000 for better quality
-            else:
-                self.rate = 11025  # Increased from 8000 for better quality
+            self.rate = codec.recording_rate(quality)
                 
-            stream = self.p.open(format=self.format,
+            audio = self.audio()
+            stream = audio.open(format=audio.get_format_from_width(self.sample_width),
                                 channels=self.channels,
                                 rate=self.rate,
                                 input=True,
@@ -533,41 +612,51 @@ class MeshtasticVoiceMessenger:
             
             self.log(f"Recording for {self.record_seconds} seconds at {self.rate}Hz...")
             
-            frames = []
+            # Blocks are copied once into a preallocated buffer and passed on as views
+            recording = recorder.RecordBuffer(self.record_seconds, self.rate, self.channels, self.sample_width)
+            encoder = None
+            if self.streaming:
+                encoder = codec.StreamEncoder(self.channels, self.sample_width, self.rate, quality,
+                                              segment_seconds=self.engine.stream_send['segment_seconds'])
             
             for i in range(0, int(self.rate / self.chunk * self.record_seconds)):
                 if not self.recording:
                     break
                 data = stream.read(self.chunk)
-                frames.append(data)
+                with self.record_timer.time():
+                    block = recording.write(data)
+                    if encoder is not None:
+                        self.engine.queue_stream_data(encoder.write(block))
             
             stream.stop_stream()
             stream.close()
             
+            if encoder is not None:
+                # Chunks already on air belong to the message even if it was stopped early
+                self.engine.finish_stream_send(encoder.flush())
+            
             if self.recording:  # Only save if we didn't manually stop
-                self.save_recording(frames)
+                self.save_recording(recording)
                 
-            self.master.after(0, self.recording_finished)
+            self.ui_updates.call(self.recording_finished)
             
         except Exception as e:
             self.log(f"Error during recording: {str(e)}")
-            self.master.after(0, self.recording_finished)
+            if self.streaming:
+                self.engine.abort_stream_send()
+            self.ui_updates.call(self.recording_finished)
 
-    def save_recording(self, frames):
-        """Save the recorded audio frames to a WAV file"""
-        try:
-            wf = wave.open(self.current_recording_path, 'wb')
-            wf.setnchannels(self.channels)
-            wf.setsampwidth(self.p.get_sample_size(self.format))
-            wf.setframerate(self.rate)
-            wf.writeframes(b''.join(frames))
-            wf.close()
-            
-            self.log(f"Recording saved to {self.current_recording_path}")
-            self.add_message_to_list(f"Recording at {datetime.now().strftime('%H:%M:%S')}", self.current_recording_path)
-            
-        except Exception as e:
-            self.log(f"Error saving recording: {str(e)}")
+    def save_recording(self, recording):
+        """Keep the recording for sending and archive it to a WAV file in the background"""
+        self.current_recording = recording
+        description = f"Recording at {datetime.now().strftime('%H:%M:%S')}"
+
+        def saved(path):
+            self.log(f"Recording saved to {path}")
+            self.add_message_to_list(description, path)
+
+        recorder.save_async(recording, self.current_recording_path, on_saved=saved,
+                            on_error=lambda e: self.log(f"Error saving recording: {str(e)}"))
 
     def recording_finished(self):
         """Update UI after recording is finished"""
@@ -575,16 +664,42 @@ class MeshtasticVoiceMessenger:
         self.record_button.config(text="Record Voice Message")
         self.status_var.set("Ready")
         self.send_button.config(state=tk.NORMAL)
+        self.pre_encode()
 
     def stop_recording(self):
         """Stop the current recording"""
         self.recording = False
         self.log("Recording stopped manually")
 
-    def add_message_to_list(self, description, filepath):
-        """Add a voice message to the list"""
-        self.voice_messages.append({"description": description, "filepath": filepath})
-        self.messages_list.insert(tk.END, description)
+    def add_message_to_list(self, description, filepath, live=None):
+        """Add a voice message to the list and return its entry (safe from any thread)"""
+        entry = {"description": description, "filepath": filepath, "live": live}
+        self.ui_updates.call(self.insert_message, entry)
+        return entry
+
+    def insert_message(self, entry):
+        """Insert a message into the list widget; main loop only"""
+        self.voice_messages.append(entry)
+        self.messages_list.insert(tk.END, entry["description"])
+
+    def update_message_entry(self, entry, description, filepath=None):
+        """Change the text (and file) of a list entry, e.g. a live message (safe from any thread)"""
+        self.ui_updates.call(self.refresh_message, entry, description, filepath)
+
+    def refresh_message(self, entry, description, filepath):
+        """Redraw a list entry; main loop only"""
+        entry["description"] = description
+        if filepath:
+            entry["filepath"] = filepath
+        for index, other in enumerate(self.voice_messages):
+            if other is entry:
+                selected = index in self.messages_list.curselection()
+                self.messages_list.delete(index)
+                self.messages_list.insert(index, description)
+                if selected:
+                    self.messages_list.selection_set(index)
+                    self.on_message_select(None)
+                break
 
     def on_message_select(self, event):
         """Handle message selection from the list"""
@@ -594,8 +709,8 @@ class MeshtasticVoiceMessenger:
             if index < 0 or index >= len(self.voice_messages):
                 return
                 
-            filepath = self.voice_messages[index]["filepath"]
-            if filepath:
+            entry = self.voice_messages[index]
+            if entry["filepath"] or entry.get("live"):
                 self.play_button.config(state=tk.NORMAL)
                 self.stop_button.config(state=tk.NORMAL)
             else:
@@ -612,8 +727,14 @@ class MeshtasticVoiceMessenger:
         if index < 0 or index >= len(self.voice_messages):
             return
             
-        filepath = self.voice_messages[index]["filepath"]
+        entry = self.voice_messages[index]
+        filepath = entry["filepath"]
         if not filepath:
+            if entry.get("live"):
+                # Still arriving: play what has been decoded and follow along
+                self.playing = True
+                self.status_var.set("Playing (live)...")
+                threading.Thread(target=self.play_live_audio, args=(entry["live"],), daemon=True).start()
             return
             
         if not os.path.exists(filepath):
@@ -631,7 +752,8 @@ class MeshtasticVoiceMessenger:
         try:
             wf = wave.open(filepath, 'rb')
             
-            stream = self.p.open(format=self.p.get_format_from_width(wf.getsampwidth()),
+            audio = self.audio()
+            stream = audio.open(format=audio.get_format_from_width(wf.getsampwidth()),
                                 channels=wf.getnchannels(),
                                 rate=wf.getframerate(),
                                 output=True)
@@ -645,11 +767,44 @@ class MeshtasticVoiceMessenger:
             stream.stop_stream()
             stream.close()
             
-            self.master.after(0, self.playback_finished)
+            self.ui_updates.call(self.playback_finished)
             
         except Exception as e:
             self.log(f"Error during playback: {str(e)}")
-            self.master.after(0, self.playback_finished)
+            self.ui_updates.call(self.playback_finished)
+
+    def play_live_audio(self, live):
+        """Play a message's decoded audio while later segments are still arriving"""
+        try:
+            params = live.params
+            audio = self.audio()
+            stream = audio.open(format=audio.get_format_from_width(params.sample_width),
+                                channels=params.channels,
+                                rate=params.sample_rate,
+                                output=True)
+            
+            block = self.chunk * params.channels * params.sample_width
+            offset = 0
+            while self.playing:
+                data = live.read(offset)
+                if not data:
+                    if live.finished:
+                        break
+                    continue  # Waiting for the next segment
+                for start in range(0, len(data), block):
+                    if not self.playing:
+                        break
+                    stream.write(data[start:start + block])
+                    offset += len(data[start:start + block])
+            
+            stream.stop_stream()
+            stream.close()
+            
+            self.ui_updates.call(self.playback_finished)
+            
+        except Exception as e:
+            self.log(f"Error during live playback: {str(e)}")
+            self.ui_updates.call(self.playback_finished)
 
     def playback_finished(self):
         """Update UI after playback is finished"""
@@ -661,120 +816,24 @@ class MeshtasticVoiceMessenger:
         self.playing = False
         self.log("Playback stopped")
 
-    def ultra_compress_audio(self, wav_path):
-        """Ultra compress audio file for transmission"""
-        try:
-            # Read WAV file
-            with wave.open(wav_path, 'rb') as wf:
-                # Get WAV file parameters
-                channels = wf.getnchannels()
-                sample_width = wf.getsampwidth()
-                sample_rate = wf.getframerate()
-                frames = wf.readframes(wf.getnframes())
-            
-            # Get quality setting
-            quality = self.compression_quality_var.get()
-            target_rate = 4000  # Default ultra low - increased from 2000
-            
-            if quality == "Very Low":
-                target_rate = 8000  # Increased from 4000
-            elif quality == "Low":
-                target_rate = 11025  # Increased from 8000
-            
-            # Downsample audio if needed (reduce sample rate)
-            if sample_rate > target_rate:
-                frames, sample_rate = self.downsample_audio(frames, channels, sample_width, sample_rate, target_rate)
-            
-            # Reduce bit depth only for Ultra Low quality
-            if quality == "Ultra Low" and sample_width > 1:
-                frames = audioop.lin2lin(frames, sample_width, 1)  # Convert to 8-bit
-                sample_width = 1
-            
-            # Apply amplitude compression (reduce dynamic range) - less aggressive now
-            if quality == "Ultra Low":
-                frames = self.compress_dynamic_range(frames, sample_width, 0.6, 0.7)  # Less compression
-            elif quality == "Very Low":
-                frames = self.compress_dynamic_range(frames, sample_width, 0.7, 0.8)  # Even less compression
-            
-            # Create a header with audio parameters
-            header = f"{sample_rate},{channels},{sample_width}".encode()
-            header_size = len(header)
-            
-            # Prepend header size (1 byte) and header to the audio data
-            data_with_header = struct.pack('!B', header_size) + header + frames
-            
-            # Compress the data with zlib at maximum compression
-            compressed_data = zlib.compress(data_with_header, 9)
-            
-            # Log compression stats
-            original_size = len(frames)
-            compressed_size = len(compressed_data)
-            compression_ratio = original_size / compressed_size if compressed_size > 0 else 0
-            
-            self.log(f"Compressed audio: {original_size} bytes -> {compressed_size} bytes (ratio: {compression_ratio:.2f}x)")
-            return compressed_data
-            
-        except Exception as e:
-            self.log(f"Error compressing audio: {str(e)}")
-            return None
+    def encode_options(self):
+        """(quality, segment_seconds, trim_silence) from the current settings; main loop only"""
+        segment_seconds = codec.SEGMENT_SECONDS if self.progressive_var.get() else None
+        return self.compression_quality_var.get(), segment_seconds, self.trim_silence_var.get()
 
-    def compress_dynamic_range(self, frames, sample_width, threshold=0.6, ratio=0.7):
-        """Compress the dynamic range of audio to make it more compressible"""
-        try:
-            # Convert to numpy array for processing
-            if sample_width == 1:
-                # 8-bit audio is unsigned
-                audio_array = np.frombuffer(frames, dtype=np.uint8)
-                # Convert to signed for processing
-                audio_array = audio_array.astype(np.int16) - 128
-            else:
-                # 16-bit audio is signed
-                audio_array = np.frombuffer(frames, dtype=np.int16)
-            
-            # Apply simple compression (reduce dynamic range)
-            # This makes quiet sounds louder and loud sounds quieter
-            # Using less aggressive settings now
-            
-            # Normalize to -1.0 to 1.0 range
-            max_val = 32768 if sample_width == 2 else 128
-            normalized = audio_array.astype(np.float32) / max_val
-            
-            # Apply compression
-            compressed = np.zeros_like(normalized)
-            for i in range(len(normalized)):
-                if abs(normalized[i]) > threshold:
-                    if normalized[i] > 0:
-                        compressed[i] = threshold + (normalized[i] - threshold) * ratio
-                    else:
-                        compressed[i] = -threshold + (normalized[i] + threshold) * ratio
-                else:
-                    compressed[i] = normalized[i]
-            
-            # Convert back to original format
-            if sample_width == 1:
-                # Convert back to unsigned 8-bit
-                result = (compressed * 128 + 128).astype(np.uint8).tobytes()
-            else:
-                # Convert back to signed 16-bit
-                result = (compressed * 32768).astype(np.int16).tobytes()
-            
-            return result
-            
-        except Exception as e:
-            self.log(f"Error compressing dynamic range: {str(e)}")
-            return frames  # Return original frames if there's an error
+    def pre_encode(self, event=None):
+        """Start encoding the last recording with the current settings in the background"""
+        if self.current_recording is not None:
+            self.ultra_compress_audio(self.current_recording)
 
-    def downsample_audio(self, frames, channels, sample_width, original_rate, target_rate):
-        """Downsample audio to a lower sample rate"""
-        try:
-            # Use audioop to downsample
-            downsampled_frames = audioop.ratecv(frames, sample_width, channels, 
-                                               original_rate, target_rate, None)[0]
-            
-            return downsampled_frames, target_rate
-        except Exception as e:
-            self.log(f"Error downsampling audio: {str(e)}")
-            return frames, original_rate
+    def ultra_compress_audio(self, recording):
+        """Ultra compress a recording for transmission, returning a Future of the payload
+
+        Resample, reduce bit depth and dynamic range, then add the binary
+        header, on the encode worker. A payload already encoded with the same
+        settings comes straight from the cache.
+        """
+        return self.encode_cache.submit(recording, *self.encode_options())
 
     def send_test_message(self):
         """Send a simple test message to verify connectivity"""
@@ -783,25 +842,8 @@ class MeshtasticVoiceMessenger:
             return
             
         try:
-            # Create a simple test message
-            test_payload = {
-                "test": f"Test message from {self.interface.getLongName() or 'unknown'} at {datetime.now().strftime('%H:%M:%S')}"
-            }
-            
-            # Convert to JSON string then to bytes
-            json_payload = json.dumps(test_payload).encode('utf-8')
-            
-            # Send the message
-            self.log(f"Sending test message: {test_payload['test']}")
-            self.log(f"Payload size: {len(json_payload)} bytes")
-            
-            self.interface.sendData(
-                json_payload,
-                destinationId=meshtastic.BROADCAST_ADDR,
-                portNum=256,  # PRIVATE_APP port
-                wantAck=True
-            )
-            self.log("Test message sent successfully")
+            # Send a simple test message
+            self.engine.send_test_message(f"Test message from {self.interface.getLongName() or 'unknown'} at {datetime.now().strftime('%H:%M:%S')}")
             
         except Exception as e:
             self.log(f"Error sending test message: {str(e)}")
@@ -813,88 +855,55 @@ class MeshtasticVoiceMessenger:
             messagebox.showerror("Error", "Not connected to Meshtastic device")
             return
             
-        if not self.current_recording_path or not os.path.exists(self.current_recording_path):
+        if self.current_recording is None:
             messagebox.showerror("Error", "No recording available to send")
             return
             
-        if self.sending_chunks:
-            messagebox.showinfo("Info", "Already sending a voice message")
-            return
-            
         try:
-            self.cancel_send_event.clear()
-
-            # Update chunk size from dropdown
+            # Update chunk size and FEC from the dropdowns
             self.update_chunk_size()
+            self.update_fec_overhead()
             
-            # Ultra compress the audio file
-            compressed_data = self.ultra_compress_audio(self.current_recording_path)
-            if not compressed_data:
-                messagebox.showerror("Error", "Failed to compress audio")
-                return
-                
-            # Encode as base64
-            encoded_data = base64.b64encode(compressed_data).decode('utf-8')
-            
-            # Check if we need to chunk the message
-            if len(encoded_data) <= self.max_chunk_size:
-                # Small enough to send in one message
-                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                payload = {
-                    "voice_data": encoded_data,
-                    "timestamp": timestamp
-                }
-                
-                # Convert to JSON string then to bytes
-                json_payload = json.dumps(payload).encode('utf-8')
-                
-                # Log the size
-                self.log(f"Voice message size: {len(json_payload)} bytes")
-                
-                self.stop_send_button.config(state=tk.NORMAL)
-
-                # Send the message
-                self.log("Sending voice message...")
-                self.interface.sendData(
-                    json_payload,
-                    destinationId=meshtastic.BROADCAST_ADDR,
-                    portNum=256,  # PRIVATE_APP port
-                    wantAck=True
-                )
-                self.log("Voice message sent successfully")
-                self.stop_send_button.config(state=tk.DISABLED)
-                
-            else:
-                # Need to chunk the message
-                self.log(f"Message too large ({len(encoded_data)} bytes), splitting into chunks")
-                self.send_chunked_message(encoded_data)
-                
+            # Usually already encoded in the background; otherwise send once the encode is done
             self.send_button.config(state=tk.DISABLED)
+            recording = self.current_recording
+            future = self.ultra_compress_audio(recording)
+            if future.done():
+                self.send_encoded(recording, future)
+            else:
+                self.status_var.set("Encoding...")
+                future.add_done_callback(lambda f: self.ui_updates.call(self.send_encoded, recording, f))
             
         except Exception as e:
             self.log(f"Error sending voice message: {str(e)}")
-            self.stop_send_button.config(state=tk.DISABLED)
+            self.send_button.config(state=tk.NORMAL)
             messagebox.showerror("Error", f"Failed to send voice message: {str(e)}")
-            self.sending_chunks = False
 
-    def send_chunked_message(self, encoded_data):
-        """Split a large message into chunks and send them sequentially"""
-        # Generate a unique ID for this chunked message
-        chunk_id = str(uuid.uuid4())[:8]
-        
-        # Calculate how many chunks we need
-        total_chunks = math.ceil(len(encoded_data) / self.max_chunk_size)
-        
-        self.log(f"Splitting message into {total_chunks} chunks (size: {self.max_chunk_size} bytes)")
+    def send_encoded(self, recording, future):
+        """Send an encoded recording; main loop only"""
+        self.status_var.set("Ready")
+        self.send_button.config(state=tk.NORMAL)
+        try:
+            compressed_data = future.result()
+        except Exception as e:
+            self.log(f"Error compressing audio: {str(e)}")
+            messagebox.showerror("Error", "Failed to compress audio")
+            return
         
-        # Set flag to prevent multiple sends at once
-        self.sending_chunks = True
-        self.stop_send_button.config(state=tk.NORMAL)
+        # Log compression stats
+        original_size = recording.length
+        compressed_size = len(compressed_data)
+        compression_ratio = original_size / compressed_size if compressed_size > 0 else 0
+        self.log(f"Compressed audio: {original_size} bytes -> {compressed_size} bytes (ratio: {compression_ratio:.2f}x)")
         
-        # Start sending chunks in a separate thread
-        threading.Thread(target=self.send_chunks_thread, 
-                        args=(chunk_id, encoded_data, total_chunks),
-                        daemon=True).start()
+        try:
+            # Queued behind any voice messages already being sent; they take turns chunk by chunk
+            self.engine.send_payload(compressed_data)
+            self.stop_send_button.config(state=tk.NORMAL)
+            
+        except Exception as e:
+            self.log(f"Error sending voice message: {str(e)}")
+            messagebox.showerror("Error", f"Failed to send voice message: {str(e)}")
         
 #     def send_chunks_thread(self, chunk_id, encoded_data, total_chunks):
 #         """Send chunks of a message sequentially with retries"""
@@ -953,89 +962,38 @@ class MeshtasticVoiceMessenger:
 #             self.sending_chunks = False
 #             self.master.after(0, lambda: self.send_button.config(state=tk.NORMAL))
 
-    def send_chunks_thread(self, chunk_id, encoded_data, total_chunks):
-        """Send chunks of a message sequentially with retries"""
-        try:
-            for i in range(total_chunks):
-                # Check for cancellation before preparing each chunk
-                if self.cancel_send_event.is_set():
-                    self.log("Send cancelled by user.")
-                    break
-
-                start = i * self.max_chunk_size
-                end = min(start + self.max_chunk_size, len(encoded_data))
-                chunk_data = encoded_data[start:end]
-
-                payload = {
-                    "chunk_id": chunk_id,
-                    "chunk_num": i + 1,
-                    "total_chunks": total_chunks,
-                    "data": chunk_data
-                }
-                json_payload = json.dumps(payload).encode('utf-8')
-
-                success = False
-                for retry in range(self.chunk_retry_count):
-                    if self.cancel_send_event.is_set():
-                        self.log("Send cancelled during retry loop.")
-                        break
-                    try:
-                        self.log(f"Sending chunk {i+1}/{total_chunks}...")
-                        self.interface.sendData(
-                            json_payload,
-                            destinationId=meshtastic.BROADCAST_ADDR,
-                            portNum=256,
-                            wantAck=True
-                        )
-                        success = True
-                        break
-                    except Exception as e:
-                        self.log(f"Error sending chunk {i+1}, retry {retry+1}: {str(e)}")
-                        time.sleep(self.chunk_retry_delay)
-
-                if self.cancel_send_event.is_set():
-                    break
-
-                if not success:
-                    self.log(f"Failed to send chunk {i+1} after {self.chunk_retry_count} retries")
-                    # Optional: continue or abort; here we continue to try later chunks
-
-                # Throttle between chunks (also abortable)
-                for _ in range(10):  # 1s sleep in 0.1s steps, so we can cancel quickly
-                    if self.cancel_send_event.is_set():
-                        break
-                    time.sleep(0.1)
-                if self.cancel_send_event.is_set():
-                    break
-
-            if not self.cancel_send_event.is_set():
-                self.log(f"All {total_chunks} chunks sent")
-
-        except Exception as e:
-            self.log(f"Error sending chunks: {str(e)}")
-        finally:
-            self.sending_chunks = False
-            # Ensure UI is cleaned up no matter what
-            self.master.after(0, lambda: (
-                self.send_button.config(state=tk.NORMAL),
-                self.stop_send_button.config(state=tk.DISABLED)
-            ))
+    def start_stream_send(self):
+        """Queue a message whose chunks are transmitted while they are recorded"""
+        if not self.is_connected:
+            self.log("Not connected, recording without sending")
+            return False
+        
+        self.update_chunk_size()
+        self.update_fec_overhead()
+        segment_seconds = codec.SEGMENT_SECONDS if self.progressive_var.get() else None
+        if not self.engine.start_stream_send(segment_seconds):
+            return False
+        self.stop_send_button.config(state=tk.NORMAL)
+        return True
 
+    def send_finished(self, message_id, stats):
+        """Disable Stop Sending once no voice message is left to send (safe from any thread)"""
+        self.ui_updates.call(lambda: self.engine.sending() or self.stop_send_button.config(state=tk.DISABLED))
 
     def stop_sending(self):
-        """Request cancellation of an in-progress send."""
-        if self.sending_chunks:
-            self.log("Cancelling send...")
-            self.cancel_send_event.set()
-        else:
-            # Not chunking; nothing to cancel
-            self.log("No chunked send in progress.")
+        """Cancel every queued and in-progress voice message"""
+        self.engine.stop_sending()
         # UI cleanup regardless
         self.stop_send_button.config(state=tk.DISABLED)
 
 def main():
+    parser = argparse.ArgumentParser(description="Meshtastic Voice Messenger")
+    parser.add_argument("--profile", metavar="DIR",
+                        help=f"profile the encode, send and receive paths into DIR (or set {profiling.ENV_VAR})")
+    args = parser.parse_args()
+    
     root = tk.Tk()
-    app = MeshtasticVoiceMessenger(root)
+    app = MeshtasticVoiceMessenger(root, profile_dir=args.profile)
     root.mainloop()
 
 if __name__ == "__main__":
@@ -0,0 +1,49 @@
+"""Send latency with background pre-encoding and the payload cache
+
+For each quality a 30 s recording is sent three ways:
+- cold: encoded when Send is pressed (the old behaviour)
+- pre-encoded: Send is pressed after the background encode has finished
+- resend: the same recording sent again, e.g. after changing chunk size
+
+"send ms" is the time from pressing Send until the payload is available.
+The hit and encode counts show that only the first request encoded.
+
+Run from the repository root:
+    python benchmarks/bench_cache.py
+"""
+import time
+
+import common
+import codec
+import encodecache
+import recorder
+
+SECONDS = 30
+
+
+def send_latency(fn):
+    start = time.perf_counter()
+    fn()
+    return (time.perf_counter() - start) * 1000
+
+
+def main():
+    print(f"{SECONDS} s recordings")
+    print(f"{'quality':<10} {'cold ms':>8} {'pre-encoded ms':>15} {'resend ms':>10} {'hits':>5} {'encodes':>8}")
+    for quality in codec.QUALITY_PRESETS:
+        rate = codec.recording_rate(quality)
+        recording = recorder.RecordBuffer(SECONDS, rate, 1, 2)
+        recording.write(common.synthetic_speech(SECONDS, rate).tobytes())
+
+        cold = send_latency(lambda: encodecache.EncodeCache().get(recording, quality))
+
+        cache = encodecache.EncodeCache()
+        cache.submit(recording, quality).result()  # Background encode when recording stops
+        pre_encoded = send_latency(lambda: cache.get(recording, quality))
+        resend = send_latency(lambda: cache.get(recording, quality))
+        cache.close()
+        print(f"{quality:<10} {cold:>8.2f} {pre_encoded:>15.3f} {resend:>10.3f} {cache.hits:>5} {cache.misses:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""Codec benchmark: every quality preset over a speech corpus
+
+Each WAV file in the corpus (or a set of synthetic clips when no corpus is
+given) is encoded and decoded with every preset. Reported per preset:
+- encode and decode time per second of audio
+- payload bytes and packets ("Medium" chunks) per second of audio
+- peak traced memory of one encode plus decode
+- SNR and segmental SNR of the decoded audio against the input, resampled
+  to the decoded rate (waveform metrics, so the parametric Vocoder scores
+  near or below 0 dB even when it is intelligible)
+
+With --json the results are also written as JSON, together with the commit
+and library versions, so runs from different versions can be compared.
+
+Run from the repository root:
+    python benchmarks/bench_codec.py [--corpus DIR] [--json results.json]
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import wave
+
+import numpy as np
+
+import common
+import codec
+import pcm
+import wire
+
+FRAME_SIZE = 180  # "Medium" chunks
+SYNTHETIC_CLIPS = 4
+SYNTHETIC_SECONDS = 5
+SYNTHETIC_RATE = 16000
+SEGMENT_MS = 20  # Segmental SNR frame length
+MAX_SNR = 100.0  # Reported for lossless output
+
+
+def load_corpus(directory):
+    """Return [(name, frames, channels, sample_width, sample_rate)] for the WAV files in a directory"""
+    clips = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.wav"))):
+        with wave.open(path, 'rb') as wf:
+            clips.append((os.path.basename(path), wf.readframes(wf.getnframes()),
+                          wf.getnchannels(), wf.getsampwidth(), wf.getframerate()))
+    return clips
+
+
+def synthetic_corpus():
+    """Synthetic 16-bit mono clips with a different seed each"""
+    return [(f"synthetic-{seed}", common.synthetic_speech(SYNTHETIC_SECONDS, SYNTHETIC_RATE, seed).tobytes(),
+             1, 2, SYNTHETIC_RATE) for seed in range(SYNTHETIC_CLIPS)]
+
+
+def to_mono(frames, channels, sample_width, sample_rate, target_rate):
+    """Input PCM as mono float samples on the int16 scale at `target_rate`"""
+    samples = pcm.to_float(frames, sample_width, channels).mean(axis=1) * 2 ** (16 - 8 * sample_width)
+    if sample_rate != target_rate:
+        resampler = pcm.Resampler(sample_rate, target_rate)
+        samples = np.concatenate((resampler.process(samples), resampler.flush()))[:, 0]
+    return samples.astype(np.float64)
+
+
+def snr(reference, decoded):
+    """Signal-to-noise ratio in dB"""
+    noise = np.sum((reference - decoded) ** 2)
+    if noise == 0:
+        return MAX_SNR
+    return min(MAX_SNR, 10 * np.log10(np.sum(reference ** 2) / noise))
+
+
+def segmental_snr(reference, decoded, rate):
+    """Mean per-frame SNR in dB, each frame clamped to [-10, 35] dB"""
+    size = max(1, rate * SEGMENT_MS // 1000)
+    count = len(reference) // size
+    if count == 0:
+        return snr(reference, decoded)
+    ref = reference[:count * size].reshape(count, size)
+    err = ref - decoded[:count * size].reshape(count, size)
+    energy = np.sum(ref ** 2, axis=1)
+    noise = np.maximum(np.sum(err ** 2, axis=1), 1e-9)
+    frames = 10 * np.log10(np.maximum(energy, 1e-9) / noise)
+    # Skip silent frames, whose SNR says nothing about quality
+    active = energy > 1e-4 * energy.max() if energy.max() > 0 else np.ones(count, dtype=bool)
+    return float(np.mean(np.clip(frames[active], -10, 35)))
+
+
+def measure(clip, quality):
+    """Encode and decode one clip, returning its measurements"""
+    name, frames, channels, width, rate = clip
+    seconds = len(frames) / (channels * width * rate)
+
+    encode_time, payload = common.timed(lambda: codec.encode_audio(frames, channels, width, rate, quality), repeat=3)
+    decode_time, (params, decoded) = common.timed(lambda: codec.decode_audio(payload), repeat=3)
+
+    tracemalloc.start()
+    codec.decode_audio(codec.encode_audio(frames, channels, width, rate, quality))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    output = to_mono(decoded, params.channels, params.sample_width, params.sample_rate, params.sample_rate)
+    reference = to_mono(frames, channels, width, rate, params.sample_rate)
+    length = min(len(reference), len(output))
+    reference, output = reference[:length], output[:length]
+    return {
+        "clip": name,
+        "seconds": seconds,
+        "encode_time": encode_time,
+        "decode_time": decode_time,
+        "bytes": len(payload),
+        "packets": len(wire.split_payload(0, payload, FRAME_SIZE)),
+        "peak_memory": peak,
+        "snr": float(snr(reference, output)),
+        "segsnr": segmental_snr(reference, output, params.sample_rate),
+    }
+
+
+def summarize(runs):
+    """Per-second-of-audio averages over the clips of one preset"""
+    seconds = sum(run["seconds"] for run in runs)
+    return {
+        "encode_ms_per_s": 1000 * sum(run["encode_time"] for run in runs) / seconds,
+        "decode_ms_per_s": 1000 * sum(run["decode_time"] for run in runs) / seconds,
+        "bytes_per_s": sum(run["bytes"] for run in runs) / seconds,
+        "packets_per_s": sum(run["packets"] for run in runs) / seconds,
+        "peak_memory": max(run["peak_memory"] for run in runs),
+        "snr": float(np.mean([run["snr"] for run in runs])),
+        "segsnr": float(np.mean([run["segsnr"] for run in runs])),
+    }
+
+
+def environment():
+    """Versions identifying this run"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=root, capture_output=True,
+                                text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {"commit": commit, "python": platform.python_version(), "numpy": np.__version__,
+            "time": time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", help="directory of WAV files (default: synthetic clips)")
+    parser.add_argument("--json", help="also write the results to this file ('-' for stdout only)")
+    args = parser.parse_args()
+
+    clips = load_corpus(args.corpus) if args.corpus else synthetic_corpus()
+    if not clips:
+        sys.exit(f"No WAV files in {args.corpus}")
+
+    results = {"environment": environment(), "frame_size": FRAME_SIZE,
+               "corpus": args.corpus or "synthetic", "presets": {}}
+    if args.json != "-":
+        print(f"{len(clips)} clips, {sum(len(c[1]) / (c[2] * c[3] * c[4]) for c in clips):.1f} s of audio, "
+              f"{FRAME_SIZE}-byte packets")
+        print(f"{'quality':<10} {'enc ms/s':>9} {'dec ms/s':>9} {'B/s':>8} {'pkt/s':>6} {'peak KiB':>9} "
+              f"{'SNR dB':>7} {'segSNR':>7}")
+    for quality in codec.QUALITY_PRESETS:
+        runs = [measure(clip, quality) for clip in clips]
+        summary = summarize(runs)
+        results["presets"][quality] = {"summary": summary, "clips": runs}
+        if args.json != "-":
+            print(f"{quality:<10} {summary['encode_ms_per_s']:>9.2f} {summary['decode_ms_per_s']:>9.2f} "
+                  f"{summary['bytes_per_s']:>8.0f} {summary['packets_per_s']:>6.2f} "
+                  f"{summary['peak_memory'] / 1024:>9.0f} {summary['snr']:>7.1f} {summary['segsnr']:>7.1f}")
+
+    if args.json == "-":
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    elif args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Duplicate suppression on receive
+
+A VoiceEngine sends a message over a SimMesh that delivers extra copies of
+packets (rebroadcasts) and loses some acks, so chunks are also resent. The
+receiver runs with the duplicate filters on, and with them disabled
+(capacity 0). Measured at the receiver: packets handed to on_receive, how
+many were dropped as duplicates, log lines written and time spent in
+on_receive per packet. Both must rebuild the message exactly once.
+
+A micro-benchmark then times the filter itself against parsing a frame.
+
+Run from the repository root:
+    python benchmarks/bench_dedupe.py [--duplicate 0.3] [--loss 0.05]
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+import common
+import codec
+import dedupe
+import engine
+import sender
+import simmesh
+import wire
+
+LATENCY = 0.01
+QUALITY = "ADPCM"
+SECONDS = 5
+TIMEOUT = 60
+
+
+def make_engine(mesh, output_dir, **callbacks):
+    node = engine.VoiceEngine(output_dir=output_dir, **callbacks)
+    node.interface = mesh.add_node(on_receive=node.on_receive)
+    node.send_rtt = sender.RttEstimator(initial_rto=20 * LATENCY, min_rto=8 * LATENCY)
+    node.chunk_retry_delay = 4 * LATENCY
+    return node
+
+
+def run(payload, duplicate, loss, enabled):
+    mesh = simmesh.SimMesh(loss=loss, latency=LATENCY, jitter=LATENCY, duplicate=duplicate, seed=1)
+    saved = []
+    logs = [0]
+    timing = {'packets': 0, 'seconds': 0.0}
+    sent = threading.Event()
+
+    def log(message):
+        logs[0] += 1
+
+    with tempfile.TemporaryDirectory() as directory:
+        source = make_engine(mesh, os.path.join(directory, "source"),
+                             on_send_finished=lambda message_id, stats: sent.set())
+        receiver = make_engine(mesh, os.path.join(directory, "receiver"), log=log,
+                               add_message=lambda description, filepath, live=None: saved.append(filepath))
+        if not enabled:
+            receiver.seen_packets = dedupe.DuplicateFilter(capacity=0)
+            receiver.seen_chunks = dedupe.DuplicateFilter(capacity=0)
+        handler = receiver.on_receive
+
+        def timed_receive(packet, interface=None):
+            start = time.perf_counter()
+            handler(packet, interface)
+            timing['seconds'] += time.perf_counter() - start
+            timing['packets'] += 1
+        receiver.interface.on_receive = timed_receive
+
+        source.send_payload(payload)
+        deadline = time.monotonic() + TIMEOUT
+        while not (saved and sent.is_set()) and time.monotonic() < deadline:
+            receiver.check_stalled_messages()
+            sent.wait(LATENCY * 10)
+        time.sleep(20 * LATENCY)  # Late copies
+        source.close()
+        receiver.close()
+        mesh.close()
+    return timing, receiver.duplicates_dropped(), logs[0], len(saved)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--duplicate", type=float, default=0.3, help="chance of an extra copy (default 0.3)")
+    parser.add_argument("--loss", type=float, default=0.05, help="per-hop packet loss (default 0.05)")
+    args = parser.parse_args()
+
+    rate = codec.recording_rate(QUALITY)
+    payload = codec.encode_audio(common.synthetic_speech(SECONDS, rate).tobytes(), 1, 2, rate, QUALITY)
+    print(f"{QUALITY} message of {len(payload)} bytes, {args.duplicate:.0%} duplicated, {args.loss:.0%} loss")
+    print(f"{'filter':<8} {'packets':>8} {'dropped':>8} {'log lines':>10} {'us/packet':>10} {'saved':>6}")
+    for name, enabled in (("off", False), ("on", True)):
+        timing, dropped, logs, saved = run(payload, args.duplicate, args.loss, enabled)
+        print(f"{name:<8} {timing['packets']:>8} {dropped:>8} {logs:>10} "
+              f"{timing['seconds'] * 1e6 / max(timing['packets'], 1):>10.1f} {saved:>6}")
+
+    frame = wire.split_payload(1, payload, 180)[3]
+    duplicates = dedupe.DuplicateFilter()
+    key = ("!00000001",) + wire.chunk_identity(frame)
+    duplicates.add(key)
+    check, _ = common.timed(lambda: [duplicates.check(("!00000001",) + wire.chunk_identity(frame))
+                                     for _ in range(10000)])
+    parse, _ = common.timed(lambda: [wire.unpack_frame(frame) for _ in range(10000)])
+    print(f"\nduplicate check {check * 1e6 / 10000:.2f} us, frame parse and CRC {parse * 1e6 / 10000:.2f} us")
+
+
+if __name__ == "__main__":
+    main()
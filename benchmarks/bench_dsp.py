@@ -0,0 +1,58 @@
+"""Micro-benchmark: per-sample compressor loop vs the vectorized DSP chain
+
+Run from the repository root:
+    python benchmarks/bench_dsp.py
+"""
+import numpy as np
+
+from common import synthetic_speech, timed
+import codec
+import dsp
+
+
+def reference_compress(frames, sample_width, threshold, ratio):
+    """The original per-sample implementation of compress_dynamic_range"""
+    if sample_width == 1:
+        audio_array = np.frombuffer(frames, dtype=np.uint8).astype(np.int16) - 128
+    else:
+        audio_array = np.frombuffer(frames, dtype=np.int16)
+    max_val = 32768 if sample_width == 2 else 128
+    normalized = audio_array.astype(np.float32) / max_val
+    compressed = np.zeros_like(normalized)
+    for i in range(len(normalized)):
+        if abs(normalized[i]) > threshold:
+            if normalized[i] > 0:
+                compressed[i] = threshold + (normalized[i] - threshold) * ratio
+            else:
+                compressed[i] = -threshold + (normalized[i] + threshold) * ratio
+        else:
+            compressed[i] = normalized[i]
+    if sample_width == 1:
+        return (compressed * 128 + 128).astype(np.uint8).tobytes()
+    return (compressed * 32768).astype(np.int16).tobytes()
+
+
+def main():
+    seconds = 30
+    # Only the presets that run the compressor, with their own settings
+    for quality, preset in codec.QUALITY_PRESETS.items():
+        if preset["threshold"] is None:
+            continue
+        rate, threshold, ratio = preset["rate"], preset["threshold"], preset["ratio"]
+        width = preset["width"] or 2
+        samples = synthetic_speech(seconds, rate)
+        if width == 1:
+            samples = dsp.BitDepthConverter(2, 1)(samples)
+        frames = samples.tobytes()
+
+        chain = dsp.dynamic_range_chain(width, threshold, ratio)
+        loop_time, expected = timed(lambda: reference_compress(frames, width, threshold, ratio))
+        vector_time, actual = timed(lambda: chain(dsp.pcm_to_array(frames, width)).tobytes(), repeat=5)
+
+        print(f"{quality:<10} {seconds}s @ {rate}Hz/{width * 8}bit: "
+              f"loop {loop_time * 1000:8.1f} ms  vectorized {vector_time * 1000:6.2f} ms  "
+              f"speedup {loop_time / vector_time:6.0f}x  identical={expected == actual}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""End-to-end transfer over a simulated mesh
+
+One sender and RECEIVERS receivers, each a VoiceEngine, share a SimMesh with
+packet loss, latency and jitter. The sender encodes a synthetic recording and
+sends it with the app's real code path (framing, windowed sender, NACK
+repairs); the benchmark waits until every receiver has written the WAV file.
+Mesh and engine timers are scaled down so a run takes seconds, so times are
+wall-clock at that scale. Airtime is also given as an estimate for the
+LongFast preset, from the bytes the mesh carried.
+
+Reported per quality x chunk size: success rate, mean time to deliver,
+packets and airtime bytes per message.
+
+Run from the repository root:
+    python benchmarks/bench_e2e.py [--loss 0.1] [--trials 3] [--quality Low]
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+import common
+import codec
+import engine
+import repair
+import sender
+import simmesh
+
+SECONDS = 5
+RECEIVERS = 2
+CHUNK_SIZES = {"Small": 150, "Medium": 180, "Large": 200}
+TIMEOUT = 30  # Seconds before a transfer counts as failed
+
+
+class Node:
+    """A VoiceEngine on the mesh with timers scaled for the simulator"""
+
+    def __init__(self, mesh, output_dir, latency):
+        self.delivered = threading.Event()
+        self.engine = engine.VoiceEngine(output_dir=output_dir,
+                                         add_message=self.on_message,
+                                         on_send_finished=lambda message_id, stats: None)
+        self.engine.interface = mesh.add_node(on_receive=self.engine.on_receive)
+        self.engine.send_rtt = sender.RttEstimator(initial_rto=20 * latency, min_rto=8 * latency)
+        self.engine.chunk_retry_delay = 4 * latency
+        self.engine.repair_requester = repair.RepairRequester(stall_timeout=20 * latency, max_backoff=4 * latency,
+                                                              suppress_window=20 * latency, max_requests=10)
+        self.engine.repair_responder = repair.RepairResponder(repair_holdoff=10 * latency)
+        self.engine.repair_coalesce_delay = 2 * latency
+
+    def on_message(self, description, filepath, live=None):
+        if filepath:
+            self.delivered.set()
+
+
+def transfer(payload, chunk_size, args, trial):
+    """Send one payload and return (seconds until all received or None, mesh stats)"""
+    mesh = simmesh.SimMesh(loss=args.loss, latency=args.latency, jitter=args.latency / 2, seed=trial)
+    with tempfile.TemporaryDirectory() as output_dir:
+        nodes = [Node(mesh, os.path.join(output_dir, str(i)), args.latency) for i in range(RECEIVERS + 1)]
+        source, receivers = nodes[0], nodes[1:]
+        source.engine.max_chunk_size = chunk_size
+
+        stop = threading.Event()
+
+        def check_stalls():
+            while not stop.wait(args.latency):
+                for node in receivers:
+                    node.engine.check_stalled_messages()
+
+        threading.Thread(target=check_stalls, daemon=True).start()
+        start = time.perf_counter()
+        source.engine.send_payload(payload)
+        deadline = start + TIMEOUT
+        elapsed = None
+        if all(node.delivered.wait(max(0, deadline - time.perf_counter())) for node in receivers):
+            elapsed = time.perf_counter() - start
+        stop.set()
+        for node in nodes:
+            node.engine.close()
+        mesh.close()
+    return elapsed, mesh.stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--loss", type=float, default=0.1, help="per-hop packet loss (default 0.1)")
+    parser.add_argument("--latency", type=float, default=0.02, help="per-hop latency in seconds (default 0.02)")
+    parser.add_argument("--trials", type=int, default=3)
+    parser.add_argument("--quality", action="append", help="quality preset (repeatable, default all)")
+    args = parser.parse_args()
+
+    print(f"{SECONDS} s message, {RECEIVERS} receivers, {args.loss:.0%} loss, {args.latency * 1000:.0f} ms latency, "
+          f"{args.trials} trials")
+    print(f"{'quality':<10} {'chunks':<7} {'bytes':>6} {'success':>8} {'deliver':>8} {'packets':>8} "
+          f"{'airtime B':>10} {'LongFast':>9}")
+    for quality in args.quality or codec.QUALITY_PRESETS:
+        rate = codec.recording_rate(quality)
+        samples = common.synthetic_speech(SECONDS, rate).tobytes()
+        payload = codec.encode_audio(samples, 1, 2, rate, quality)
+        for name, chunk_size in CHUNK_SIZES.items():
+            times = []
+            packets = airtime_bytes = airtime = 0
+            for trial in range(args.trials):
+                elapsed, stats = transfer(payload, chunk_size, args, trial)
+                if elapsed is not None:
+                    times.append(elapsed)
+                packets += stats.packets
+                airtime_bytes += stats.airtime_bytes
+                airtime += stats.airtime()
+            mean = f"{sum(times) / len(times):>7.2f}s" if times else f"{'-':>8}"
+            print(f"{quality:<10} {name:<7} {len(payload):>6} {len(times) / args.trials:>8.0%} {mean} "
+                  f"{packets / args.trials:>8.1f} {airtime_bytes / args.trials:>10.0f} "
+                  f"{airtime / args.trials:>8.0f}s")
+
+
+if __name__ == "__main__":
+    main()
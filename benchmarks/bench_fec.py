@@ -0,0 +1,77 @@
+"""FEC overhead vs simulated packet loss
+
+Sends a 5 s "Ultra Low" message through an i.i.d. lossy channel and resends
+the whole message until the receiver can rebuild it, as the app does today
+without repair. Reports first-pass delivery rate and average packets on air.
+
+Run from the repository root:
+    python benchmarks/bench_fec.py
+"""
+import random
+
+from common import synthetic_speech, timed
+import codec
+import fec
+import wire
+
+SECONDS = 5
+FRAME_SIZE = 150
+LOSS_RATES = (0.01, 0.05, 0.10, 0.20)
+TRIALS = 300
+MAX_ATTEMPTS = 50
+
+
+def delivered(frames, loss, rng, total, params):
+    """Simulate one pass over the channel; return True if the message decodes"""
+    received = {frame.seq for frame in frames if rng.random() >= loss}
+    if params is None:
+        return len(received) == total
+    return fec.is_decodable(received, total, params)
+
+
+def main():
+    recording = synthetic_speech(SECONDS, 11025).tobytes()
+    payload = codec.encode_audio(recording, 1, 2, 11025, "Ultra Low")
+    print(f"Payload {len(payload)} bytes, {FRAME_SIZE}-byte frames, {TRIALS} trials per cell")
+
+    rng = random.Random(42)
+    print(f"{'overhead':<9} {'frames':>6} {'encode':>9} {'decode':>9}  " +
+          "  ".join(f"loss {loss:>4.0%}: ok / pkts" for loss in LOSS_RATES))
+    for name, overhead in fec.OVERHEADS.items():
+        if overhead:
+            encode_time, packed = timed(lambda: fec.encode_frames(1, payload, FRAME_SIZE, overhead), repeat=3)
+        else:
+            encode_time, packed = timed(lambda: wire.split_payload(1, payload, FRAME_SIZE), repeat=3)
+        frames = [wire.unpack_frame(p) for p in packed]
+        total = frames[0].total
+        params = fec.parse_frame_payload(frames[0].payload)[0] if overhead else None
+
+        decode_time = 0.0
+        if params is not None:
+            # Worst case: drop as many data shards per block as there is parity
+            shards = {}
+            for frame in frames:
+                shards[frame.seq] = fec.parse_frame_payload(frame.payload)[1]
+            for block in fec.layout(total, params):
+                for seq in range(block.data_start, block.data_start + block.parity_count):
+                    shards.pop(seq, None)
+            decode_time, rebuilt = timed(lambda: fec.decode_payload(shards, total, params), repeat=3)
+            assert rebuilt == payload
+
+        cells = []
+        for loss in LOSS_RATES:
+            first_pass = 0
+            packets = 0
+            for _ in range(TRIALS):
+                for attempt in range(1, MAX_ATTEMPTS + 1):
+                    if delivered(frames, loss, rng, total, params):
+                        break
+                first_pass += attempt == 1
+                packets += attempt * len(frames)
+            cells.append(f"{first_pass / TRIALS:>10.0%} / {packets / TRIALS:5.0f}")
+        print(f"{name:<9} {len(frames):>6} {encode_time * 1000:7.1f}ms {decode_time * 1000:7.1f}ms  " +
+              "  ".join(cells))
+
+
+if __name__ == "__main__":
+    main()
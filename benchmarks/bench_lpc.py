@@ -0,0 +1,43 @@
+"""LPC vocoder: encode/decode speed, bitrate and a round-trip check
+
+Run from the repository root:
+    python benchmarks/bench_lpc.py
+"""
+import numpy as np
+
+from common import synthetic_speech, timed
+import codec
+import lpc
+import wire
+
+SECONDS = 10
+
+
+def main():
+    samples = synthetic_speech(SECONDS, lpc.SAMPLE_RATE)
+    print(f"{SECONDS}s of synthetic speech at {lpc.SAMPLE_RATE} Hz")
+    for frame_length in (180, 360):
+        encode_time, body = timed(lambda: lpc.encode(samples, frame_length), repeat=3)
+        decode_time, decoded = timed(lambda: lpc.decode(body), repeat=3)
+
+        # Round trip: same duration (rounded up to whole frames) and similar loudness
+        assert 0 <= len(decoded) - len(samples) < frame_length
+        level_in = np.sqrt(np.mean(samples.astype(np.float64) ** 2))
+        level_out = np.sqrt(np.mean(decoded[:len(samples)].astype(np.float64) ** 2))
+        assert abs(20 * np.log10(level_out / level_in)) < 3, (level_in, level_out)
+
+        packets = len(wire.split_payload(0, codec.AUDIO_HEADER.pack(0, 0, 0) + body, 150))
+        print(f"frame {frame_length:>3} ({lpc.bitrate(frame_length):.0f} bit/s): {len(body)} bytes, "
+              f"{packets} Small packets; encode {SECONDS / encode_time:5.0f}x realtime, "
+              f"decode {SECONDS / decode_time:5.0f}x realtime; level {level_out / level_in:.2f}x")
+
+    # Full codec path from a 11025 Hz recording, as the app sends it
+    recording = synthetic_speech(SECONDS, 11025).tobytes()
+    payload = codec.encode_audio(recording, 1, 2, 11025, "Vocoder")
+    params, frames = codec.decode_audio(payload)
+    assert params == codec.AudioParams(lpc.SAMPLE_RATE, 1, 2)
+    print(f"Vocoder preset: {len(payload)} byte payload, decoded {len(frames) // 2} samples at {params.sample_rate} Hz")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Metrics: cost of recording and exporting
+
+Times one counter increment and one histogram observation on values bound
+with labels() (how the engine records on hot paths), a labels() lookup
+done per call, and a Timer block. Then times receiving a whole message
+through a VoiceEngine, whose registry records every packet, against the
+same work with the recording calls replaced by no-ops, and renders the
+resulting registry as Prometheus text.
+
+Run from the repository root:
+    python benchmarks/bench_metrics.py
+"""
+import tempfile
+
+import common
+import codec
+import engine
+import metrics
+import wire
+
+N = 100000
+QUALITY = "ADPCM"
+SECONDS = 10
+FRAME_SIZE = 180
+
+
+class NullValue:
+    """Stands in for a counter or histogram value that records nothing"""
+
+    def inc(self, amount=1):
+        pass
+
+    def observe(self, value):
+        pass
+
+    def time(self):
+        return NullTimer()
+
+
+class NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+def micro():
+    registry = metrics.Registry()
+    counter = registry.counter("bench_total", "Benchmark counter", ("kind",))
+    histogram = registry.histogram("bench_seconds", "Benchmark histogram", ("stage",))
+    bound = counter.labels("bound")
+    stage = histogram.labels("stage")
+
+    def labelled():
+        for _ in range(N):
+            counter.labels("lookup").inc()
+
+    def timed_block():
+        for _ in range(N):
+            with stage.time():
+                pass
+
+    for name, fn in (("counter inc (bound)", lambda: [bound.inc() for _ in range(N)]),
+                     ("counter labels().inc", labelled),
+                     ("histogram observe", lambda: [stage.observe(0.003) for _ in range(N)]),
+                     ("timer block", timed_block),
+                     ("empty loop", lambda: [None for _ in range(N)])):
+        best, _ = common.timed(fn, repeat=5)
+        print(f"{name:<22} {best * 1e9 / N:>8.0f} ns")
+
+
+def packets(payload):
+    for index, frame in enumerate(wire.split_payload(1, payload, FRAME_SIZE)):
+        yield {'id': index + 1, 'from': 1, 'fromId': "!00000001",
+               'decoded': {'portnum': 'PRIVATE_APP', 'payload': frame}}
+
+
+def receive(payload, enabled):
+    with tempfile.TemporaryDirectory() as directory:
+        node = engine.VoiceEngine(output_dir=directory)
+        if not enabled:
+            node.stage_timers = {stage: NullValue() for stage in node.stage_timers}
+            node.packets_received = node.bytes_received = NullValue()
+        for packet in packets(payload):
+            node.on_receive(packet)
+        node.close()
+    return node.metrics
+
+
+def main():
+    micro()
+
+    rate = codec.recording_rate(QUALITY)
+    payload = codec.encode_audio(common.synthetic_speech(SECONDS, rate).tobytes(), 1, 2, rate, QUALITY)
+    count = sum(1 for _ in packets(payload))
+    print(f"\nReceiving a {SECONDS} s {QUALITY} message, {count} packets")
+    for name, enabled in (("no-op metrics", False), ("metrics", True)):
+        best, registry = common.timed(lambda: receive(payload, enabled), repeat=3)
+        print(f"{name:<22} {best * 1000:>8.2f} ms")
+    best, text = common.timed(registry.render, repeat=10)
+    print(f"render                 {best * 1000:>8.2f} ms, {len(text.splitlines())} lines, {len(text)} bytes")
+
+
+if __name__ == "__main__":
+    main()
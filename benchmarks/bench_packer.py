@@ -0,0 +1,169 @@
+"""Packet budget: packets on air with and without filling spare room
+
+A VoiceEngine sends over a lossless SimMesh (timers scaled like bench_e2e)
+for every chunk size of the app plus "Max" (the mesh's DATA_PAYLOAD_LEN):
+- voice: one encoded message
+- stream: the same payload sent while recording, ending with an END frame
+- voice+test: the message and a test message queued together
+
+Reported: packets on air and mean packet fill (payload bytes over packets
+times the limit), with packing off (one frame per packet) and on (small
+frames ride in the room left by others, as one bundle). The receiver must
+get the voice message and the test message every time.
+
+A single transfer leaves little to pack, at most its last chunk and a
+small frame. The group scenario is where small frames pile up: GROUP
+senders talk at once over a lossy mesh (repair timers scaled like
+bench_e2e), so the receiver NACKs several stalled messages per poll. It
+reports NACK frames, the packets they took and all packets on air,
+averaged over TRIALS seeds.
+
+Run from the repository root:
+    python benchmarks/bench_packer.py
+"""
+import os
+import tempfile
+import threading
+import time
+
+import common
+import codec
+import engine
+import packer
+import repair
+import sender
+import simmesh
+
+LATENCY = 0.01
+QUALITY = "ADPCM"
+SECONDS = 5
+TIMEOUT = 30
+CHUNK_SIZES = {"Small": 150, "Medium": 180, "Large": 200, "Max": packer.DEFAULT_MAX_PAYLOAD}
+GROUP = 6  # Senders talking at once in the group scenario
+GROUP_LOSS = 0.2
+TRIALS = 3
+
+
+def make_engine(mesh, output_dir, **callbacks):
+    node = engine.VoiceEngine(output_dir=output_dir, **callbacks)
+    node.interface = mesh.add_node(on_receive=node.on_receive)
+    node.send_rtt = sender.RttEstimator(initial_rto=20 * LATENCY, min_rto=8 * LATENCY)
+    node.chunk_retry_delay = 4 * LATENCY
+    return node
+
+
+def run(scenario, payload, chunk_size, pack):
+    """Packets and payload bytes on air until the receiver has everything, or None on timeout"""
+    mesh = simmesh.SimMesh(latency=LATENCY, seed=1)
+    voice, test = threading.Event(), threading.Event()
+
+    def on_message(description, filepath, live=None):
+        if filepath:
+            voice.set()
+
+    with tempfile.TemporaryDirectory() as directory:
+        source = make_engine(mesh, os.path.join(directory, "source"))
+        receiver = make_engine(mesh, os.path.join(directory, "receiver"), add_message=on_message,
+                               on_test_message=lambda from_node, text: test.set())
+        source.max_chunk_size = chunk_size
+        source.pack_packets = pack
+        if scenario == "stream":
+            source.start_stream_send()
+            source.queue_stream_data(payload)
+            source.finish_stream_send(b"")
+        else:
+            source.send_payload(payload)
+        if scenario == "voice+test":
+            source.send_test_message("ping")
+        else:
+            test.set()
+
+        deadline = time.monotonic() + TIMEOUT
+        while not (voice.is_set() and test.is_set()) and time.monotonic() < deadline:
+            voice.wait(LATENCY)
+        # Let the last acks arrive so nothing is still in flight
+        while source.sending() and time.monotonic() < deadline:
+            time.sleep(LATENCY)
+        done = voice.is_set() and test.is_set()
+        source.close()
+        receiver.close()
+        mesh.close()
+    return (mesh.stats.packets, mesh.stats.payload_bytes) if done else None
+
+
+def run_group(payload, pack, seed):
+    """(NACK frames, packets the receiver sent, packets on air) for GROUP simultaneous messages, or None"""
+    mesh = simmesh.SimMesh(loss=GROUP_LOSS, latency=LATENCY, jitter=LATENCY / 2, seed=seed)
+    delivered = []
+    nacks = [0]
+    with tempfile.TemporaryDirectory() as directory:
+        receiver = make_engine(mesh, os.path.join(directory, "receiver"),
+                               add_message=lambda description, filepath, live=None: filepath and delivered.append(1))
+        receiver.pack_packets = pack
+        receiver.repair_requester = repair.RepairRequester(stall_timeout=20 * LATENCY, max_backoff=4 * LATENCY,
+                                                           suppress_window=20 * LATENCY, max_requests=10)
+        poll = receiver.repair_requester.poll
+
+        def counted_poll(messages, now=None):
+            requests, abandoned = poll(messages, now)
+            nacks[0] += len(requests)
+            return requests, abandoned
+        receiver.repair_requester.poll = counted_poll
+        sent = [0]
+        send_frame = receiver.send_frame
+
+        def counted_send(frame, on_response=None):
+            sent[0] += 1
+            return send_frame(frame, on_response)
+        receiver.send_frame = counted_send
+
+        sources = []
+        for index in range(GROUP):
+            source = make_engine(mesh, os.path.join(directory, f"source{index}"))
+            source.repair_responder = repair.RepairResponder(repair_holdoff=10 * LATENCY)
+            source.repair_coalesce_delay = 2 * LATENCY
+            sources.append(source)
+        for source in sources:
+            source.send_payload(payload)
+
+        deadline = time.monotonic() + TIMEOUT
+        while len(delivered) < GROUP and time.monotonic() < deadline:
+            receiver.check_stalled_messages()
+            time.sleep(LATENCY)
+        done = len(delivered) == GROUP
+        for node in sources + [receiver]:
+            node.close()
+        mesh.close()
+    return (nacks[0], sent[0], mesh.stats.packets) if done else None
+
+
+def main():
+    rate = codec.recording_rate(QUALITY)
+    payload = codec.encode_audio(common.synthetic_speech(SECONDS, rate).tobytes(), 1, 2, rate, QUALITY)
+    print(f"{QUALITY} message of {len(payload)} bytes, {simmesh.MAX_PAYLOAD}-byte packet limit")
+    print(f"{'scenario':<11} {'chunk':<7} {'packets off':>11} {'packets on':>10} {'fill off':>9} {'fill on':>8}")
+    for scenario in ("voice", "stream", "voice+test"):
+        for name, chunk_size in CHUNK_SIZES.items():
+            results = [run(scenario, payload, chunk_size, pack) for pack in (False, True)]
+            if None in results:
+                print(f"{scenario:<11} {name:<7} not delivered")
+                continue
+            fills = [payload_bytes / (packets * simmesh.MAX_PAYLOAD) for packets, payload_bytes in results]
+            print(f"{scenario:<11} {name:<7} {results[0][0]:>11} {results[1][0]:>10} "
+                  f"{fills[0]:>9.0%} {fills[1]:>8.0%}")
+
+    print(f"\ngroup: {GROUP} senders at once, {GROUP_LOSS:.0%} loss, Medium chunks, mean of {TRIALS} trials")
+    print(f"{'packing':<8} {'NACKs':>6} {'NACK packets':>13} {'packets on air':>15}")
+    for pack in (False, True):
+        results = [run_group(payload, pack, seed) for seed in range(TRIALS)]
+        results = [result for result in results if result is not None]
+        if not results:
+            print(f"{'on' if pack else 'off':<8} not delivered")
+            continue
+        nacks, sent, packets = (sum(column) / len(results) for column in zip(*results))
+        print(f"{'on' if pack else 'off':<8} {nacks:>6.1f} {sent:>13.1f} {packets:>15.1f}"
+              + (f"  ({TRIALS - len(results)} trials not delivered)" if len(results) < TRIALS else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""NumPy PCM stages (pcm.py) against audioop
+
+Times each replacement on synthetic speech and, when audioop is still
+importable (Python 3.12 and older), the audioop function it replaces:
+- resampling 16 kHz to 8 kHz and 11025 Hz (Resampler vs audioop.ratecv)
+- 16 to 8 bit (dsp.BitDepthConverter vs audioop.lin2lin)
+- mu-law both ways and IMA ADPCM both ways
+
+For the lossless stages "match" says whether the output is identical to
+audioop's. For the resampler, which is a different (better) filter, it
+gives the level of a tone 20% above the new Nyquist frequency (aliasing)
+and of a 1 kHz tone (passband), both in dB.
+
+Run from the repository root:
+    python benchmarks/bench_pcm.py
+"""
+import numpy as np
+
+import common
+import dsp
+import pcm
+
+try:
+    import audioop
+except ImportError:
+    audioop = None
+
+SECONDS = 10
+RATE = 16000
+
+
+def tone_level(frequency, source_rate, target_rate, resample):
+    """Output level in dB of a full-scale tone after resampling"""
+    t = np.arange(source_rate) / source_rate
+    tone = (16000 * np.sin(2 * np.pi * frequency * t)).astype(np.int16)
+    output = np.frombuffer(resample(tone.tobytes(), source_rate, target_rate), dtype=np.int16).astype(np.float64)
+    middle = output[len(output) // 4:3 * len(output) // 4]  # Skip the filter edges
+    return 20 * np.log10(max(np.sqrt(np.mean(middle ** 2)), 1e-3) / (16000 / np.sqrt(2)))
+
+
+def numpy_resample(frames, source_rate, target_rate):
+    return pcm.resample(frames, 2, 1, source_rate, target_rate)
+
+
+def audioop_resample(frames, source_rate, target_rate):
+    return audioop.ratecv(frames, 2, 1, source_rate, target_rate, None)[0]
+
+
+def report(name, numpy_fn, audioop_fn, compare=None):
+    """Time both versions and print one row"""
+    numpy_time, result = common.timed(numpy_fn, repeat=3)
+    line = f"{name:<22} {numpy_time * 1000 / SECONDS:>10.2f}"
+    if audioop is None:
+        print(line)
+        return
+    audioop_time, expected = common.timed(audioop_fn, repeat=3)
+    match = compare(result, expected) if compare else "yes" if bytes(result) == bytes(expected) else "no"
+    print(f"{line} {audioop_time * 1000 / SECONDS:>12.2f} {match:>14}")
+
+
+def main():
+    samples = common.synthetic_speech(SECONDS, RATE)
+    frames = samples.tobytes()
+    adpcm = pcm.adpcm_encode(samples)
+    ulaw = pcm.lin2ulaw(samples)
+    to_8bit = dsp.BitDepthConverter(2, 1)
+
+    print(f"{SECONDS} s of {RATE} Hz speech" + ("" if audioop else " (audioop not available)"))
+    print(f"{'stage':<22} {'numpy ms/s':>10} {'audioop ms/s':>12} {'match':>14}")
+    for target in (8000, 11025):
+        nyquist = target / 2
+
+        def filter_quality(result, expected, target=target, nyquist=nyquist):
+            return " ".join(f"{tone_level(frequency, RATE, target, numpy_resample):.0f}/"
+                            f"{tone_level(frequency, RATE, target, audioop_resample):.0f}"
+                            for frequency in (1.2 * nyquist, 1000))
+
+        report(f"resample -> {target}", lambda: numpy_resample(frames, RATE, target),
+               lambda: audioop_resample(frames, RATE, target), filter_quality)
+    report("16 -> 8 bit", lambda: to_8bit(samples).tobytes(), lambda: audioop.lin2lin(frames, 2, 1))
+    report("lin2ulaw", lambda: pcm.lin2ulaw(samples).tobytes(), lambda: audioop.lin2ulaw(frames, 2))
+    report("ulaw2lin", lambda: pcm.ulaw2lin(ulaw).tobytes(), lambda: audioop.ulaw2lin(ulaw.tobytes(), 2))
+    # audioop leaves an odd last sample out, pcm pads it into a final byte
+    report("ADPCM encode", lambda: pcm.adpcm_encode(samples)[:len(samples) // 2],
+           lambda: audioop.lin2adpcm(frames, 2, None)[0])
+    report("ADPCM decode", lambda: pcm.adpcm_decode(adpcm).tobytes(), lambda: audioop.adpcm2lin(adpcm, 2, None)[0])
+    if audioop:
+        print("resample match: alias/1 kHz level in dB, numpy/audioop")
+
+
+if __name__ == "__main__":
+    main()
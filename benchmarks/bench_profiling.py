@@ -0,0 +1,57 @@
+"""Profiling hooks: cost when off and when on
+
+Receives a whole message through a VoiceEngine, which runs its receive,
+reassemble and decode hot paths: as the app runs by default (profiling
+off, so nothing is wrapped), and with the engine's hot paths instrumented,
+with and without tracemalloc sampling. The reports written are listed.
+
+Run from the repository root:
+    python benchmarks/bench_profiling.py
+"""
+import os
+import tempfile
+
+import common
+import codec
+import engine
+import profiling
+import wire
+
+QUALITY = "ADPCM"
+SECONDS = 10
+FRAME_SIZE = 180
+
+
+def receive(payload, directory, profiler):
+    node = engine.VoiceEngine(output_dir=directory)
+    if profiler is not None:
+        profiler.instrument(node, engine.VoiceEngine.PROFILED)
+    for index, frame in enumerate(wire.split_payload(1, payload, FRAME_SIZE)):
+        node.on_receive({'id': index + 1, 'from': 1, 'fromId': "!00000001",
+                         'decoded': {'portnum': 'PRIVATE_APP', 'payload': frame}})
+    node.close()
+    return node
+
+
+def main():
+    rate = codec.recording_rate(QUALITY)
+    payload = codec.encode_audio(common.synthetic_speech(SECONDS, rate).tobytes(), 1, 2, rate, QUALITY)
+    print(f"Receiving a {SECONDS} s {QUALITY} message of {len(payload)} bytes")
+    with tempfile.TemporaryDirectory() as directory:
+        node = receive(payload, directory, profiling.from_environment(None))
+        unwrapped = node.process_voice_message.__func__ is engine.VoiceEngine.process_voice_message
+        print(f"profiling off: hot paths unwrapped: {unwrapped}")
+        for name, memory_every in (("off", None), ("cProfile", 0), ("cProfile + tracemalloc", 10)):
+            profiler = None
+            if memory_every is not None:
+                profiler = profiling.Profiler(os.path.join(directory, "profiles"), memory_every=memory_every)
+            best, _ = common.timed(lambda: receive(payload, directory, profiler), repeat=3)
+            print(f"{name:<24} {best * 1000:>8.1f} ms")
+            if profiler is not None:
+                profiler.close()
+        reports = sorted(os.listdir(os.path.join(directory, "profiles")))
+        print(f"reports: {', '.join(reports)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Perceived latency of progressive playback
+
+A 10 s message is sent as one zlib/LPC body and as 1 s segments. For the
+segmented payload, chunks are fed in order through ReassemblyBuffer and
+LiveAudio to find how many chunks must arrive before the first second can
+play. Without segments, nothing plays until the last chunk. Also reported is
+the size cost of segmenting.
+
+Run from the repository root:
+    python benchmarks/bench_progressive.py
+"""
+import common
+import codec
+import progressive
+import reassembly
+import wire
+
+SECONDS = 10
+FRAME_SIZE = 180  # "Medium" chunks
+
+
+def first_playable(payload):
+    """Chunks received before the first segment decodes"""
+    frames = wire.split_payload(1, payload, FRAME_SIZE)
+    store = reassembly.ReassemblyBuffer(max_bytes=16 * 2 ** 20)
+    live = progressive.LiveAudio()
+    for count, packet in enumerate(frames, 1):
+        frame = wire.unpack_frame(packet)
+        message = store.add(1, "node", frame.seq, frame.total, frame.payload)
+        if live.feed(message.chunk(frame.seq)):
+            return count, len(frames)
+    return len(frames), len(frames)
+
+
+def main():
+    print(f"{SECONDS} s message, {FRAME_SIZE}-byte packets, {codec.SEGMENT_SECONDS:.0f} s segments")
+    print(f"{'quality':<10} {'chunks':>7} {'first audio after':>18} {'segment overhead':>17}")
+    for quality in codec.QUALITY_PRESETS:
+        rate = codec.recording_rate(quality)
+        samples = common.synthetic_speech(SECONDS, rate).tobytes()
+        whole = codec.encode_audio(samples, 1, 2, rate, quality)
+        segmented = codec.encode_audio(samples, 1, 2, rate, quality, segment_seconds=codec.SEGMENT_SECONDS)
+        first, total = first_playable(segmented)
+        print(f"{quality:<10} {total:>7} {first:>7} ({first / total:>5.0%})    "
+              f"{len(segmented) / len(whole) - 1:>15.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""Reassembly store under many concurrent partial messages
+
+Simulated nodes each start several messages. Chunks arrive interleaved in
+random order and a share of them is lost, so most messages stay partial.
+Two loads are run: a moderate one the app's limits hold without evicting,
+and a heavy one of thousands of concurrent messages. "dict" is the old
+unbounded nested dict of chunks joined with `+=`. "sized" is
+ReassemblyBuffer with limits large enough for the load, and "default" is
+ReassemblyBuffer with the app's limits, which must turn messages away or
+evict to stay bounded. Reported are chunk insert throughput, peak traced
+memory, how many of the messages that got every chunk were completed, and
+what each buffer evicted. First it checks that a streamed message whose END
+frame announces more chunks than it has slots still takes the rest of its
+chunks, and that a streamed message cannot grow past the byte cap.
+
+Run from the repository root:
+    python benchmarks/bench_reassembly.py
+"""
+import os
+import random
+import time
+import tracemalloc
+
+import common
+import reassembly
+import wire
+
+LOADS = (("moderate", 20, 4), ("heavy", 300, 10))  # (name, nodes, messages per node)
+CHUNKS = 40
+CHUNK_SIZE = 167  # "Small" packets minus the frame header
+DELIVERY = 0.7
+COMPLETE_SHARE = 0.1  # Messages that get every chunk
+
+
+def make_traffic(rng, nodes, messages_per_node):
+    """Interleaved (sender, message id, seq, packet) arrivals and the number of complete messages"""
+    packet = os.urandom(wire.HEADER_SIZE + CHUNK_SIZE)
+    arrivals = []
+    complete_messages = 0
+    for node in range(nodes):
+        sender = f"!{node:08x}"
+        for message_id in range(messages_per_node):
+            complete = rng.random() < COMPLETE_SHARE
+            delivered = 0
+            for seq in range(CHUNKS):
+                if complete or rng.random() < DELIVERY:
+                    arrivals.append((sender, message_id, seq, packet))
+                    delivered += 1
+            complete_messages += delivered == CHUNKS
+    rng.shuffle(arrivals)
+    return arrivals, complete_messages
+
+
+def run_dict(arrivals):
+    messages = {}
+    completed = 0
+    for sender, message_id, seq, packet in arrivals:
+        key = (sender, message_id)
+        data = packet[wire.HEADER_SIZE:]  # Fresh bytes per packet, as in the receive path
+        entry = messages.setdefault(key, {'chunks': {}, 'total_chunks': CHUNKS, 'last_chunk_time': time.time()})
+        entry['chunks'][seq + 1] = data
+        if len(entry['chunks']) == CHUNKS:
+            combined = b""
+            for i in range(1, CHUNKS + 1):
+                combined += entry['chunks'][i]
+            del messages[key]
+            completed += 1
+    return completed, len(messages)
+
+
+def run_buffer(arrivals, **limits):
+    store = reassembly.ReassemblyBuffer(**limits)
+    completed = 0
+    for sender, message_id, seq, packet in arrivals:
+        key = (sender, message_id)
+        message = store.add(key, sender, seq, CHUNKS, packet[wire.HEADER_SIZE:])
+        if message is not None and message.received == CHUNKS:
+            message.join()
+            store.pop(key)
+            completed += 1
+    return completed, len(store), store
+
+
+def check_late_end():
+    """END frames arriving after some chunks of a streamed message"""
+    data = bytes(CHUNK_SIZE)
+    for received, then in ((6, None), (31, 31)):
+        store = reassembly.ReassemblyBuffer()
+        for seq in range(received):
+            store.add("m", "!00000001", seq, wire.TOTAL_UNKNOWN, data, now=0)
+        message = store.announce("m", "!00000001", CHUNKS, now=0)
+        if then is not None:
+            store.add("m", "!00000001", then, wire.TOTAL_UNKNOWN, data, now=0)
+            received += 1
+        assert message.missing_data() == list(range(received, CHUNKS)), message.missing_data()
+        for seq in range(received, CHUNKS):
+            store.add("m", "!00000001", seq, wire.TOTAL_UNKNOWN, data, now=0)
+        assert message.contiguous == CHUNKS and len(message.join()) == CHUNKS * CHUNK_SIZE
+        assert store.bytes_used == message.nbytes
+
+
+def check_stream_cap():
+    """A streamed message is dropped once it outgrows the byte cap, even when alone"""
+    store = reassembly.ReassemblyBuffer(max_bytes=64 * 1024)
+    data = bytes(CHUNK_SIZE)
+    for seq in range(1000):
+        if store.add("m", "!00000001", seq, wire.TOTAL_UNKNOWN, data, now=0) is None:
+            break
+    assert "m" not in store and store.bytes_used == 0 and store.evictions['memory'] == 1, store.evictions
+
+
+def measure(fn, arrivals, **kwargs):
+    """Time an untraced run, then trace a second run for peak memory"""
+    elapsed, _ = common.timed(lambda: fn(arrivals, **kwargs))
+    tracemalloc.start()
+    result = fn(arrivals, **kwargs)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak, result
+
+
+def main():
+    check_late_end()
+    check_stream_cap()
+    for load, nodes, messages_per_node in LOADS:
+        arrivals, complete_messages = make_traffic(random.Random(7), nodes, messages_per_node)
+        print(f"{load}: {nodes} nodes x {messages_per_node} messages x {CHUNKS} chunks, "
+              f"{len(arrivals)} chunks delivered, {complete_messages} messages complete")
+        print(f"{'store':<8} {'chunks/s':>10} {'peak MiB':>9} {'completed':>10} {'partials left':>14}")
+
+        elapsed, peak, (completed, left) = measure(run_dict, arrivals)
+        print(f"{'dict':<8} {len(arrivals) / elapsed:>10.0f} {peak / 2 ** 20:>9.1f} {completed:>10} {left:>14}")
+
+        sized = {'max_messages': nodes * messages_per_node, 'max_bytes': 64 * 2 ** 20,
+                 'max_per_sender': messages_per_node}
+        for name, limits in (("sized", sized), ("default", {})):
+            elapsed, peak, (completed, left, store) = measure(run_buffer, arrivals, **limits)
+            print(f"{name:<8} {len(arrivals) / elapsed:>10.0f} {peak / 2 ** 20:>9.1f} {completed:>10} {left:>14}")
+            evictions = ", ".join(f"{reason} {count}" for reason, count in store.evictions.items() if count)
+            print(f"    holds {store.bytes_used / 2 ** 20:.2f} MiB (cap {store.max_bytes / 2 ** 20:.0f} MiB), "
+                  f"evictions: {evictions or 'none'}")
+        print()
+
+
+if __name__ == "__main__":
+    main()
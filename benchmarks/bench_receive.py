@@ -0,0 +1,93 @@
+"""Receive workers: how long the radio reader thread is held up
+
+The packets of SENDERS complete messages arrive interleaved, INTERVAL
+apart, as the serial reader thread delivers a busy channel. ADPCM and the
+vocoder have the slowest decoders. on_receive is timed per packet on that
+thread, with packets handled inline (as before) and with receive workers.
+Reported: reader time in total and for the slowest packet (inline, the one
+that completed a message and decoded it), and the time until every message
+was saved. A last run delivers everything back to back into a tiny queue to
+show packets dropped by backpressure instead of stalling the reader.
+
+Run from the repository root:
+    python benchmarks/bench_receive.py
+"""
+import os
+import tempfile
+import threading
+import time
+
+import common
+import codec
+import engine
+import wire
+
+SENDERS = 4
+QUALITIES = ("ADPCM", "Vocoder")
+SECONDS = 10
+FRAME_SIZE = 200
+INTERVAL = 0.001  # Seconds between packets
+TIMEOUT = 60
+
+
+def packets(payloads):
+    """Packet dicts like meshtastic delivers, senders interleaved chunk by chunk"""
+    frames = [wire.split_payload(index + 1, payload, FRAME_SIZE) for index, payload in enumerate(payloads)]
+    packet_id = 0
+    for seq in range(max(len(message) for message in frames)):
+        for index, message in enumerate(frames):
+            if seq < len(message):
+                packet_id += 1
+                yield {'id': packet_id, 'from': index + 1, 'fromId': f"!{index + 1:08x}",
+                       'decoded': {'portnum': 'PRIVATE_APP', 'payload': message[seq]}}
+
+
+def run(payloads, workers, max_pending=512, interval=INTERVAL):
+    saved = []
+    all_saved = threading.Event()
+
+    def add_message(description, filepath, live=None):
+        saved.append(filepath)
+        if len(saved) == len(payloads):
+            all_saved.set()
+
+    with tempfile.TemporaryDirectory() as directory:
+        node = engine.VoiceEngine(output_dir=directory, add_message=add_message)
+        if workers:
+            node.start_receive_workers(workers, max_pending)
+        times = []
+        start = time.perf_counter()
+        for packet in packets(payloads):
+            packet_start = time.perf_counter()
+            node.on_receive(packet)
+            times.append(time.perf_counter() - packet_start)
+            while time.perf_counter() - packet_start < interval:
+                time.sleep(interval / 4)
+        all_saved.wait(TIMEOUT if interval else 1)
+        done = time.perf_counter() - start
+        stats = node.receive_stats()
+        node.close()
+    return sum(times), max(times), done, len(saved), stats
+
+
+def main():
+    payloads = []
+    for seed in range(SENDERS):
+        quality = QUALITIES[seed % len(QUALITIES)]
+        rate = codec.recording_rate(quality)
+        payloads.append(codec.encode_audio(common.synthetic_speech(SECONDS, rate, seed).tobytes(), 1, 2, rate,
+                                           quality))
+    count = sum(1 for _ in packets(payloads))
+    print(f"{SENDERS} messages ({', '.join(QUALITIES)}), {count} packets {INTERVAL * 1000:.0f} ms apart")
+    print(f"{'receive':<22} {'reader ms':>10} {'worst ms':>9} {'saved ms':>9} {'saved':>6} {'dropped':>8}")
+    for name, workers, max_pending, interval in (("inline", 0, 512, INTERVAL), ("2 workers", 2, 512, INTERVAL),
+                                                 ("4 workers", 4, 512, INTERVAL),
+                                                 ("2 workers, q=16, burst", 2, 16, 0)):
+        reader, worst, done, saved, stats = run(payloads, workers, max_pending, interval)
+        dropped = stats['dropped'] if stats else 0
+        print(f"{name:<22} {reader * 1000:>10.1f} {worst * 1000:>9.2f} {done * 1000:>9.0f} "
+              f"{saved:>6} {dropped:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Record -> encode pipeline: in-memory buffer against the WAV round trip
+
+A 30 s recording arrives in 1024-frame blocks, as PyAudio delivers it, and
+is then encoded for sending. Two pipelines are compared per quality:
+- wav: blocks collected in a list, joined and written to a WAV file when
+  recording stops; Send reads the WAV file back and encodes it
+- memory: blocks copied into a recorder.RecordBuffer; the WAV archive is
+  written on a background thread and Send encodes the buffer directly
+
+Reported: time from the end of recording until the recording is ready
+("stop"), time from pressing Send until the payload is ready ("send"), and
+peak traced memory over the whole pipeline. Both encode the same audio to
+the same payload.
+
+Run from the repository root:
+    python benchmarks/bench_record.py
+"""
+import os
+import tempfile
+import time
+import tracemalloc
+import wave
+
+import common
+import codec
+import recorder
+
+SECONDS = 30
+BLOCK = 1024  # Frames per PyAudio read
+REPEAT = 5
+
+
+def capture(samples):
+    """Blocks as PyAudio's stream.read returns them, a new bytes object each"""
+    for start in range(0, len(samples), BLOCK):
+        yield samples[start:start + BLOCK].tobytes()
+
+
+def wav_pipeline(samples, rate, quality, path):
+    frames = []
+    for block in capture(samples):
+        frames.append(block)
+    start = time.perf_counter()
+    codec.write_wav(path, codec.AudioParams(rate, 1, 2), b''.join(frames))
+    stop = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with wave.open(path, 'rb') as wf:
+        data = wf.readframes(wf.getnframes())
+        payload = codec.encode_audio(data, wf.getnchannels(), wf.getsampwidth(), wf.getframerate(), quality)
+    return stop, time.perf_counter() - start, payload
+
+
+def memory_pipeline(samples, rate, quality, path):
+    recording = recorder.RecordBuffer(SECONDS, rate, 1, 2)
+    for block in capture(samples):
+        recording.write(block)
+    start = time.perf_counter()
+    saving = recorder.save_async(recording, path)
+    stop = time.perf_counter() - start
+
+    start = time.perf_counter()
+    params = recording.params
+    payload = codec.encode_audio(recording.frames(), params.channels, params.sample_width, params.sample_rate, quality)
+    send = time.perf_counter() - start
+    saving.join()
+    return stop, send, payload
+
+
+def run(pipeline, samples, rate, quality, path):
+    """Best stop and send times over REPEAT runs, then one traced run for memory"""
+    stop = send = float("inf")
+    for _ in range(REPEAT):
+        stop_time, send_time, payload = pipeline(samples, rate, quality, path)
+        stop, send = min(stop, stop_time), min(send, send_time)
+    tracemalloc.start()
+    pipeline(samples, rate, quality, path)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return stop, send, peak, payload
+
+
+def main():
+    print(f"{SECONDS} s recordings, {BLOCK}-frame blocks")
+    print(f"{'quality':<10} {'PCM KiB':>8} {'pipeline':<8} {'stop ms':>8} {'send ms':>8} {'peak KiB':>9}")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "recording.wav")
+        for quality in codec.QUALITY_PRESETS:
+            rate = codec.recording_rate(quality)
+            samples = common.synthetic_speech(SECONDS, rate)
+            payloads = []
+            for name, pipeline in (("wav", wav_pipeline), ("memory", memory_pipeline)):
+                stop, send, peak, payload = run(pipeline, samples, rate, quality, path)
+                payloads.append(payload)
+                print(f"{quality:<10} {samples.nbytes / 1024:>8.0f} {name:<8} {stop * 1000:>8.2f} "
+                      f"{send * 1000:>8.2f} {peak / 1024:>9.0f}")
+            assert payloads[0] == payloads[1], "pipelines produced different payloads"
+
+
+if __name__ == "__main__":
+    main()
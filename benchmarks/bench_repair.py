@@ -0,0 +1,92 @@
+"""Airtime of NACK-driven selective repeat vs blind full resends
+
+One sender broadcasts a message to several receivers over independent lossy
+links. "blind" resends the whole message until every receiver has it all.
+"nack" drives RepairRequester/RepairResponder on a simulated clock, where
+NACKs are broadcast (and can be lost) so receivers can suppress duplicates.
+
+Run from the repository root:
+    python benchmarks/bench_repair.py
+"""
+import random
+
+import common  # noqa: F401  (adds the repository root to sys.path)
+import repair
+
+FRAMES = 129  # 5 s "Ultra Low" message in Small chunks
+RECEIVERS = (1, 3, 8)
+LOSS_RATES = (0.05, 0.10, 0.20)
+TRIALS = 50
+TIME_LIMIT = 3600
+
+
+def blind(receivers, loss, rng):
+    """Resend every frame until all receivers have the whole message"""
+    have = [set() for _ in range(receivers)]
+    packets = 0
+    while any(len(h) < FRAMES for h in have):
+        for seq in range(FRAMES):
+            packets += 1
+            for h in have:
+                if rng.random() >= loss:
+                    h.add(seq)
+    return packets, 0
+
+
+def nack(receivers, loss, rng):
+    """Initial pass, then repairs driven by NACKs on a one-second clock"""
+    have = [set() for _ in range(receivers)]
+    last_chunk = [0.0] * receivers
+    requesters = [repair.RepairRequester(max_requests=1000) for _ in range(receivers)]
+    responder = repair.RepairResponder()
+    responder.remember(1, {seq: seq for seq in range(FRAMES)})
+
+    def broadcast(seq, now):
+        for r, h in enumerate(have):
+            if rng.random() >= loss:
+                h.add(seq)
+                last_chunk[r] = now
+
+    packets = nacks = 0
+    for seq in range(FRAMES):
+        packets += 1
+        broadcast(seq, seq)
+
+    now = float(FRAMES)
+    while any(len(h) < FRAMES for h in have) and now < TIME_LIMIT:
+        now += 1
+        for r, h in enumerate(have):
+            missing = [seq for seq in range(FRAMES) if seq not in h]
+            if not missing:
+                continue
+            requests, _ = requesters[r].poll([(1, 1, last_chunk[r], missing)], now)
+            for _, message_id, seqs in requests:
+                nacks += 1
+                for other in range(receivers):
+                    if other != r and rng.random() >= loss:
+                        requesters[other].on_overheard(message_id, seqs, now)
+                if rng.random() >= loss:
+                    for seq, _ in responder.request(message_id, seqs, now):
+                        packets += 1
+                        now += 1
+                        broadcast(seq, now)
+    return packets, nacks
+
+
+def main():
+    random.seed(7)
+    rng = random.Random(7)
+    print(f"{FRAMES} frames, {TRIALS} trials; average packets on air (data + NACK)")
+    print(f"{'receivers':<10} {'loss':>5} {'blind':>8} {'nack':>14} {'saving':>7}")
+    for receivers in RECEIVERS:
+        for loss in LOSS_RATES:
+            blind_total = sum(sum(blind(receivers, loss, rng)) for _ in range(TRIALS)) / TRIALS
+            results = [nack(receivers, loss, rng) for _ in range(TRIALS)]
+            data = sum(r[0] for r in results) / TRIALS
+            nacks = sum(r[1] for r in results) / TRIALS
+            print(f"{receivers:<10} {loss:>5.0%} {blind_total:>8.0f} {data:>7.0f} + {nacks:>4.1f} "
+                  f"{1 - (data + nacks) / blind_total:>7.0%}")
+
+
+if __name__ == "__main__":
+    main()
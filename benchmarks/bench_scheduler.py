@@ -0,0 +1,103 @@
+"""Transmit scheduler: control latency and interleaving of queued messages
+
+A VoiceEngine sends over a SimMesh (timers scaled like bench_e2e) to one
+receiver. Measured:
+- test message latency (queued until acked) while a long voice message is
+  being sent, against the same message on an idle channel
+- completion time of a short voice message queued while the long one is
+  sending, against sending the two one after the other as the single-message
+  sender had to
+
+Run from the repository root:
+    python benchmarks/bench_scheduler.py [--loss 0.05]
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+import common
+import codec
+import engine
+import scheduler
+import sender
+import simmesh
+
+LATENCY = 0.02
+LONG_SECONDS = 10
+SHORT_SECONDS = 2
+QUALITY = "ADPCM"
+TIMEOUT = 60
+WAIT = 0.5  # Seconds into the long send before the next message is queued
+
+
+def make_engine(mesh, output_dir, on_send_finished=None):
+    node = engine.VoiceEngine(output_dir=output_dir, on_send_finished=on_send_finished)
+    node.interface = mesh.add_node(on_receive=node.on_receive)
+    node.send_rtt = sender.RttEstimator(initial_rto=20 * LATENCY, min_rto=8 * LATENCY)
+    node.chunk_retry_delay = 4 * LATENCY
+    return node
+
+
+def run(loss, scenario, payloads):
+    """Run (kind, name) steps, "wait" pausing WAIT seconds; return {name: seconds from queueing until sent}"""
+    mesh = simmesh.SimMesh(loss=loss, latency=LATENCY, jitter=LATENCY / 2, seed=1)
+    starts = {}
+    names = {}  # voice message id -> name
+    times = {}
+    done = threading.Condition()
+
+    def finished(name):
+        with done:
+            times[name] = time.perf_counter() - starts[name]
+            done.notify_all()
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        source = make_engine(mesh, os.path.join(output_dir, "source"),
+                             on_send_finished=lambda message_id, stats: finished(names[message_id]))
+        receiver = make_engine(mesh, os.path.join(output_dir, "receiver"))
+        for kind, name in scenario:
+            if kind == "wait":
+                time.sleep(WAIT)
+                continue
+            starts[name] = time.perf_counter()
+            if kind == "voice":
+                names[source.send_payload(payloads[name])] = name
+            else:
+                source.transmit([("test", b'{"test": "ping"}')], scheduler.PRIORITY_CONTROL,
+                                on_done=lambda message, name=name: finished(name), name=name)
+
+        with done:
+            done.wait_for(lambda: len(times) == len(starts), TIMEOUT)
+        source.close()
+        receiver.close()
+        mesh.close()
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--loss", type=float, default=0.05, help="per-hop packet loss (default 0.05)")
+    args = parser.parse_args()
+
+    rate = codec.recording_rate(QUALITY)
+    payloads = {name: codec.encode_audio(common.synthetic_speech(seconds, rate, seed).tobytes(), 1, 2, rate, QUALITY)
+                for seed, (name, seconds) in enumerate((("long", LONG_SECONDS), ("short", SHORT_SECONDS)))}
+
+    idle = run(args.loss, [("test", "test")], payloads)["test"]
+    busy = run(args.loss, [("voice", "long"), ("wait", None), ("test", "test")], payloads)["test"]
+    long_alone = run(args.loss, [("voice", "long")], payloads)["long"]
+    short_alone = run(args.loss, [("voice", "short")], payloads)["short"]
+    both = run(args.loss, [("voice", "long"), ("wait", None), ("voice", "short")], payloads)
+
+    print(f"{QUALITY}: long message {len(payloads['long'])} bytes, short {len(payloads['short'])} bytes, "
+          f"{args.loss:.0%} loss, {LATENCY * 1000:.0f} ms latency (scaled timers)")
+    print(f"test message latency:    idle {idle * 1000:6.0f} ms   during long send {busy * 1000:6.0f} ms")
+    print(f"short message completes: queued {both['short']:.2f} s   "
+          f"after the long one {long_alone - WAIT + short_alone:.2f} s")
+    print(f"long message completes:  alone {long_alone:.2f} s   sharing the channel {both['long']:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
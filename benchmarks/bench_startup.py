@@ -0,0 +1,104 @@
+"""Startup time: from a fresh interpreter to the first frame of the window
+
+Every run starts a new Python process in an empty directory, so nothing is
+cached in the process. The child reports when each phase finished:
+- imports: `import app` and everything it imports
+- window: tk.Tk() and MeshtasticVoiceMessenger(root)
+- first frame: root.update(), which draws the window
+plus which heavy modules were loaded by then. The parent reports the wall
+time from spawning the child until it exits. The --eager run imports numpy,
+http.server and the radio and audio libraries (those installed) first, as
+startup did before they were deferred. The target is under 300 ms to the
+first frame.
+
+Without a display the Tk phases cannot run; the child then creates the
+VoiceEngine and encode cache the window would create and reports imports
+only.
+
+Run from the repository root:
+    python benchmarks/bench_startup.py [--runs 5] [--eager]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TARGET = 0.3  # Seconds from process start to the first frame
+HEAVY = ("numpy", "http.server", "pyaudio", "meshtastic", "serial", "pubsub")
+
+CHILD = r"""
+import json, sys, time
+start = time.perf_counter()
+phases = {}
+for name in EAGER:
+    try:
+        __import__(name)
+    except ImportError:
+        pass
+import app
+phases['imports'] = time.perf_counter() - start
+try:
+    import tkinter as tk
+    root = tk.Tk()
+except Exception as e:
+    phases['display'] = str(e)
+    import encodecache, engine
+    node = engine.VoiceEngine(output_dir="voice_messages")
+    cache = encodecache.EncodeCache()
+    phases['engine'] = time.perf_counter() - start
+    node.close()
+    cache.close()
+else:
+    messenger = app.MeshtasticVoiceMessenger(root)
+    phases['window'] = time.perf_counter() - start
+    root.update()
+    phases['first frame'] = time.perf_counter() - start
+    messenger.on_close()
+phases['loaded'] = [name for name in HEAVY if name in sys.modules]
+print(json.dumps(phases))
+"""
+
+
+def run(eager):
+    eager_modules = ["numpy", "http.server", "serial.tools.list_ports", "pyaudio", "meshtastic.serial_interface",
+                     "pubsub.pub"] if eager else []
+    code = f"EAGER = {eager_modules!r}\nHEAVY = {HEAVY!r}\n" + CHILD
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""),
+               PYTHONDONTWRITEBYTECODE="1")
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, "-c", code], cwd=directory, env=env,
+                                capture_output=True, text=True, timeout=60)
+        wall = time.perf_counter() - start
+    if result.returncode:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    return wall, json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="fresh processes per mode (default 5)")
+    parser.add_argument("--eager", action="store_true", help="also measure with the heavy modules imported first")
+    args = parser.parse_args()
+
+    modes = [("lazy", False)] + ([("eager", True)] if args.eager else [])
+    print(f"{'startup':<8} {'imports ms':>11} {'window ms':>10} {'frame ms':>9} {'process ms':>11}  loaded")
+    for name, eager in modes:
+        runs = [run(eager) for _ in range(args.runs)]
+        wall, phases = min(runs, key=lambda item: item[0])
+        window = phases.get('window', phases.get('engine'))
+        frame = phases.get('first frame')
+        print(f"{name:<8} {phases['imports'] * 1000:>11.1f} {window * 1000:>10.1f} "
+              f"{frame * 1000 if frame is not None else float('nan'):>9.1f} {wall * 1000:>11.1f}  "
+              f"{', '.join(phases['loaded']) or '-'}")
+        if 'display' in phases:
+            print(f"{'':<8} no display ({phases['display']}): window column is engine setup, no frame")
+    print(f"target: first frame (or process time without a display) under {TARGET * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""Transfer store: batched write cost and resuming an interrupted send
+
+Write cost: the receive path stores every frame of MESSAGES incoming
+messages and the transmit path marks every frame of one outgoing message
+acked. Timed on the calling thread (what the receive and transmit threads
+pay) and until everything is committed, for transferstore.TransferStore
+against committing each write on the calling thread.
+
+Resume: a VoiceEngine sends a message over a SimMesh (timers scaled like
+bench_e2e) and both nodes are restarted once the receiver holds about half
+of it. Compared: packets on air to finish the message after the restart when
+both nodes restore from their stores, against sending it again from scratch.
+
+Run from the repository root:
+    python benchmarks/bench_store.py [--loss 0.05]
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+import common
+import codec
+import engine
+import repair
+import sender
+import simmesh
+import transferstore
+import wire
+
+MESSAGES = 20
+CHUNKS = 100
+FRAME_SIZE = 180
+LATENCY = 0.02
+QUALITY = "ADPCM"
+SECONDS = 10
+TIMEOUT = 60
+
+
+def frames():
+    payload = os.urandom(CHUNKS * (FRAME_SIZE - wire.HEADER_SIZE))
+    for index in range(MESSAGES):
+        for frame in wire.split_payload(index, payload, FRAME_SIZE):
+            yield ("!00000001", index), wire.unpack_frame(frame).seq, frame
+
+
+def batched(path):
+    store = transferstore.TransferStore(path)
+    start = time.perf_counter()
+    store.save_outbound(1, {seq: frame for key, seq, frame in frames() if key[1] == 0})
+    for key, seq, frame in frames():
+        store.add_inbound(key, seq, frame)
+    for seq in range(CHUNKS):
+        store.mark_acked(1, seq)
+    caller = time.perf_counter() - start
+    store.flush()
+    total = time.perf_counter() - start
+    store.close()
+    return caller, total
+
+
+def per_write(path):
+    """The same writes, each committed on the calling thread"""
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.executescript(transferstore.SCHEMA)
+    start = time.perf_counter()
+    with connection:
+        connection.execute("INSERT INTO outbox VALUES (?, ?)", (1, time.time()))
+    for key, seq, frame in frames():
+        if key[1] == 0:
+            with connection:
+                connection.execute("INSERT INTO outbox_frames VALUES (?, ?, ?, 0)", (1, seq, frame))
+    for (sender_id, message_id), seq, frame in frames():
+        with connection:
+            connection.execute("INSERT OR REPLACE INTO inbox VALUES (?, ?, ?)", (sender_id, message_id, time.time()))
+            connection.execute("INSERT OR IGNORE INTO inbox_frames VALUES (?, ?, ?, ?)",
+                               (sender_id, message_id, seq, frame))
+    for seq in range(CHUNKS):
+        with connection:
+            connection.execute("UPDATE outbox_frames SET acked = 1 WHERE message_id = ? AND seq = ?", (1, seq))
+    total = time.perf_counter() - start
+    connection.close()
+    return total, total
+
+
+def make_engine(mesh, node_num, output_dir, store, add_message=None):
+    node = engine.VoiceEngine(output_dir=output_dir, add_message=add_message)
+    node.interface = mesh.add_node(node_num, on_receive=node.on_receive)
+    node.send_rtt = sender.RttEstimator(initial_rto=20 * LATENCY, min_rto=8 * LATENCY)
+    node.chunk_retry_delay = 4 * LATENCY
+    node.repair_requester = repair.RepairRequester(stall_timeout=20 * LATENCY, max_backoff=4 * LATENCY)
+    if store:
+        node.open_store(os.path.join(output_dir, "transfers.db"))
+    return node
+
+
+def resume(loss, payload, store):
+    """Packets sent after the restart until the receiver has the message, or None on timeout"""
+    mesh = simmesh.SimMesh(loss=loss, latency=LATENCY, jitter=LATENCY / 2, seed=1)
+    received = threading.Event()
+
+    def on_message(description, filepath, live=None):
+        if filepath:
+            received.set()
+
+    with tempfile.TemporaryDirectory() as directory:
+        source_dir, receiver_dir = os.path.join(directory, "source"), os.path.join(directory, "receiver")
+        source = make_engine(mesh, 1, source_dir, store)
+        receiver = make_engine(mesh, 2, receiver_dir, store)
+        source.send_payload(payload)
+        total = len(wire.split_payload(0, payload, source.max_chunk_size))
+        while not any(message.received >= total // 2 for _, message in receiver.message_chunks.snapshot()):
+            time.sleep(LATENCY)
+        for node in (source, receiver):
+            node.close()
+            node.interface.close()
+
+        before = mesh.stats.packets
+        source = make_engine(mesh, 1, source_dir, store)
+        receiver = make_engine(mesh, 2, receiver_dir, store, add_message=on_message)
+        if store:
+            source.resume_transfers()
+        else:
+            source.send_payload(payload)
+        deadline = time.monotonic() + TIMEOUT
+        while not received.is_set() and time.monotonic() < deadline:
+            receiver.check_stalled_messages()
+            received.wait(LATENCY)
+        sent = mesh.stats.packets - before if received.is_set() else None
+        source.close()
+        receiver.close()
+        mesh.close()
+    return sent, total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--loss", type=float, default=0.05, help="per-hop packet loss (default 0.05)")
+    args = parser.parse_args()
+
+    writes = MESSAGES * CHUNKS * 2 + CHUNKS * 2
+    print(f"{MESSAGES} incoming messages of {CHUNKS} chunks, one outgoing message acked chunk by chunk "
+          f"(~{writes} statements)")
+    print(f"{'writer':<10} {'caller ms':>10} {'committed ms':>13} {'us/write':>9}")
+    with tempfile.TemporaryDirectory() as directory:
+        for name, run in (("per write", per_write), ("batched", batched)):
+            caller, total = run(os.path.join(directory, f"{name}.db"))
+            print(f"{name:<10} {caller * 1000:>10.1f} {total * 1000:>13.1f} {caller * 1e6 / writes:>9.2f}")
+
+    rate = codec.recording_rate(QUALITY)
+    payload = codec.encode_audio(common.synthetic_speech(SECONDS, rate).tobytes(), 1, 2, rate, QUALITY)
+    print(f"\nRestart halfway through a {len(payload)}-byte {QUALITY} message, {args.loss:.0%} loss")
+    for name, store in (("from scratch", False), ("resumed", True)):
+        sent, total = resume(args.loss, payload, store)
+        result = f"{sent} packets after restart" if sent is not None else "not delivered"
+        print(f"{name:<13} {result} ({total} chunks in the message)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""Time to first packet: encode after recording vs send while recording
+
+A 10 s recording is fed to the encoder in PyAudio-sized blocks. In batch
+mode the first chunk exists only after the whole recording plus one
+encode_audio call. When streaming, it exists as soon as the encoded bytes
+fill one chunk, so the delay is the audio captured by then plus encode time.
+Also reported is the worst per-block encode time, which must stay well below
+the block duration for the record loop to keep up.
+
+Run from the repository root:
+    python benchmarks/bench_stream.py
+"""
+import time
+
+import common
+import codec
+import wire
+
+SECONDS = 10
+BLOCK = 1024  # frames_per_buffer in app.py
+FRAME_SIZE = 180  # "Medium" chunks
+
+
+def stream(samples, rate, quality):
+    """Return (audio seconds until the first frame, worst block time, frame count)"""
+    encoder = codec.StreamEncoder(1, 2, rate, quality)
+    splitter = wire.StreamSplitter(1, FRAME_SIZE)
+    first = None
+    worst = 0.0
+    frames = 0
+    for start in range(0, len(samples), BLOCK):
+        began = time.perf_counter()
+        ready = splitter.feed(encoder.write(samples[start:start + BLOCK].tobytes()))
+        worst = max(worst, time.perf_counter() - began)
+        if ready and first is None:
+            first = (start + BLOCK) / rate + worst
+        frames += len(ready)
+    frames += len(splitter.feed(encoder.flush()) + splitter.finish())
+    return first, worst, frames
+
+
+def main():
+    print(f"{SECONDS} s recording, {BLOCK}-frame blocks, {FRAME_SIZE}-byte packets")
+    print(f"{'quality':<10} {'batch first':>12} {'stream first':>13} {'worst block':>12} {'block dur':>10} {'frames':>7}")
+    for quality in codec.QUALITY_PRESETS:
+        rate = codec.recording_rate(quality)
+        samples = common.synthetic_speech(SECONDS, rate)
+        encode_time, _ = common.timed(lambda: codec.encode_audio(samples.tobytes(), 1, 2, rate, quality))
+        first, worst, frames = stream(samples, rate, quality)
+        print(f"{quality:<10} {SECONDS + encode_time:>11.2f}s {first:>12.2f}s {worst * 1000:>10.1f}ms "
+              f"{BLOCK / rate * 1000:>8.0f}ms {frames:>7}")
+
+
+if __name__ == "__main__":
+    main()
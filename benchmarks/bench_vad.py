@@ -0,0 +1,44 @@
+"""Payload reduction from silence trimming on push-to-talk recordings
+
+Synthetic push-to-talk clips (lead-in, four phrases with pauses of 0.3 to
+1.2 s, a trailing second of room noise, about 8 s in all) are encoded with
+and without trim_silence. Reported per quality: payload bytes and packets
+both ways, the saving, the share of the recording still sent as audio and
+the VAD time.
+
+Run from the repository root:
+    python benchmarks/bench_vad.py
+"""
+import common
+import codec
+import vad
+import wire
+
+CLIPS = 5
+FRAME_SIZE = 180  # "Medium" chunks
+
+
+def main():
+    print(f"{CLIPS} push-to-talk clips, {FRAME_SIZE}-byte packets")
+    print(f"{'quality':<10} {'bytes':>7} {'trimmed':>8} {'saved':>6} {'packets':>8} {'trimmed':>8} "
+          f"{'audio sent':>11} {'VAD ms':>7}")
+    for quality in codec.QUALITY_PRESETS:
+        rate = codec.recording_rate(quality)
+        clips = [common.push_to_talk(rate, seed) for seed in range(CLIPS)]
+        full = [codec.encode_audio(clip.tobytes(), 1, 2, rate, quality) for clip in clips]
+        trimmed = [codec.encode_audio(clip.tobytes(), 1, 2, rate, quality, trim_silence=True) for clip in clips]
+        vad_time, spans = common.timed(lambda: [vad.speech_spans(clip, rate) for clip in clips], repeat=3)
+        sent = sum(stop - start for clip_spans in spans for start, stop in clip_spans)
+        total = sum(len(clip) for clip in clips)
+
+        full_bytes = sum(map(len, full))
+        trimmed_bytes = sum(map(len, trimmed))
+        full_packets = sum(len(wire.split_payload(0, payload, FRAME_SIZE)) for payload in full)
+        trimmed_packets = sum(len(wire.split_payload(0, payload, FRAME_SIZE)) for payload in trimmed)
+        print(f"{quality:<10} {full_bytes // CLIPS:>7} {trimmed_bytes // CLIPS:>8} "
+              f"{1 - trimmed_bytes / full_bytes:>6.0%} {full_packets / CLIPS:>8.1f} {trimmed_packets / CLIPS:>8.1f} "
+              f"{sent / total:>11.0%} {vad_time * 1000 / CLIPS:>7.2f}")
+
+
+if __name__ == "__main__":
+    main()
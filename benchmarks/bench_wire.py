@@ -0,0 +1,50 @@
+"""Airtime per second of audio: legacy JSON + base64 chunks vs binary frames
+
+Run from the repository root:
+    python benchmarks/bench_wire.py
+"""
+import base64
+import json
+import struct
+import zlib
+
+from common import synthetic_speech
+import codec
+import wire
+
+CHUNK_SIZES = {"Small": 150, "Medium": 180, "Large": 200}
+SECONDS = 10
+RECORD_RATE = 11025
+
+
+def legacy_packets(frames, sample_rate, sample_width, chunk_size):
+    """Packets the previous JSON + base64 sender produced for the same audio"""
+    header = f"{sample_rate},1,{sample_width}".encode()
+    compressed = zlib.compress(struct.pack('!B', len(header)) + header + frames, 9)
+    encoded = base64.b64encode(compressed).decode('utf-8')
+    total = -(-len(encoded) // chunk_size)
+    return [json.dumps({"chunk_id": "0123abcd", "chunk_num": i + 1, "total_chunks": total,
+                        "data": encoded[i * chunk_size:(i + 1) * chunk_size]}).encode('utf-8')
+            for i in range(total)]
+
+
+def main():
+    recording = synthetic_speech(SECONDS, RECORD_RATE).tobytes()
+    print(f"{SECONDS}s synthetic recording, bytes on air per second of audio (packets per second)")
+    print(f"{'quality':<10} {'chunk':<7} {'legacy':>16} {'binary':>16} {'saving':>7}")
+    for quality, preset in codec.QUALITY_PRESETS.items():
+        if preset["codec"] != codec.CODEC_PCM_ZLIB:
+            continue  # The legacy format only carried zlib PCM
+        frames, rate, width = codec.preprocess(recording, 1, 2, RECORD_RATE, quality)
+        payload = codec.encode_audio(recording, 1, 2, RECORD_RATE, quality)
+        for name, size in CHUNK_SIZES.items():
+            old = legacy_packets(frames, rate, width, size)
+            new = wire.split_payload(0x0123ABCD, payload, size)
+            old_rate = sum(map(len, old)) / SECONDS
+            new_rate = sum(map(len, new)) / SECONDS
+            print(f"{quality:<10} {name:<7} {old_rate:9.0f} ({len(old) / SECONDS:4.1f}) "
+                  f"{new_rate:9.0f} ({len(new) / SECONDS:4.1f}) {1 - new_rate / old_rate:6.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""Shared helpers for the benchmark scripts"""
+import os
+import sys
+import time
+
+import numpy as np
+
+# Make the application modules importable when running from benchmarks/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def synthetic_speech(seconds, rate, seed=0):
+    """Noisy harmonic int16 signal with a syllable-like envelope"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * rate)) / rate
+    envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 3 * t) ** 2
+    tone = sum(np.sin(2 * np.pi * f * t) / (k + 1) for k, f in enumerate((140, 280, 700, 1200)))
+    signal = envelope * tone / 2 + rng.normal(0, 0.05, t.size)
+    return (np.clip(signal, -1, 1) * 32767).astype(np.int16)
+
+
+def push_to_talk(rate, seed=0, lead=0.6, tail=1.0, phrases=(1.2, 0.8, 1.5, 0.6), pauses=(0.3, 0.9, 1.2)):
+    """Synthetic push-to-talk recording: phrases of speech separated by pauses
+
+    Lead-in, pauses and tail hold low-level background noise like a real
+    microphone picks up.
+    """
+    rng = np.random.default_rng(seed)
+    parts = [rng.normal(0, 30, int(lead * rate))]
+    for index, seconds in enumerate(phrases):
+        parts.append(synthetic_speech(seconds, rate, seed + index).astype(np.float64))
+        gap = pauses[index] if index < len(pauses) else tail
+        parts.append(rng.normal(0, 30, int(gap * rate)))
+    return np.clip(np.concatenate(parts), -32768, 32767).astype(np.int16)
+
+
+def timed(fn, repeat=1):
+    """Run fn `repeat` times and return (best time in seconds, last result)"""
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
@@ -0,0 +1,353 @@
+"""Command line and daemon mode, without Tkinter or an audio device
+
+    python cli.py send message.wav [more.wav ...] --port /dev/ttyUSB0 [--quality ADPCM] [--chunk Max]
+    python cli.py receive --port /dev/ttyUSB0 --out voice_messages
+    python cli.py encode message.wav message.voice [--quality Vocoder]
+    python cli.py decode message.voice message.wav
+
+`--port Simulator` opens the built-in simulated mesh, which hears its own
+packets. `send` also takes payloads written by `encode`. `receive` runs
+until SIGINT or SIGTERM and reconnects whenever the radio goes away, so it
+can run unattended (for example as a systemd service on a gateway).
+
+The exit status is 0 on success, 1 if a message could not be sent or a
+file could not be converted, and 2 for usage errors.
+
+All the work is done by the same VoiceEngine as in the GUI; other Python
+code can use it directly, with meshlink.connect to open a radio.
+"""
+import argparse
+import os
+import signal
+import sys
+import threading
+import time
+from datetime import datetime
+
+import codec
+import engine
+import fec
+import meshlink
+import metrics
+import profiling
+import wire
+
+STALL_CHECK_INTERVAL = 1  # Seconds between repair checks of stalled incoming messages
+RECONNECT_DELAY = 5  # Seconds between attempts to reopen a lost radio
+WAV_MAGIC = b"RIFF"
+
+
+class Console:
+    """Timestamped output; engine log lines only when verbose (safe from any thread)"""
+
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+        self.lock = threading.Lock()
+
+    def print(self, message, stream=None):
+        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with self.lock:
+            print(f"[{timestamp}] {message}", file=stream or sys.stdout, flush=True)
+
+    def log(self, message):
+        if self.verbose:
+            self.print(message, sys.stderr)
+
+    def error(self, message):
+        self.print(message, sys.stderr)
+
+
+def chunk_size(value):
+    """A chunk size preset name or a number of bytes"""
+    if value in engine.CHUNK_SIZES:
+        return engine.CHUNK_SIZES[value]
+    try:
+        return int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected one of {', '.join(engine.CHUNK_SIZES)} or a number of bytes")
+
+
+class Session:
+    """A VoiceEngine configured from the common options, with its metrics server and profiler"""
+
+    def __init__(self, args, console, **callbacks):
+        self.args = args
+        self.engine = engine.VoiceEngine(output_dir=args.out, log=console.log, **callbacks)
+        self.engine.max_chunk_size = args.chunk
+        self.engine.fec_overhead = args.fec
+        self.profiler = profiling.from_environment(args.profile, log=console.error)
+        if self.profiler is not None:
+            self.profiler.instrument(self.engine, engine.VoiceEngine.PROFILED)
+        self.metrics_server = None
+        if args.metrics_port is not None:
+            try:
+                self.metrics_server = metrics.MetricsServer(self.engine.metrics, args.metrics_port)
+                console.print(f"Serving metrics on http://127.0.0.1:{self.metrics_server.port}/metrics")
+            except OSError as e:
+                console.error(f"Metrics server not started: {str(e)}")
+
+    def write_metrics(self):
+        if self.args.metrics_file:
+            metrics.write_file(self.engine.metrics, self.args.metrics_file)
+
+    def close(self):
+        self.engine.close()
+        self.write_metrics()
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+        if self.profiler is not None:
+            self.profiler.close()
+
+
+def close_interface(interface, console):
+    try:
+        interface.close()
+    except Exception as e:
+        console.error(f"Error closing interface: {str(e)}")
+
+
+def load_payload(path, args):
+    """Encode a WAV file with the chosen settings, or read a payload written by `encode`"""
+    with open(path, 'rb') as f:
+        if f.read(len(WAV_MAGIC)) != WAV_MAGIC:
+            f.seek(0)
+            return f.read()
+    segment_seconds = codec.SEGMENT_SECONDS if args.progressive else None
+    return codec.encode_wav(path, args.quality, segment_seconds, args.trim_silence)
+
+
+def send(args, console):
+    """Send each file as a voice message and wait until all are finished"""
+    try:
+        payloads = [(path, load_payload(path, args)) for path in args.files]
+    except Exception as e:
+        console.error(f"Error reading audio: {str(e)}")
+        return 1
+
+    finished = {}  # message id -> SendStats
+    condition = threading.Condition()
+
+    def on_send_finished(message_id, stats):
+        with condition:
+            finished[message_id] = stats
+            condition.notify_all()
+
+    session = Session(args, console, on_send_finished=on_send_finished)
+    node = session.engine
+    try:
+        node.interface = meshlink.connect(args.port, node.on_receive)
+    except Exception as e:
+        console.error(f"Error connecting to {args.port}: {str(e)}")
+        session.close()
+        return 1
+
+    status = 0
+    try:
+        sent = []
+        for path, payload in payloads:
+            message_id = node.send_payload(payload)
+            sent.append((path, message_id))
+            console.print(f"Queued {path} as message {message_id:08x} ({len(payload)} bytes)")
+        deadline = time.monotonic() + args.timeout if args.timeout else None
+        with condition:
+            while len(finished) < len(sent):
+                remaining = deadline - time.monotonic() if deadline else None
+                if remaining is not None and remaining <= 0:
+                    break
+                condition.wait(remaining)
+        for path, message_id in sent:
+            stats = finished.get(message_id)
+            if stats is None:
+                console.error(f"{path}: timed out")
+                status = 1
+            elif stats.failed:
+                console.error(f"{path}: {stats.failed} chunks failed ({stats.summary()})")
+                status = 1
+            else:
+                console.print(f"{path}: sent ({stats.summary()})")
+    except KeyboardInterrupt:
+        console.error("Interrupted")
+        status = 1
+    finally:
+        node.stop_sending()
+        session.close()
+        close_interface(node.interface, console)
+    return status
+
+
+class ReceiveDaemon:
+    """Keep a radio open and save every voice message it receives"""
+
+    def __init__(self, args, console):
+        self.args = args
+        self.console = console
+        self.stop = threading.Event()
+        self.lost = threading.Event()
+        self.interface = None
+        self.session = Session(args, console, add_message=self.message_saved, on_test_message=self.test_message)
+        self.engine = self.session.engine
+        # Received packets are decoded on worker threads, not the meshtastic reader thread
+        self.engine.start_receive_workers()
+        if args.store:
+            self.engine.open_store(args.store)
+
+    def message_saved(self, description, filepath, live=None):
+        self.console.print(f"{description}: {filepath}")
+
+    def test_message(self, from_node, text):
+        self.console.print(f"Test message from {from_node}: {text}")
+
+    def connection_lost(self, interface=None):
+        """Called from the meshtastic thread when the serial link drops"""
+        if interface in (None, self.interface):
+            self.lost.set()
+
+    def connect(self):
+        try:
+            self.interface = meshlink.connect(self.args.port, self.engine.on_receive, self.connection_lost)
+        except Exception as e:
+            self.console.error(f"Error connecting to {self.args.port}: {str(e)}")
+            return False
+        self.engine.interface = self.interface
+        self.lost.clear()
+        node_num = meshlink.node_number(self.interface)
+        self.console.print(f"Connected to {self.args.port}" + (f", node {node_num}" if node_num is not None else ""))
+        self.engine.resume_transfers()
+        return True
+
+    def disconnect(self):
+        self.engine.suspend_transfers()
+        if self.interface is not None:
+            close_interface(self.interface, self.console)
+        self.interface = None
+        self.engine.interface = None
+
+    def run(self):
+        """Receive until stopped, reconnecting after a lost connection"""
+        self.console.print(f"Saving voice messages to {self.args.out}")
+        while not self.stop.is_set():
+            if not self.connect():
+                self.stop.wait(RECONNECT_DELAY)
+                continue
+            while not self.stop.is_set() and not self.lost.is_set():
+                self.engine.check_stalled_messages()
+                self.session.write_metrics()
+                self.stop.wait(STALL_CHECK_INTERVAL)
+            if self.lost.is_set():
+                self.console.error(f"Connection to {self.args.port} lost, reconnecting")
+            self.disconnect()
+            if self.lost.is_set():
+                self.stop.wait(RECONNECT_DELAY)
+        self.session.close()
+        self.console.print("Stopped")
+
+
+def receive(args, console):
+    daemon = ReceiveDaemon(args, console)
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda signum, frame: daemon.stop.set())
+    daemon.run()
+    return 0
+
+
+def encode(args, console):
+    """Encode a WAV file into a payload file and report its size on air"""
+    try:
+        params, frames = codec.read_wav(args.input)
+        segment_seconds = codec.SEGMENT_SECONDS if args.progressive else None
+        payload = codec.encode_audio(frames, params.channels, params.sample_width, params.sample_rate,
+                                     args.quality, segment_seconds=segment_seconds,
+                                     trim_silence=args.trim_silence)
+        with open(args.output, 'wb') as f:
+            f.write(payload)
+    except Exception as e:
+        console.error(f"Error encoding {args.input}: {str(e)}")
+        return 1
+    seconds = len(frames) / (params.channels * params.sample_width * params.sample_rate)
+    if args.fec > 0:
+        packets = len(fec.encode_frames(0, payload, args.chunk, args.fec))
+    else:
+        packets = len(wire.split_payload(0, payload, args.chunk))
+    console.print(f"{args.input}: {seconds:.1f} s, {len(frames)} bytes -> {args.output}: {len(payload)} bytes "
+                  f"({args.quality}), {packets} packets of up to {args.chunk} bytes")
+    return 0
+
+
+def decode(args, console):
+    """Decode a payload file into a WAV file"""
+    try:
+        with open(args.input, 'rb') as f:
+            params = codec.decode_to_wav(f.read(), args.output)
+    except Exception as e:
+        console.error(f"Error decoding {args.input}: {str(e)}")
+        return 1
+    console.print(f"{args.input} -> {args.output}: {params.sample_rate} Hz, {params.channels} channels, "
+                  f"{params.sample_width * 8}-bit")
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Meshtastic voice messages from the command line")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print the engine's log on stderr")
+    parser.add_argument("--profile", metavar="DIR",
+                        help=f"profile the send and receive paths into DIR (or set {profiling.ENV_VAR})")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def audio_options(command):
+        command.add_argument("--quality", choices=list(codec.QUALITY_PRESETS), default=codec.DEFAULT_QUALITY,
+                             help=f"compression quality (default {codec.DEFAULT_QUALITY})")
+        command.add_argument("--progressive", action="store_true",
+                             help="encode in ~1 s segments that play before the whole message arrives")
+        command.add_argument("--trim-silence", action="store_true", help="drop silence and shorten long pauses")
+
+    def link_options(command):
+        command.add_argument("--chunk", type=chunk_size, default=engine.CHUNK_SIZES["Medium"],
+                             help=f"chunk size: {', '.join(engine.CHUNK_SIZES)} or bytes (default Medium)")
+        command.add_argument("--fec", type=float, default=0.0,
+                             help="parity chunks per data chunk, e.g. 0.25 (default 0, off)")
+
+    def engine_options(command, out_help):
+        command.add_argument("--port", required=True, help="serial port of the radio, or Simulator")
+        command.add_argument("--out", default="voice_messages", help=out_help)
+        command.add_argument("--metrics-port", type=int, help="serve Prometheus metrics on this port")
+        command.add_argument("--metrics-file", help="write Prometheus metrics to this file")
+
+    command = commands.add_parser("send", help="send WAV files (or encoded payloads) as voice messages")
+    command.add_argument("files", nargs="+", metavar="FILE")
+    audio_options(command)
+    link_options(command)
+    engine_options(command, "directory for anything received meanwhile (default voice_messages)")
+    command.add_argument("--timeout", type=float, default=0,
+                         help="give up after this many seconds (default 0, wait until sent)")
+    command.set_defaults(run=send)
+
+    command = commands.add_parser("receive", help="save received voice messages until stopped")
+    link_options(command)
+    engine_options(command, "directory for received messages (default voice_messages)")
+    command.add_argument("--store", help="transfer store file, so partial messages survive restarts")
+    command.set_defaults(run=receive)
+
+    command = commands.add_parser("encode", help="encode a WAV file into a payload file")
+    command.add_argument("input")
+    command.add_argument("output")
+    audio_options(command)
+    link_options(command)
+    command.set_defaults(run=encode)
+
+    command = commands.add_parser("decode", help="decode a payload file into a WAV file")
+    command.add_argument("input")
+    command.add_argument("output")
+    command.set_defaults(run=decode)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    console = Console(args.verbose)
+    if getattr(args, 'out', None):
+        os.makedirs(args.out, exist_ok=True)
+    return args.run(args, console)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,421 @@
+"""Audio payload encoding for voice messages
+
+An encoded payload is a small binary audio header followed by the codec body:
+
+    codec id (1 byte) | sample rate (2 bytes) | channels << 4 | sample width (1 byte) | body
+
+For CODEC_PCM_ZLIB the body is zlib-compressed PCM, and CODEC_PCM8_ZLIB is
+the same for unsigned 8-bit PCM (8-bit CODEC_PCM_ZLIB bodies come from older
+versions, which sent signed samples); for CODEC_LPC it is the parametric
+bitstream from lpc.py (8 kHz, 16-bit mono); for CODEC_ADPCM it is
+zlib-compressed 4-bit IMA ADPCM of 16-bit mono audio. CODEC_SEGMENTED wraps
+either of them in independently decodable segments of about SEGMENT_SECONDS,
+each `inner codec (1 byte) | length (2 bytes) | body`, so a receiver can
+play the start of a message while the rest is still arriving. With silence
+trimming, long pauses become CODEC_SILENCE segments whose body is the number
+of silent sample frames (4 bytes), and the decoder writes silence in their
+place. Payloads produced by older versions start with an ASCII
+"rate,channels,width" header inside the zlib stream instead;
+decode_legacy_audio handles those.
+
+StreamEncoder produces the same payload format block by block while audio is
+still being captured.
+
+encode_wav and decode_to_wav convert between WAV files and payloads, for
+the command line and other code that works on files.
+"""
+import struct
+import wave
+import zlib
+from collections import namedtuple
+
+from lazyimport import lazy_import
+
+import dsp
+import lpc
+import pcm
+import vad
+
+np = lazy_import("numpy")  # Imported on first use, keeping numpy out of startup
+
+CODEC_PCM_ZLIB = 1
+CODEC_LPC = 2
+CODEC_SEGMENTED = 3
+CODEC_SILENCE = 4  # Segments only
+CODEC_ADPCM = 5
+CODEC_PCM8_ZLIB = 6  # Unsigned 8-bit PCM; receivers without it report an unsupported codec
+MONO_CODECS = (CODEC_LPC, CODEC_ADPCM)  # Encode 16-bit mono at the preset rate
+
+CODEC_VERSION = 2  # Bump when the same input and preset encode differently (payload caches use it)
+
+AUDIO_HEADER = struct.Struct('!BHB')
+SEGMENT_HEADER = struct.Struct('!BH')
+SILENCE_BODY = struct.Struct('!I')
+SEGMENT_SECONDS = 1.0
+SIGNED_TO_UNSIGNED = bytes((value + 128) & 0xFF for value in range(256))  # bytes.translate table
+MAX_SEGMENT_PCM = 60000  # PCM bytes per segment, so a zlib body always fits the 2-byte length
+
+AudioParams = namedtuple('AudioParams', 'sample_rate channels sample_width')
+
+# Encode settings for each compression quality, smallest first. "width" forces a
+# sample width, "threshold"/"ratio" configure the dynamic range compressor
+# (None disables it) and "frame_length" is the LPC frame in samples.
+QUALITY_PRESETS = {
+    "Vocoder": {"codec": CODEC_LPC, "rate": lpc.SAMPLE_RATE, "width": None,
+                "threshold": None, "ratio": None, "frame_length": 180},
+    "Ultra Low": {"codec": CODEC_PCM_ZLIB, "rate": 4000, "width": 1, "threshold": 0.6, "ratio": 0.7},
+    "ADPCM": {"codec": CODEC_ADPCM, "rate": 8000, "width": None, "threshold": 0.7, "ratio": 0.8},
+    "Very Low": {"codec": CODEC_PCM_ZLIB, "rate": 8000, "width": None, "threshold": 0.7, "ratio": 0.8},
+    "Low": {"codec": CODEC_PCM_ZLIB, "rate": 11025, "width": None, "threshold": None, "ratio": None},
+}
+DEFAULT_QUALITY = "Low"
+
+
+def unsigned_8bit(frames):
+    """Signed 8-bit PCM as the unsigned 8-bit PCM of WAV files and CODEC_PCM8_ZLIB
+
+    Signed 8-bit is what the bit depth converter and audioop produce, and
+    what 8-bit CODEC_PCM_ZLIB and legacy payloads carry.
+    """
+    return bytes(frames).translate(SIGNED_TO_UNSIGNED)
+
+
+def get_preset(quality):
+    """Return the encode settings for a quality name"""
+    return QUALITY_PRESETS.get(quality, QUALITY_PRESETS[DEFAULT_QUALITY])
+
+
+def recording_rate(quality):
+    """Sample rate to record at for a given quality"""
+    return get_preset(quality)["rate"]
+
+
+def downsample(frames, channels, sample_width, original_rate, target_rate):
+    """Resample audio to another (usually lower) sample rate"""
+    return pcm.resample(frames, sample_width, channels, original_rate, target_rate)
+
+
+def preprocess(frames, channels, sample_width, sample_rate, quality):
+    """Apply the resampling, bit depth and dynamic range stages for a quality
+
+    Returns (frames, sample_rate, sample_width) of the processed PCM. Frames
+    may be any bytes-like object and are not copied when no stage applies;
+    the result is a bytes-like view.
+    """
+    preset = get_preset(quality)
+
+    # Downsample audio if needed (reduce sample rate)
+    if sample_rate > preset["rate"]:
+        frames = downsample(frames, channels, sample_width, sample_rate, preset["rate"])
+        sample_rate = preset["rate"]
+
+    # Reduce bit depth if the preset asks for it
+    if preset["width"] and sample_width > preset["width"]:
+        converter = dsp.BitDepthConverter(sample_width, preset["width"])
+        frames = as_bytes(converter(dsp.pcm_to_array(frames, sample_width)))
+        if preset["width"] == 1:
+            frames = unsigned_8bit(frames)
+        sample_width = preset["width"]
+
+    # Apply amplitude compression (reduce dynamic range)
+    if preset["threshold"] is not None:
+        chain = dsp.dynamic_range_chain(sample_width, preset["threshold"], preset["ratio"])
+        frames = as_bytes(chain(dsp.pcm_to_array(frames, sample_width)))
+
+    return frames, sample_rate, sample_width
+
+
+def as_bytes(samples):
+    """View a contiguous sample array as bytes without copying"""
+    return memoryview(np.ascontiguousarray(samples)).cast('B')
+
+
+def pack_audio_header(codec, sample_rate, channels, sample_width):
+    """Pack the binary audio header"""
+    return AUDIO_HEADER.pack(codec, sample_rate, (channels << 4) | sample_width)
+
+
+def unpack_audio_header(payload):
+    """Unpack the binary audio header, returning (codec, AudioParams)"""
+    if len(payload) < AUDIO_HEADER.size:
+        raise ValueError("Audio payload too short")
+    codec, sample_rate, layout = AUDIO_HEADER.unpack_from(payload)
+    return codec, AudioParams(sample_rate, layout >> 4, layout & 0x0F)
+
+
+def pcm_to_mono_int16(frames, channels, sample_width):
+    """Convert PCM bytes to a mono float array on the int16 scale"""
+    samples = dsp.Normalize(sample_width)(dsp.pcm_to_array(frames, sample_width)) * 32768
+    if channels > 1:
+        samples = samples[:len(samples) // channels * channels].reshape(-1, channels).mean(axis=1)
+    return samples
+
+
+def payload_codec(codec, sample_width):
+    """The codec id to send a preset's audio under once it is `sample_width` bytes wide"""
+    return CODEC_PCM8_ZLIB if codec == CODEC_PCM_ZLIB and sample_width == 1 else codec
+
+
+def segment_bytes(codec, params, preset, seconds):
+    """PCM bytes per segment, whole frames (whole LPC frames, ADPCM byte pairs) only"""
+    unit = {CODEC_LPC: preset.get("frame_length"), CODEC_ADPCM: 2}.get(codec, 1)
+    samples = max(1, int(params.sample_rate * seconds) // unit) * unit
+    frame_bytes = params.channels * params.sample_width
+    return min(samples, max(1, MAX_SEGMENT_PCM // (frame_bytes * unit)) * unit) * frame_bytes
+
+
+def encode_body(codec, frames, preset):
+    """Encode processed PCM (16-bit mono for MONO_CODECS) into a codec body"""
+    if codec == CODEC_LPC:
+        return lpc.encode(np.frombuffer(frames, dtype=np.int16), preset["frame_length"])
+    if codec == CODEC_ADPCM:
+        return zlib.compress(pcm.adpcm_encode(np.frombuffer(frames, dtype=np.int16)), 9)
+    return zlib.compress(frames, 9)
+
+
+def encode_segment(codec, frames, preset):
+    """Encode one self-contained segment of processed PCM"""
+    body = encode_body(codec, frames, preset)
+    return SEGMENT_HEADER.pack(codec, len(body)) + body
+
+
+def silence_segment(count):
+    """Segment standing for `count` silent sample frames"""
+    return SEGMENT_HEADER.pack(CODEC_SILENCE, SILENCE_BODY.size) + SILENCE_BODY.pack(count)
+
+
+def encode_audio(frames, channels, sample_width, sample_rate, quality, segment_seconds=None, trim_silence=False):
+    """Encode raw PCM into a payload ready for chunking
+
+    With `segment_seconds` the payload uses CODEC_SEGMENTED so it can be
+    played progressively. With `trim_silence` leading and trailing silence
+    is dropped and long pauses are sent as silence markers.
+    """
+    preset = get_preset(quality)
+    frames, sample_rate, sample_width = preprocess(frames, channels, sample_width, sample_rate, quality)
+    codec = payload_codec(preset["codec"], sample_width)
+    frame_length = None
+    if preset["codec"] in MONO_CODECS:
+        if sample_rate != preset["rate"]:
+            frames = downsample(frames, channels, sample_width, sample_rate, preset["rate"])
+            sample_rate = preset["rate"]
+        if (channels, sample_width) != (1, 2):
+            frames = as_bytes(pcm_to_mono_int16(frames, channels, sample_width).astype(np.int16))
+            channels, sample_width = 1, 2
+        if preset["codec"] == CODEC_LPC:
+            # Cut only at LPC frame boundaries
+            frame_length = preset["frame_length"]
+
+    frame_bytes = channels * sample_width
+    spans = [(0, len(frames) // frame_bytes)]
+    if trim_silence:
+        samples = pcm_to_mono_int16(frames, channels, sample_width)
+        spans = vad.speech_spans(samples, sample_rate, frame_length)
+
+    if segment_seconds or spans != [(0, len(frames) // frame_bytes)]:
+        params = AudioParams(sample_rate, channels, sample_width)
+        size = segment_bytes(codec, params, preset, segment_seconds or len(frames) / (frame_bytes * sample_rate))
+        segments = []
+        for index, (start, stop) in enumerate(spans):
+            if index:
+                segments.append(silence_segment(start - spans[index - 1][1]))
+            audio = frames[start * frame_bytes:stop * frame_bytes]
+            segments += [encode_segment(codec, audio[offset:offset + size], preset)
+                         for offset in range(0, len(audio), size)]
+        return pack_audio_header(CODEC_SEGMENTED, sample_rate, channels, sample_width) + b"".join(segments)
+
+    header = pack_audio_header(codec, sample_rate, channels, sample_width)
+    return header + encode_body(codec, frames, preset)
+
+
+class StreamEncoder:
+    """Encode PCM blocks as they are recorded
+
+    `write` returns the payload bytes that are ready so far (starting with the
+    audio header) and `flush` returns the rest once recording stops. Joined
+    together they decode with decode_audio like an encode_audio payload.
+
+    zlib holds output back until its window fills, which could be seconds of
+    audio. When it has held `flush_interval` seconds, a sync flush releases
+    them at the cost of a few bytes. With `segment_seconds` the output is a
+    CODEC_SEGMENTED payload and each segment is emitted once it is full.
+    """
+
+    def __init__(self, channels, sample_width, sample_rate, quality, flush_interval=0.5, segment_seconds=None):
+        self.quality = quality
+        self.flush_interval = flush_interval
+        self.segment_seconds = segment_seconds
+        self.segment = bytearray()
+        self.held = 0.0  # Seconds of audio inside the zlib compressor
+        self.preset = get_preset(quality)
+        self.channels = channels
+        self.sample_width = sample_width
+        self.sample_rate = sample_rate
+
+        if self.preset["codec"] in MONO_CODECS:
+            self.target_rate = self.preset["rate"]
+            self.params = AudioParams(self.target_rate, 1, 2)
+        else:
+            self.target_rate = min(sample_rate, self.preset["rate"])
+            width = sample_width
+            if self.preset["width"] and sample_width > self.preset["width"]:
+                width = self.preset["width"]
+            self.params = AudioParams(self.target_rate, channels, width)
+        if self.preset["codec"] == CODEC_LPC:
+            self.lpc = lpc.StreamEncoder(self.preset["frame_length"])
+        else:
+            self.compressor = zlib.compressobj(9)
+            self.adpcm = pcm.AdpcmEncoder() if self.preset["codec"] == CODEC_ADPCM else None
+        # Keeps the filter state between blocks so block edges don't click
+        self.resampler = None
+        if self.target_rate != sample_rate:
+            self.resampler = pcm.Resampler(sample_rate, self.target_rate, channels)
+
+        self.codec = codec = payload_codec(self.preset["codec"], self.params.sample_width)
+        if segment_seconds:
+            self.segment_size = segment_bytes(codec, self.params, self.preset, segment_seconds)
+            codec = CODEC_SEGMENTED
+        self.header = pack_audio_header(codec, *self.params)
+
+    def write(self, frames):
+        """Encode a block of raw PCM and return any finished payload bytes"""
+        output, self.header = self.header, b""
+        if self.resampler:
+            frames = pcm.from_float(self.resampler.process(pcm.to_float(frames, self.sample_width, self.channels)),
+                                    self.sample_width)
+        return output + self._encode(frames)
+
+    def flush(self):
+        """Return the payload bytes still buffered in the encoder"""
+        output, self.header = self.header, b""
+        if self.resampler:
+            output += self._encode(pcm.from_float(self.resampler.flush(), self.sample_width))
+        if self.segment_seconds:
+            if self.segment:
+                output += encode_segment(self.codec, bytes(self.segment), self.preset)
+                self.segment = bytearray()
+            return output
+        if self.preset["codec"] == CODEC_LPC:
+            return output + self.lpc.flush()
+        if self.adpcm:
+            output += self.compressor.compress(self.adpcm.flush())
+        return output + self.compressor.flush()
+
+    def _encode(self, frames):
+        """Encode a block of PCM already at the target rate"""
+        frames, _, width = preprocess(frames, self.channels, self.sample_width, self.target_rate, self.quality)
+        if self.preset["codec"] in MONO_CODECS:
+            samples = pcm_to_mono_int16(frames, self.channels, width).astype(np.int16)
+            if self.preset["codec"] == CODEC_LPC and not self.segment_seconds:
+                return self.lpc.write(samples)
+            frames, width = samples.tobytes(), 2
+        if self.segment_seconds:
+            self.segment += frames
+            output = b""
+            while len(self.segment) >= self.segment_size:
+                output += encode_segment(self.codec, bytes(self.segment[:self.segment_size]), self.preset)
+                del self.segment[:self.segment_size]
+            return output
+        seconds = len(frames) / (self.params.channels * width * self.target_rate)
+        if self.adpcm:
+            frames = self.adpcm.encode(np.frombuffer(frames, dtype=np.int16))
+        compressed = self.compressor.compress(frames)
+        self.held = 0.0 if compressed else self.held + seconds
+        if self.held >= self.flush_interval:
+            compressed += self.compressor.flush(zlib.Z_SYNC_FLUSH)
+            self.held = 0.0
+        return compressed
+
+
+def split_segments(data):
+    """Parse the complete segments at the start of a segmented body
+
+    Returns ([(inner codec, body), ...], bytes consumed); a trailing partial
+    segment is left for later.
+    """
+    segments = []
+    offset = 0
+    while len(data) - offset >= SEGMENT_HEADER.size:
+        codec, length = SEGMENT_HEADER.unpack_from(data, offset)
+        end = offset + SEGMENT_HEADER.size + length
+        if end > len(data):
+            break
+        segments.append((codec, bytes(data[offset + SEGMENT_HEADER.size:end])))
+        offset = end
+    return segments, offset
+
+
+def decode_segment(codec, body, params):
+    """Decode one segment body to PCM bytes in the payload's format"""
+    if codec == CODEC_PCM_ZLIB:
+        frames = zlib.decompress(body)
+        return unsigned_8bit(frames) if params.sample_width == 1 else frames
+    if codec == CODEC_PCM8_ZLIB:
+        return zlib.decompress(body)
+    if codec == CODEC_LPC:
+        return lpc.decode(body).tobytes()
+    if codec == CODEC_ADPCM:
+        return pcm.adpcm_decode(zlib.decompress(body)).tobytes()
+    if codec == CODEC_SILENCE:
+        # 8-bit PCM is unsigned, so its silence is 0x80
+        fill = b"\x80" if params.sample_width == 1 else b"\x00"
+        return fill * (SILENCE_BODY.unpack(body)[0] * params.channels * params.sample_width)
+    raise ValueError(f"Unsupported segment codec {codec}")
+
+
+def decode_audio(payload):
+    """Decode a payload produced by encode_audio, returning (AudioParams, frames)"""
+    codec, params = unpack_audio_header(payload)
+    body = payload[AUDIO_HEADER.size:]
+    if codec == CODEC_SEGMENTED:
+        segments, consumed = split_segments(body)
+        if consumed != len(body):
+            raise ValueError("Truncated audio segment")
+        return params, b"".join(decode_segment(inner, data, params) for inner, data in segments)
+    if codec in (CODEC_PCM_ZLIB, CODEC_PCM8_ZLIB, CODEC_LPC, CODEC_ADPCM):
+        return params, decode_segment(codec, body, params)
+    raise ValueError(f"Unsupported codec {codec}")
+
+
+def decode_legacy_audio(decompressed_data):
+    """Decode the old ASCII-header payload (after zlib), returning (AudioParams, frames)"""
+    # Parse the header (first few bytes contain sample rate and other info)
+    header_size = struct.unpack('!B', decompressed_data[0:1])[0]
+    header_data = decompressed_data[1:1 + header_size]
+    audio_data = decompressed_data[1 + header_size:]
+
+    header_parts = header_data.split(b',')
+    params = AudioParams(int(header_parts[0]), int(header_parts[1]), int(header_parts[2]))
+    if params.sample_width == 1:
+        audio_data = unsigned_8bit(audio_data)
+    return params, audio_data
+
+
+def read_wav(path):
+    """Read a WAV file, returning (AudioParams, frames)"""
+    with wave.open(path, 'rb') as wf:
+        params = AudioParams(wf.getframerate(), wf.getnchannels(), wf.getsampwidth())
+        return params, wf.readframes(wf.getnframes())
+
+
+def write_wav(path, params, frames):
+    """Write PCM frames to a WAV file"""
+    with wave.open(path, 'wb') as wf:
+        wf.setnchannels(params.channels)
+        wf.setsampwidth(params.sample_width)
+        wf.setframerate(params.sample_rate)
+        wf.writeframes(frames)
+
+
+def encode_wav(path, quality, segment_seconds=None, trim_silence=False):
+    """Encode a WAV file into a payload (see encode_audio)"""
+    params, frames = read_wav(path)
+    return encode_audio(frames, params.channels, params.sample_width, params.sample_rate, quality,
+                        segment_seconds=segment_seconds, trim_silence=trim_silence)
+
+
+def decode_to_wav(payload, path):
+    """Decode a payload into a WAV file, returning its AudioParams"""
+    params, frames = decode_audio(payload)
+    write_wav(path, params, frames)
+    return params
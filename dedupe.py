@@ -0,0 +1,74 @@
+"""Drop duplicate packets before they are parsed
+
+Rebroadcasting nodes repeat a packet with its original packet id, and
+senders resend chunks (with new packet ids) that were received but whose
+ack was lost. Either way the receiver would log, CRC-check, store and
+count the same chunk again, and a duplicate single-packet message could be
+saved twice.
+
+DuplicateFilter remembers the most recent keys in a bounded LRU, so its
+memory is fixed however long the node runs. The engine checks one filter
+keyed on (sender, packet id) and one keyed on the chunk: (sender, message
+id, seq) read straight from a binary frame header, or (sender, chunk_id,
+chunk_num) for legacy JSON chunks. A key that falls out of the LRU only
+means a very late duplicate gets through to the reassembly buffer, which
+ignores it there.
+"""
+import threading
+from collections import OrderedDict
+
+DEFAULT_CAPACITY = 4096  # Keys remembered per filter
+
+
+class DuplicateFilter:
+    """Bounded LRU of recently seen keys"""
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        self.keys = OrderedDict()
+        self.checked = 0
+        self.dropped = 0  # Duplicates found
+
+    def __len__(self):
+        return len(self.keys)
+
+    def seen(self, key):
+        """Record a key and return True if it was already seen"""
+        with self.lock:
+            if self._check(key):
+                return True
+            self._add(key)
+            return False
+
+    def check(self, key):
+        """Return True (and count a drop) if a key was seen, without recording it
+
+        For keys read from unvalidated data: add() them once the packet
+        turns out to be valid, so a corrupt copy cannot hide the good one.
+        """
+        with self.lock:
+            return self._check(key)
+
+    def add(self, key):
+        with self.lock:
+            self._add(key)
+
+    def _check(self, key):
+        self.checked += 1
+        if key in self.keys:
+            self.keys.move_to_end(key)
+            self.dropped += 1
+            return True
+        return False
+
+    def _add(self, key):
+        self.keys[key] = None
+        self.keys.move_to_end(key)
+        if len(self.keys) > self.capacity:
+            self.keys.popitem(last=False)
+
+    def discard(self, key):
+        """Forget a key so the same packet is accepted again"""
+        with self.lock:
+            self.keys.pop(key, None)
@@ -0,0 +1,124 @@
+"""Vectorized DSP stages for the voice encode pipeline.
+
+Every stage is a callable that takes a NumPy array and returns a new one, so
+stages can be chained with DSPChain without any per-sample Python code.
+"""
+from lazyimport import lazy_import
+
+np = lazy_import("numpy")  # Imported on first use, keeping numpy out of startup
+
+# Full-scale value used to map integer PCM to the -1.0 to 1.0 range
+FULL_SCALE = {1: 128.0, 2: 32768.0}
+
+# Signed dtypes used for bit depth conversion (audioop semantics: 8-bit is signed)
+SIGNED_DTYPES = {1: "int8", 2: "int16", 4: "int32"}
+
+
+def pcm_to_array(frames, sample_width):
+    """View raw PCM bytes as a NumPy array without copying"""
+    if sample_width == 1:
+        # 8-bit WAV audio is unsigned
+        return np.frombuffer(frames, dtype=np.uint8)
+    return np.frombuffer(frames, dtype=SIGNED_DTYPES[sample_width])
+
+
+class DSPChain:
+    """Run a sequence of DSP stages over an array of samples"""
+
+    def __init__(self, *stages):
+        self.stages = list(stages)
+
+    def __call__(self, samples):
+        for stage in self.stages:
+            samples = stage(samples)
+        return samples
+
+
+class Normalize:
+    """Convert integer PCM to float32 in the -1.0 to 1.0 range"""
+
+    def __init__(self, sample_width):
+        self.sample_width = sample_width
+
+    def __call__(self, samples):
+        if samples.dtype == np.float32:
+            return samples
+        # Scale the converted copy in place rather than allocating another array
+        samples = samples.astype(np.float32)
+        if self.sample_width == 1:
+            # Convert unsigned 8-bit to signed before scaling
+            samples -= 128
+        samples /= np.float32(FULL_SCALE[self.sample_width])
+        return samples
+
+
+class SoftKneeCompressor:
+    """Reduce the dynamic range of float samples above a threshold
+
+    `ratio` is the slope applied above `threshold` (0.7 keeps 70% of the
+    excess). With `knee` > 0 the transition is a quadratic curve spanning
+    `knee` around the threshold; the default hard knee matches the original
+    per-sample implementation exactly.
+    """
+
+    def __init__(self, threshold=0.6, ratio=0.7, knee=0.0):
+        self.threshold = threshold
+        self.ratio = ratio
+        self.knee = knee
+
+    def __call__(self, samples):
+        threshold = self.threshold
+        ratio = self.ratio
+        magnitude = np.abs(samples)
+        result = np.array(samples, dtype=np.float32)
+
+        # Only the samples above the knee are computed, in place in the copy
+        # Hard knee: threshold + (x - threshold) * ratio, mirrored for negative samples
+        over = magnitude > threshold + self.knee / 2
+        result[over] = np.copysign(threshold + (magnitude[over] - threshold) * ratio, samples[over])
+
+        if self.knee > 0:
+            low = threshold - self.knee / 2
+            in_knee = (magnitude > low) & ~over
+            bent = magnitude[in_knee]
+            curved = bent + (ratio - 1) * (bent - low) ** 2 / (2 * self.knee)
+            result[in_knee] = np.copysign(curved, samples[in_knee])
+
+        return result
+
+
+class Quantize:
+    """Convert float samples back to integer PCM of the given width"""
+
+    def __init__(self, sample_width):
+        self.sample_width = sample_width
+
+    def __call__(self, samples):
+        if self.sample_width == 1:
+            # Back to unsigned 8-bit
+            return (samples * 128 + 128).astype(np.uint8)
+        return (samples * 32768).astype(np.int16)
+
+
+class BitDepthConverter:
+    """Change the sample width of signed integer PCM (like audioop.lin2lin)"""
+
+    def __init__(self, source_width, target_width):
+        self.source_width = source_width
+        self.target_width = target_width
+
+    def __call__(self, samples):
+        shift = 8 * (self.source_width - self.target_width)
+        samples = samples.astype(SIGNED_DTYPES[max(self.source_width, self.target_width)])
+        if shift > 0:
+            samples = samples >> shift
+        elif shift < 0:
+            samples = samples << -shift
+        return samples.astype(SIGNED_DTYPES[self.target_width])
+
+
+def dynamic_range_chain(sample_width, threshold=0.6, ratio=0.7, knee=0.0):
+    """Build the normalize -> compress -> quantize chain used before zlib"""
+    return DSPChain(Normalize(sample_width),
+                    SoftKneeCompressor(threshold, ratio, knee),
+                    Quantize(sample_width))
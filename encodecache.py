@@ -0,0 +1,94 @@
+"""Background encoding with a cache of encoded payloads
+
+Encoding starts on a worker thread as soon as a recording is finished, so
+pressing Send usually finds the payload ready. Payloads are kept in an LRU
+cache keyed by (recording hash, quality, encode options, codec version) and
+bounded by total size. Sending again, or after changing the chunk size or
+FEC, which are applied after encoding, reuses the cached bytes.
+
+Encode times are recorded as the "compress" stage of a metrics registry.
+"""
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import codec
+import metrics
+
+MAX_CACHE_BYTES = 4 * 1024 * 1024
+
+
+class EncodeCache:
+    """Encode recordings in the background and remember the payloads"""
+
+    def __init__(self, max_bytes=MAX_CACHE_BYTES, encode=codec.encode_audio, registry=None):
+        self.max_bytes = max_bytes
+        self.encode = encode
+        self.lock = threading.Lock()
+        self.payloads = OrderedDict()  # key -> payload, least recently used first
+        self.size = 0  # Bytes held in payloads
+        self.pending = {}  # key -> Future of an encode in progress
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="encode")
+        self.hits = 0  # Requests answered from the cache
+        self.misses = 0  # Encodes started
+
+        registry = registry or metrics.Registry()
+        self.encode_timer = metrics.stage_timer(registry, "compress")
+        registry.function("counter", "voice_encode_cache_requests_total", "Encode requests by cache outcome",
+                          lambda: {("hit",): self.hits, ("miss",): self.misses}, ("result",))
+        registry.function("gauge", "voice_encode_cache_bytes", "Encoded payload bytes held in the cache",
+                          lambda: self.size)
+
+    @staticmethod
+    def key(recording, quality, segment_seconds=None, trim_silence=False):
+        """Cache key for a recording encoded with the given settings"""
+        return (recording.digest(), quality, segment_seconds, trim_silence, codec.CODEC_VERSION)
+
+    def submit(self, recording, quality, segment_seconds=None, trim_silence=False):
+        """Start encoding in the background unless the payload is cached or pending
+
+        Returns a Future for the payload.
+        """
+        key = self.key(recording, quality, segment_seconds, trim_silence)
+        with self.lock:
+            payload = self.payloads.get(key)
+            if payload is not None:
+                self.payloads.move_to_end(key)
+                self.hits += 1
+                future = Future()
+                future.set_result(payload)
+                return future
+            future = self.pending.get(key)
+            if future is None:
+                self.misses += 1
+                future = self.executor.submit(self._encode, key, recording, quality, segment_seconds, trim_silence)
+                self.pending[key] = future
+            return future
+
+    def get(self, recording, quality, segment_seconds=None, trim_silence=False):
+        """Return the payload, waiting for a background encode or encoding now"""
+        return self.submit(recording, quality, segment_seconds, trim_silence).result()
+
+    def _encode(self, key, recording, quality, segment_seconds, trim_silence):
+        params = recording.params
+        try:
+            with self.encode_timer.time():
+                payload = self.encode(recording.frames(), params.channels, params.sample_width, params.sample_rate,
+                                      quality, segment_seconds=segment_seconds, trim_silence=trim_silence)
+        except Exception:
+            with self.lock:
+                del self.pending[key]
+            raise
+        with self.lock:
+            del self.pending[key]
+            self.payloads[key] = payload
+            self.size += len(payload)
+            # Always keep the newest payload, even if it alone is over the limit
+            while self.size > self.max_bytes and len(self.payloads) > 1:
+                _, evicted = self.payloads.popitem(last=False)
+                self.size -= len(evicted)
+        return payload
+
+    def close(self):
+        """Stop the worker once queued encodes are done"""
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,947 @@
+"""Voice message transfer engine
+
+Everything between a Meshtastic interface and the audio files: framing
+payloads and queueing them on the prioritized transmit scheduler, receiving
+and reassembling chunks, repairs, streamed and progressive messages. It has
+no GUI; the app (or a benchmark) hands it an interface with `sendData` and
+forwards received packets to `on_receive`.
+
+UI effects go through callbacks:
+- log(text) and progress(key, text), where None clears the progress
+- add_message(description, filepath, live=None), which returns a handle
+- update_message(handle, description, filepath=None)
+- on_test_message(from_node, text)
+- on_send_finished(message_id, stats)
+
+Callbacks run on whichever thread did the work, so they must be thread-safe.
+After start_receive_workers(), on_receive only queues packets and they are
+processed on receive worker threads (see receivepool.py).
+
+With a transfer store (open_store), outgoing messages and incoming partials
+are also kept on disk: restore() reloads them after a restart,
+suspend_transfers() pauses our messages when the link goes down and
+resume_transfers() continues them, and any stored unacked chunks, once it
+is back.
+
+Stage timings, packet and byte counts, reassembly occupancy and per-peer
+delivery outcomes are recorded in `metrics`, a metrics.Registry that the
+app exports (see metrics.py).
+"""
+import base64
+import inspect
+import json
+import os
+import queue
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+import codec
+import dedupe
+import fec
+import metrics
+import packer
+import progressive
+import reassembly
+import receivepool
+import repair
+import scheduler
+import sender
+import transferstore
+import wire
+
+# Chunk size presets, in whole packet bytes including the binary frame header
+CHUNK_SIZES = {
+    "Small": 150,    # More reliable, more chunks
+    "Medium": 180,   # Balance between reliability and speed
+    "Large": 200,    # Faster transfer, less reliable
+    "Max": packer.DEFAULT_MAX_PAYLOAD  # Fewest packets; capped at the connected radio's limit
+}
+
+
+class VoiceEngine:
+    """Send and receive chunked voice messages over one interface"""
+
+    # Hot paths wrapped when profiling is on (see profiling.py)
+    PROFILED = ("send_payload", "send_frame", "process_voice_message", "reassemble_message",
+                "create_wav_from_compressed")
+
+    def __init__(self, interface=None, output_dir="voice_messages", log=None, progress=None,
+                 add_message=None, update_message=None, on_test_message=None, on_send_finished=None,
+                 registry=None):
+        self.interface = interface
+        self.output_dir = output_dir
+        self.log = log or (lambda message: None)
+        self.progress = progress or (lambda key, text: None)
+        self.add_message = add_message or (lambda description, filepath, live=None: None)
+        self.update_message = update_message or (lambda handle, description, filepath=None: None)
+        self.on_test_message = on_test_message or (lambda from_node, text: None)
+        self.on_send_finished = on_send_finished or (lambda message_id, stats: None)
+
+        # Message chunking
+        self.max_chunk_size = CHUNK_SIZES["Medium"]  # Whole packet bytes including the binary frame header
+        self.pack_packets = True  # Fill spare room in a packet with other small queued frames
+        # Incoming partial messages, bounded by age, count, memory and per sender
+        self.message_chunks = reassembly.ReassemblyBuffer(on_evict=self.on_partial_evicted)
+        self.completed_messages = OrderedDict()  # Recently finished binary messages
+        self.max_completed_messages = 256
+        self.live_messages = {}  # message key -> {'live': LiveAudio, 'entry': list entry, 'fed': chunks decoded}
+        # Receive workers for different senders and the stall timer share the two above
+        self.received_lock = threading.Lock()
+        self.fec_overhead = 0.0  # Parity shards per data shard (0 disables FEC)
+        # Rebroadcasts and resent chunks are dropped before they are parsed
+        self.seen_packets = dedupe.DuplicateFilter()  # (sender, packet id)
+        self.seen_chunks = dedupe.DuplicateFilter()  # (sender, message id, seq) or (sender, chunk_id, chunk_num)
+        # Packets are handled on the caller's thread unless start_receive_workers is called
+        self.receive_pool = None
+
+        # Selective repeat: NACK stalled incoming messages, answer NACKs for ours
+        self.repair_requester = repair.RepairRequester()
+        self.repair_responder = repair.RepairResponder()
+        self.pending_repairs = {}  # message id -> seqs requested by receivers
+        self.repair_lock = threading.Lock()
+        self.repair_thread_running = False
+        self.repair_coalesce_delay = 1  # Seconds to wait for more NACKs before repairing
+
+        # Every outgoing packet goes through one prioritized scheduler, created on first use
+        self.scheduler = None
+        self.outbound = {}  # message id -> scheduler.OutboundMessage of our voice messages
+        self.chunk_retry_count = 2  # Number of times to retry sending a chunk
+        self.chunk_retry_delay = 1  # Seconds between retries (and chunks, if acks are unavailable)
+        self.max_send_window = 8  # Most chunks in flight waiting for an ack
+        self.send_rtt = sender.RttEstimator()  # Shared across messages so later sends start warm
+        self.stream_send = None  # State of a message being sent while it is recorded
+        self.suspended = set()  # Message ids paused because the interface went away
+
+        # Optional on-disk outbox and inbox so transfers survive restarts and reconnects
+        self.store = None
+        self.closing = False  # Messages cancelled by close() stay in the store
+
+        # Metrics; pass a shared registry to export them together with the app's
+        self.metrics = registry or metrics.Registry()
+        self.register_metrics()
+
+        os.makedirs(output_dir, exist_ok=True)
+
+    @property
+    def interface(self):
+        return self._interface
+
+    @interface.setter
+    def interface(self, interface):
+        # Which sendData options this meshtastic version takes, looked up once per interface
+        self._interface = interface
+        self.send_parameters = frozenset()
+        if interface is not None:
+            self.send_parameters = frozenset(inspect.signature(interface.sendData).parameters)
+
+    def register_metrics(self):
+        """Create the engine's metrics; counts kept elsewhere are read when exported"""
+        registry = self.metrics
+        self.stage_timers = {stage: metrics.stage_timer(registry, stage)
+                             for stage in ("chunk", "send", "receive", "reassemble", "decode")}
+        self.packets_received = registry.counter("voice_packets_received_total", "Packets received on PRIVATE_APP")
+        self.bytes_received = registry.counter("voice_bytes_received_total", "Bytes received on PRIVATE_APP")
+        self.messages_received = registry.counter("voice_messages_received_total",
+                                                  "Incoming voice messages by sender and outcome",
+                                                  ("peer", "result"))
+        self.messages_sent = registry.counter("voice_messages_sent_total", "Our voice messages by outcome",
+                                              ("result",))
+        self.invalid_packets = metrics.CounterValue()  # Exported as voice_packets_dropped_total{reason="invalid"}
+        registry.function("counter", "voice_packets_dropped_total", "Received packets dropped before processing",
+                          self.dropped_packets, ("reason",))
+        registry.function("gauge", "voice_reassembly_messages", "Partial messages being reassembled",
+                          lambda: len(self.message_chunks))
+        registry.function("gauge", "voice_reassembly_bytes", "Bytes held by partial messages",
+                          lambda: self.message_chunks.bytes_used)
+        registry.function("counter", "voice_reassembly_evictions_total", "Partial messages dropped by the reassembly buffer",
+                          lambda: {(reason,): count for reason, count in self.message_chunks.evictions.items()},
+                          ("reason",))
+        registry.function("gauge", "voice_send_queue_messages", "Messages queued on the transmit scheduler",
+                          lambda: self.scheduler.depth() if self.scheduler else 0)
+        registry.function("gauge", "voice_receive_queue_packets", "Packets waiting for a receive worker",
+                          lambda: self.receive_pool.pending() if self.receive_pool is not None else 0)
+
+    def dropped_packets(self):
+        """Received packets dropped by reason, as {(reason,): count}"""
+        stats = self.receive_stats()
+        return {("duplicate",): self.duplicates_dropped(),
+                ("queue_full",): stats['dropped'] if stats else 0,
+                ("invalid",): self.invalid_packets.value}
+
+    # Receiving
+
+    def on_receive(self, packet, interface=None):
+        """Handle received messages from the mesh network
+
+        With receive workers this only drops duplicates and queues the
+        packet, so the radio reader thread is never held up.
+        """
+        if packet.get('id') and self.seen_packets.seen((packet.get('from'), packet.get('id'))):
+            return
+        if self.receive_pool is not None:
+            self.receive_pool.submit(packet, packet.get('from'))
+        else:
+            self.process_packet(packet)
+
+    def process_packet(self, packet):
+        """Parse a received packet and act on it"""
+        with self.stage_timers["receive"].time():
+            self.handle_packet(packet)
+
+    def handle_packet(self, packet):
+        """Dispatch a received packet by port"""
+        try:
+            from_id = packet.get('fromId', 'unknown')
+            self.log(f"Received packet: {packet.get('id')} from {from_id}")
+
+            if packet.get('decoded', {}).get('portnum') == 'TEXT_MESSAGE_APP':
+                self.log(f"Received text message from {from_id}")
+                self.process_text_message(packet)
+            elif packet.get('decoded', {}).get('portnum') == 'PRIVATE_APP':
+                self.log(f"Received private app data from {from_id}")
+                self.packets_received.inc()
+                self.bytes_received.inc(len(packet['decoded'].get('payload') or b""))
+                self.process_voice_message(packet)
+        except Exception as e:
+            self.log(f"Error processing received packet: {str(e)}")
+
+    def process_text_message(self, packet):
+        """Process a received text message"""
+        try:
+            message = packet.get('decoded', {}).get('text', '')
+            from_node = packet.get('fromId', 'Unknown')
+            self.log(f"Text message from {from_node}: {message}")
+
+            # Add to messages list
+            self.add_message(f"Text from {from_node}: {message}", None)
+
+        except Exception as e:
+            self.log(f"Error processing text message: {str(e)}")
+
+    def process_voice_message(self, packet):
+        """Process a received voice message"""
+        self.process_payload(packet.get('decoded', {}).get('payload'), packet.get('fromId', 'Unknown'))
+
+    def process_payload(self, data, from_node):
+        """Process one PRIVATE_APP payload, a whole packet or a packet carried in a bundle"""
+        try:
+            if not data:
+                self.log("Received empty voice message payload")
+                return
+
+            if wire.is_binary_frame(data):
+                chunk = wire.chunk_identity(data)
+                if chunk is not None and self.seen_chunks.check((from_node,) + chunk):
+                    return
+                self.process_binary_frame(data, from_node)
+                return
+
+            try:
+                # Try to decode as JSON
+                json_data = json.loads(data.decode('utf-8'))
+
+                # Check if this is a chunked message
+                if 'chunk_id' in json_data and 'chunk_num' in json_data and 'total_chunks' in json_data:
+                    if self.seen_chunks.seen((from_node, json_data['chunk_id'], json_data['chunk_num'])):
+                        return
+                    self.progress(json_data['chunk_id'], f"Receiving {json_data['chunk_id']} from {from_node}: chunk {json_data['chunk_num']}/{json_data['total_chunks']}")
+                    self.process_message_chunk(json_data, from_node)
+                elif 'voice_data' in json_data and 'timestamp' in json_data:
+                    if self.seen_chunks.seen((from_node, 'voice_data', json_data['timestamp'])):
+                        return
+                    # This is a complete voice message
+                    voice_data = base64.b64decode(json_data['voice_data'])
+                    timestamp = json_data['timestamp']
+
+                    # Save the voice message
+                    filename = f"{self.output_dir}/received_{from_node}_{timestamp}.wav"
+                    with open(filename, 'wb') as f:
+                        f.write(voice_data)
+
+                    self.log(f"Received voice message from {from_node}")
+                    self.add_message(f"Voice from {from_node} at {timestamp}", filename)
+                elif 'test' in json_data:
+                    # This is a test message
+                    self.log(f"Received test message from {from_node}: {json_data['test']}")
+                    self.on_test_message(from_node, json_data['test'])
+            except json.JSONDecodeError:
+                self.invalid_packets.inc()
+                self.log("Received data is not in JSON format")
+
+        except Exception as e:
+            self.log(f"Error processing voice message: {str(e)}")
+
+    def process_binary_frame(self, data, from_node, persist=True):
+        """Process a packet using the binary chunk framing
+
+        `persist` is False when replaying frames restored from the store.
+        """
+        try:
+            frame = wire.unpack_frame(data)
+        except wire.FrameError as e:
+            self.invalid_packets.inc()
+            self.log(f"Dropping invalid frame from {from_node}: {str(e)}")
+            return
+        if wire.frame_type(frame) in (wire.TYPE_DATA, wire.TYPE_END):
+            self.seen_chunks.add((from_node, frame.message_id, frame.seq))
+
+        if wire.frame_type(frame) == wire.TYPE_NACK:
+            self.process_nack(frame, from_node)
+            return
+        if wire.frame_type(frame) == wire.TYPE_END:
+            self.process_end(frame, from_node, data if persist else None)
+            return
+        if wire.frame_type(frame) == wire.TYPE_BUNDLE:
+            try:
+                packets = wire.unpack_bundle(frame)
+            except wire.FrameError as e:
+                self.invalid_packets.inc()
+                self.log(f"Dropping invalid bundle from {from_node}: {str(e)}")
+                return
+            for packet in packets:
+                self.process_payload(packet, from_node)
+            return
+        if wire.frame_type(frame) != wire.TYPE_DATA:
+            self.log(f"Ignoring unknown frame type {wire.frame_type(frame)} from {from_node}")
+            return
+
+        chunk_id = (from_node, frame.message_id)
+        if self.is_completed(chunk_id):
+            # Late parity or duplicate chunk of a message we already rebuilt
+            return
+
+        fec_params = None
+        payload = frame.payload
+        if frame.flags & wire.FLAG_FEC:
+            try:
+                fec_params, payload = fec.parse_frame_payload(payload)
+            except wire.FrameError as e:
+                self.invalid_packets.inc()
+                self.log(f"Dropping invalid FEC frame from {from_node}: {str(e)}")
+                return
+
+        kind = "parity chunk" if frame.flags & wire.FLAG_PARITY else "chunk"
+        self.progress(chunk_id, f"Receiving {frame.message_id:08x} from {from_node}: {kind} {frame.seq + 1}/{frame.total}")
+        self.store_chunk(chunk_id, frame.seq + 1, frame.total, payload, from_node,
+                         legacy=False, fec_params=fec_params, packed=data if persist else None)
+
+    def process_end(self, frame, from_node, packed=None):
+        """Handle the END frame closing a message that was sent while recording"""
+        chunk_id = (from_node, frame.message_id)
+        if self.is_completed(chunk_id):
+            return
+
+        message = self.message_chunks.announce(chunk_id, from_node, frame.total)
+        if message is None:
+            # Accept the END again if it is resent once there is room
+            self.seen_chunks.discard((from_node, frame.message_id, frame.seq))
+            self.log(f"Dropping message {frame.message_id:08x} from {from_node}: no room to buffer it")
+            return
+        if self.store is not None and packed is not None:
+            self.store.add_inbound(chunk_id, frame.seq, packed)
+        self.log(f"Message {frame.message_id:08x} from {from_node} ended after {frame.total} chunks")
+        self.check_message_complete(chunk_id, message)
+
+    def process_nack(self, frame, from_node):
+        """Handle a repair request from a receiver"""
+        seqs = wire.unpack_nack(frame)
+
+        # Other receivers missing the same chunks can skip their own NACK
+        self.repair_requester.on_overheard(frame.message_id, seqs)
+
+        if not self.repair_responder.knows(frame.message_id):
+            return
+
+        self.log(f"NACK from {from_node} for {len(seqs)} chunks of message {frame.message_id:08x}")
+        with self.repair_lock:
+            self.pending_repairs.setdefault(frame.message_id, set()).update(seqs)
+            if self.repair_thread_running:
+                return
+            self.repair_thread_running = True
+        threading.Thread(target=self.send_repairs_thread, daemon=True).start()
+
+    def send_repairs_thread(self):
+        """Resend chunks requested by NACKs, merging requests that arrive together"""
+        try:
+            while True:
+                # Give other receivers' NACKs a moment to arrive so one repair serves all
+                time.sleep(self.repair_coalesce_delay)
+                with self.repair_lock:
+                    pending = self.pending_repairs
+                    self.pending_repairs = {}
+                    if not pending:
+                        self.repair_thread_running = False
+                        return
+
+                for message_id, seqs in pending.items():
+                    resend = self.repair_responder.request(message_id, seqs)
+                    if not resend:
+                        continue
+                    self.log(f"Repairing {len(resend)} chunks of message {message_id:08x}")
+                    self.transmit([(seq + 1, frame) for seq, frame in resend], scheduler.PRIORITY_REPAIR,
+                                  name=f"repair of {message_id:08x}",
+                                  on_done=lambda message: self.log(f"{message.name}: {message.stats.summary()}"))
+        except Exception as e:
+            self.log(f"Error sending repairs: {str(e)}")
+            with self.repair_lock:
+                self.repair_thread_running = False
+
+    def missing_seqs(self, message):
+        """Sequence numbers a binary message still needs to be rebuilt"""
+        if message.fec is not None:
+            return fec.missing_for_decode(message.seqs(), message.total, message.fec)
+        return message.missing_data()
+
+    def on_partial_evicted(self, message, reason):
+        """Clean up after the reassembly buffer drops a partial message"""
+        self.log(f"Dropped partial message {self.format_chunk_id(message.key)} from {message.sender} "
+                 f"({message.received}/{message.total} chunks, {reason})")
+        self.progress(message.key, None)
+        self.messages_received.labels(message.sender, "dropped").inc()
+        self.repair_requester.forget(message.key)
+        self.forget_seen_chunks(message)
+        self.forget_stored_partial(message.key)
+        self.end_live_message(message.key)
+
+    def forget_seen_chunks(self, message):
+        """Accept the chunks of a dropped partial message again, should they be resent"""
+        if isinstance(message.key, tuple):
+            sender, message_id = message.key
+            for seq in list(message.seqs()) + [message.total]:  # END takes the seq after the last chunk
+                self.seen_chunks.discard((sender, message_id, seq))
+        else:
+            for seq in message.seqs():
+                self.seen_chunks.discard((message.sender, message.key, seq + 1))
+
+    def duplicates_dropped(self):
+        """Number of duplicate packets and chunks dropped on receive"""
+        return self.seen_packets.dropped + self.seen_chunks.dropped
+
+    def start_receive_workers(self, workers=receivepool.DEFAULT_WORKERS, max_pending=receivepool.MAX_PENDING):
+        """Process received packets on worker threads instead of in on_receive"""
+        if self.receive_pool is None:
+            self.receive_pool = receivepool.ReceivePool(self.process_packet, workers, max_pending, log=self.log)
+
+    def receive_stats(self):
+        """Receive worker counters (see ReceivePool.stats), or None without workers"""
+        return self.receive_pool.stats() if self.receive_pool is not None else None
+
+    def check_stalled_messages(self):
+        """NACK binary messages that stopped receiving chunks; call this periodically"""
+        if self.interface is None:
+            return
+        try:
+            self.message_chunks.expire()
+
+            # Chunks arrive on the receive thread, so work on a snapshot
+            snapshot = self.message_chunks.snapshot()
+            messages = [(chunk_id, chunk_id[1], message.last_chunk_time, self.missing_seqs(message))
+                        for chunk_id, message in snapshot
+                        if not message.legacy]
+            requests, abandoned = self.repair_requester.poll(messages)
+            totals = {chunk_id: message.total for chunk_id, message in snapshot}
+
+            nacks = []
+            for chunk_id, message_id, seqs in requests:
+                total = totals[chunk_id]
+                nacks.append((f"NACK {message_id:08x}", wire.pack_nack(message_id, total, seqs, self.frame_size())))
+                self.log(f"Requesting {len(seqs)} missing chunks of message {message_id:08x}")
+            if nacks:
+                # Queued together, so the scheduler can bundle the NACKs of several stalled messages
+                self.transmit(nacks, scheduler.PRIORITY_CONTROL, want_ack=False,
+                              name=nacks[0][0] if len(nacks) == 1 else f"NACKs for {len(nacks)} messages")
+
+            for chunk_id in abandoned:
+                self.log(f"Giving up on message {self.format_chunk_id(chunk_id)} after repeated repair requests")
+                message = self.message_chunks.pop(chunk_id)
+                if message is not None:
+                    self.messages_received.labels(message.sender, "dropped").inc()
+                    self.forget_seen_chunks(message)
+                self.forget_stored_partial(chunk_id)
+                self.progress(chunk_id, None)
+                self.end_live_message(chunk_id)
+        except Exception as e:
+            self.log(f"Error checking stalled messages: {str(e)}")
+
+    def process_message_chunk(self, chunk_data, from_node):
+        """Process a chunk of a multi-part voice message"""
+        self.store_chunk(chunk_data['chunk_id'], chunk_data['chunk_num'], chunk_data['total_chunks'],
+                         chunk_data['data'].encode('ascii'), from_node, legacy=True)
+
+    def store_chunk(self, chunk_id, chunk_num, total_chunks, chunk_content, from_node, legacy, fec_params=None,
+                    packed=None):
+        """Store a received chunk and reassemble once enough chunks have arrived
+
+        `packed` is the whole binary frame, kept in the transfer store if one is open.
+        """
+        message = self.message_chunks.add(chunk_id, from_node, chunk_num - 1, total_chunks, chunk_content,
+                                          legacy=legacy, fec_params=fec_params)
+        if message is None:
+            # Accept the chunk again if it is resent once there is room
+            if legacy:
+                self.seen_chunks.discard((from_node, chunk_id, chunk_num))
+            else:
+                self.seen_chunks.discard((from_node, chunk_id[1], chunk_num - 1))
+            self.log(f"Dropping message {self.format_chunk_id(chunk_id)} from {from_node}: no room to buffer it")
+            return
+        if self.store is not None and packed is not None:
+            self.store.add_inbound(chunk_id, chunk_num - 1, packed)
+        if not legacy:
+            self.update_live_message(chunk_id, message)
+        self.check_message_complete(chunk_id, message)
+
+    def is_completed(self, chunk_id):
+        """Check whether a binary message was already rebuilt"""
+        with self.received_lock:
+            return chunk_id in self.completed_messages
+
+    def update_live_message(self, chunk_id, message):
+        """Decode newly in-order chunks of a segmented message for playback while it arrives"""
+        with self.received_lock:
+            live_message = self.live_messages.get(chunk_id)
+        if live_message is None:
+            if not message.has(0) or not progressive.is_progressive(message.chunk(0)):
+                return
+            live_message = {'live': progressive.LiveAudio(), 'entry': None, 'fed': 0}
+            with self.received_lock:
+                live_message = self.live_messages.setdefault(chunk_id, live_message)
+
+        if live_message['fed'] == message.contiguous:
+            return
+        live = live_message['live']
+        try:
+            decoded = 0
+            for seq in range(live_message['fed'], message.contiguous):
+                decoded += live.feed(message.chunk(seq))
+            live_message['fed'] = message.contiguous
+        except Exception as e:
+            self.log(f"Error decoding live audio: {str(e)}")
+            self.end_live_message(chunk_id)
+            return
+
+        if not decoded:
+            return
+        description = f"Voice from {message.sender} (live, {live.duration:.1f}s so far)"
+        if live_message['entry'] is None:
+            live_message['entry'] = self.add_message(description, None, live=live)
+            live_message['description'] = description
+            self.log(f"Message {self.format_chunk_id(chunk_id)} from {message.sender} is playable while it arrives")
+        else:
+            live_message['description'] = description
+            self.update_message(live_message['entry'], description)
+
+    def end_live_message(self, chunk_id, payload=None, description=None, filepath=None):
+        """Finish the live audio of a message, with the full payload if it was rebuilt"""
+        with self.received_lock:
+            live_message = self.live_messages.pop(chunk_id, None)
+        if live_message is None or live_message['entry'] is None:
+            return False
+        live = live_message['live']
+        try:
+            if payload is not None:
+                # Decode whatever did not arrive in order (or was recovered by FEC)
+                live.feed(payload[live.consumed:])
+        except Exception as e:
+            self.log(f"Error decoding live audio: {str(e)}")
+        live.finish(complete=payload is not None)
+        if description is None:
+            description = f"{live_message['description'].split(' (')[0]} (incomplete, {live.duration:.1f}s)"
+        self.update_message(live_message['entry'], description, filepath)
+        return True
+
+    def check_message_complete(self, chunk_id, message):
+        """Reassemble a message once enough chunks have arrived, otherwise show progress"""
+        received_chunks = message.received
+        if message.fec is not None:
+            if fec.is_decodable(message.seqs(), message.total, message.fec):
+                self.log(f"Received enough chunks ({received_chunks}) to rebuild message {self.format_chunk_id(chunk_id)}")
+                self.progress(chunk_id, None)
+                self.reassemble_message(chunk_id)
+            else:
+                self.progress(chunk_id, f"Message {self.format_chunk_id(chunk_id)}: {received_chunks} chunks ({message.total} data)")
+        elif received_chunks == message.total:
+            self.log(f"Received all {message.total} chunks for message {self.format_chunk_id(chunk_id)}")
+            self.progress(chunk_id, None)
+            self.reassemble_message(chunk_id)
+        else:
+            # Show how many chunks we have so far (a streamed message's total is unknown until it ends)
+            total = message.total or "?"
+            self.progress(chunk_id, f"Message {self.format_chunk_id(chunk_id)}: {received_chunks}/{total} chunks")
+
+    def format_chunk_id(self, chunk_id):
+        """Readable id for a legacy (string) or binary (sender, int) message key"""
+        if isinstance(chunk_id, tuple):
+            return f"{chunk_id[1]:08x}"
+        return chunk_id
+
+    def reassemble_message(self, chunk_id):
+        """Reassemble a complete message from chunks"""
+        message = self.message_chunks.get(chunk_id)
+        if message is None:
+            return
+        from_node = message.sender
+        timestamp = message.timestamp
+
+        missing_chunks = message.missing_data()
+        if missing_chunks and message.fec is None:
+            self.log(f"Missing chunks {[seq + 1 for seq in missing_chunks]} for message {self.format_chunk_id(chunk_id)}, cannot reassemble")
+            return
+
+        try:
+            with self.stage_timers["reassemble"].time():
+                if message.fec is not None:
+                    # Rebuild any missing data chunks from the parity chunks
+                    payload = fec.decode_payload(message.shards(), message.total, message.fec)
+                    if missing_chunks:
+                        self.log(f"Recovered {len(missing_chunks)} lost chunks with FEC")
+                elif message.legacy:
+                    # Legacy chunks are base64 text of the zlib stream
+                    payload = base64.b64decode(message.join())
+                else:
+                    payload = message.join()
+
+            # Save as WAV file
+            filename = f"{self.output_dir}/received_{from_node}_{timestamp}.wav"
+
+            # Create WAV file from the encoded payload
+            self.create_wav_from_compressed(payload, filename, legacy=message.legacy)
+
+            self.log(f"Reassembled and saved voice message from {from_node}")
+            self.messages_received.labels(from_node, "complete").inc()
+            description = f"Voice from {from_node} at {timestamp}"
+            if not self.end_live_message(chunk_id, payload, description, filename):
+                self.add_message(description, filename)
+
+            # Clean up
+            self.message_chunks.pop(chunk_id)
+            self.repair_requester.forget(chunk_id)
+            self.forget_stored_partial(chunk_id)
+            if not message.legacy:
+                with self.received_lock:
+                    self.completed_messages[chunk_id] = time.time()
+                    while len(self.completed_messages) > self.max_completed_messages:
+                        self.completed_messages.popitem(last=False)
+
+        except Exception as e:
+            self.messages_received.labels(from_node, "failed").inc()
+            self.log(f"Error reassembling message: {str(e)}")
+
+    def create_wav_from_compressed(self, compressed_data, filename, legacy=False):
+        """Create a WAV file from compressed audio data"""
+        try:
+            with self.stage_timers["decode"].time():
+                if legacy:
+                    # Old senders put an ASCII header inside the zlib stream
+                    params, audio_data = codec.decode_legacy_audio(zlib.decompress(compressed_data))
+                else:
+                    params, audio_data = codec.decode_audio(compressed_data)
+
+            codec.write_wav(filename, params, audio_data)
+
+            self.log(f"Created WAV file: {filename}")
+        except Exception as e:
+            self.log(f"Error creating WAV file: {str(e)}")
+
+    # Sending
+
+    def packet_limit(self):
+        """Largest packet payload the current interface can send"""
+        return packer.max_payload(self.interface)
+
+    def frame_size(self):
+        """Bytes per frame: the selected chunk size, capped at the interface's limit"""
+        return min(self.max_chunk_size, self.packet_limit())
+
+    def transmit(self, items, priority, want_ack=True, source=None, on_done=None, name=None, on_ack=None):
+        """Queue (label, frame) items on the transmit scheduler and return the OutboundMessage"""
+        if self.scheduler is None:
+            self.scheduler = scheduler.TransmitScheduler(self.send_frame,
+                                                         rtt=self.send_rtt,
+                                                         max_window=self.max_send_window,
+                                                         max_attempts=self.chunk_retry_count + 1,
+                                                         fallback_interval=self.chunk_retry_delay,
+                                                         log=self.log,
+                                                         progress=lambda message, text: self.progress(
+                                                             ('send', message.key), text),
+                                                         registry=self.metrics)
+        self.scheduler.max_payload = self.packet_limit() if self.pack_packets else None
+        return self.scheduler.submit(items, priority, want_ack, source, on_done, name, on_ack)
+
+    def send_test_message(self, text):
+        """Broadcast a JSON test message ahead of any queued voice chunks"""
+        json_payload = json.dumps({"test": text}).encode('utf-8')
+
+        self.log(f"Sending test message: {text}")
+        self.log(f"Payload size: {len(json_payload)} bytes")
+
+        self.transmit([("test", json_payload)], scheduler.PRIORITY_CONTROL, name="test message",
+                      on_done=lambda message: self.log(f"Test message sent successfully"
+                                                       if message.stats.acked else "Test message was not acked"))
+
+    def send_payload(self, payload):
+        """Frame an encoded payload and queue it for sending
+
+        Returns the message id. Raises if the message could not be queued.
+        """
+        # Split into binary frames (a single frame if it fits in one packet)
+        message_id = wire.new_message_id()
+        frame_size = self.frame_size()
+        with self.stage_timers["chunk"].time():
+            if self.fec_overhead > 0:
+                frames = fec.encode_frames(message_id, payload, frame_size, self.fec_overhead)
+            else:
+                frames = wire.split_payload(message_id, payload, frame_size)
+            frames_by_seq = {wire.unpack_frame(frame).seq: frame for frame in frames}
+
+        # Keep the frames so receivers can NACK missing chunks
+        self.repair_responder.remember(message_id, frames_by_seq)
+        if self.store is not None:
+            self.store.save_outbound(message_id, frames_by_seq)
+
+        if len(frames) == 1:
+            self.log(f"Voice message size: {len(frames[0])} bytes")
+        else:
+            self.log(f"Message too large ({len(payload)} bytes), splitting into chunks")
+            self.log(f"Splitting message {message_id:08x} into {len(frames)} chunks (size: {frame_size} bytes)")
+        self.queue_voice_message(message_id, [(seq + 1, frame) for seq, frame in frames_by_seq.items()])
+        return message_id
+
+    def queue_voice_message(self, message_id, items, source=None):
+        """Queue (seq + 1, frame) items of one of our voice messages"""
+        queued = self.scheduler.depth(scheduler.PRIORITY_VOICE) if self.scheduler else 0
+        if queued:
+            self.log(f"Queued message {message_id:08x} behind {queued} other voice messages")
+        on_ack = None
+        if self.store is not None:
+            on_ack = lambda message, label: self.store.mark_acked(message_id, label - 1)
+        message = self.transmit(items, scheduler.PRIORITY_VOICE, source=source, name=f"message {message_id:08x}",
+                                on_done=lambda message: self.voice_message_sent(message_id, message),
+                                on_ack=on_ack)
+        self.outbound[message_id] = message
+        if message.finished.is_set():
+            self.outbound.pop(message_id, None)  # Finished before it was recorded here
+
+    def voice_message_sent(self, message_id, message):
+        """Log the outcome of one of our voice messages; runs on the scheduler thread"""
+        self.outbound.pop(message_id, None)
+        self.suspended.discard(message_id)
+        stats = message.stats
+        if message.state == "cancelled":
+            self.log(f"Send of message {message_id:08x} cancelled")
+        else:
+            self.log(f"All {stats.total} chunks of message {message_id:08x} sent")
+        if self.store is not None and not self.closing:
+            if stats.failed and message.state != "cancelled":
+                # Stays in the outbox; resume_transfers sends the failed chunks again
+                self.log(f"{stats.failed} chunks of message {message_id:08x} will be resent after reconnecting")
+            else:
+                self.store.remove_outbound(message_id)
+        self.log(f"Message {message_id:08x}: {stats.summary()}")
+        if message.state == "cancelled":
+            self.messages_sent.labels("cancelled").inc()
+        else:
+            self.messages_sent.labels("failed" if stats.failed else "complete").inc()
+            self.stage_timers["send"].observe(stats.elapsed)
+        self.on_send_finished(message_id, stats)
+
+    def sending(self):
+        """Whether any of our voice messages is still queued or being sent"""
+        return bool(self.outbound)
+
+    def send_queue(self):
+        """Status of every queued outgoing message, see OutboundMessage.status"""
+        return self.scheduler.status() if self.scheduler else []
+
+    def start_stream_send(self, segment_seconds=None):
+        """Queue a message whose chunks are produced while recording
+
+        Returns False (and sends nothing) if a message is already being
+        streamed.
+        """
+        if self.stream_send is not None:
+            self.log("Already streaming a voice message, recording without sending")
+            return False
+
+        if self.fec_overhead > 0:
+            self.log("FEC is not applied when sending while recording")
+
+        message_id = wire.new_message_id()
+        self.stream_send = {
+            'message_id': message_id,
+            'splitter': wire.StreamSplitter(message_id, self.frame_size()),
+            'queue': queue.Queue(),
+            'seq': 0,
+            'segment_seconds': segment_seconds
+        }
+        if self.store is not None:
+            self.store.save_outbound(message_id, {})
+        self.log(f"Streaming message {message_id:08x} while recording (chunk size: {self.frame_size()} bytes)")
+        self.queue_voice_message(message_id, [], self.stream_send['queue'])
+        return True
+
+    def queue_stream_data(self, data):
+        """Cut newly encoded bytes into chunks and queue the full ones for sending"""
+        for frame in self.stream_send['splitter'].feed(data):
+            self.queue_stream_frame(frame)
+
+    def queue_stream_frame(self, frame):
+        stream = self.stream_send
+        seq = stream['seq']
+        stream['seq'] += 1
+        # Keep every frame (END included) so receivers can NACK it
+        self.repair_responder.add(stream['message_id'], seq, frame)
+        if self.store is not None:
+            self.store.add_outbound_frame(stream['message_id'], seq, frame)
+        stream['queue'].put((seq + 1, frame))
+
+    def finish_stream_send(self, data):
+        """Queue the last chunk and the END frame announcing the chunk count"""
+        self.queue_stream_data(data)
+        splitter = self.stream_send['splitter']
+        for frame in splitter.finish():
+            self.queue_stream_frame(frame)
+        self.stream_send['queue'].put(None)
+        self.log(f"Recording finished, message {self.stream_send['message_id']:08x} has {splitter.count} chunks")
+        self.stream_send = None
+
+    def abort_stream_send(self):
+        """Let the streamed message finish with what was queued, without an END frame"""
+        if self.stream_send is not None:
+            self.stream_send['queue'].put(None)
+            self.stream_send = None
+
+    def send_frame(self, frame, on_response=None):
+        """Send one frame, with wantAck if on_response is given, reporting the ack/nak to it
+
+        Returns False if no ack was asked for or this meshtastic version
+        cannot report responses.
+        """
+        options = {}
+        if on_response is not None and 'onResponse' in self.send_parameters:
+            options['onResponse'] = on_response
+            if 'onResponseAckPermitted' in self.send_parameters:
+                # Newer versions only pass routing acks to handlers that opt in
+                options['onResponseAckPermitted'] = True
+
+        self.interface.sendData(
+            frame,
+            destinationId=wire.BROADCAST_ADDR,
+            portNum=wire.PORT_NUM,
+            wantAck=on_response is not None,
+            **options
+        )
+        return 'onResponse' in options
+
+    def cancel_send(self, message_id):
+        """Cancel one of our queued or in-progress voice messages"""
+        message = self.outbound.get(message_id)
+        return message is not None and self.scheduler.cancel(message)
+
+    def pause_send(self, message_id):
+        message = self.outbound.get(message_id)
+        return message is not None and self.scheduler.pause(message)
+
+    def resume_send(self, message_id):
+        message = self.outbound.get(message_id)
+        return message is not None and self.scheduler.resume(message)
+
+    def stop_sending(self):
+        """Cancel all of our queued and in-progress voice messages"""
+        if self.outbound:
+            self.log("Cancelling send...")
+            self.scheduler.cancel_all(scheduler.PRIORITY_VOICE)
+        else:
+            self.log("No voice message being sent.")
+
+    # Persistence
+
+    def open_store(self, path):
+        """Keep transfers in a transfer store at `path` and restore what it holds
+
+        Returns False (and keeps everything in memory only) if the store
+        cannot be opened.
+        """
+        try:
+            self.store = transferstore.TransferStore(path, log=self.log)
+        except Exception as e:
+            self.log(f"Error opening transfer store: {str(e)}")
+            return False
+        self.restore()
+        return True
+
+    def restore(self):
+        """Reload stored partial messages and the frames of our unfinished messages
+
+        Partials are replayed through the receive path, so one that is now
+        complete is rebuilt straight away and the rest are NACKed when they
+        stall. Our messages are only sent again by resume_transfers.
+        """
+        try:
+            partials = self.store.load_inbound()
+            for (sender, message_id), frames in partials:
+                for frame in frames:
+                    self.process_binary_frame(frame, sender, persist=False)
+            if partials:
+                self.log(f"Restored {len(partials)} partial incoming messages")
+
+            for stored in self.store.load_outbound():
+                self.repair_responder.remember(stored.message_id, stored.frames)
+        except Exception as e:
+            self.log(f"Error restoring transfers: {str(e)}")
+
+    def forget_stored_partial(self, chunk_id):
+        if self.store is not None and isinstance(chunk_id, tuple):
+            self.store.remove_inbound(chunk_id)
+
+    def suspend_transfers(self):
+        """Pause our voice messages while the interface is gone"""
+        for message_id, message in list(self.outbound.items()):
+            if self.scheduler.pause(message):
+                self.suspended.add(message_id)
+        if self.suspended:
+            self.log(f"Paused {len(self.suspended)} voice messages until reconnected")
+
+    def resume_transfers(self):
+        """Continue our messages after (re)connecting
+
+        Messages paused by suspend_transfers carry on, and stored messages
+        that are not queued (left from before a restart, or finished with
+        failed chunks) are queued again with only their unacked chunks.
+        Returns the number of messages resumed.
+        """
+        resumed = 0
+        for message_id in list(self.suspended):
+            message = self.outbound.get(message_id)
+            if message is not None and self.scheduler.resume(message):
+                resumed += 1
+        self.suspended.clear()
+
+        if self.store is None:
+            return resumed
+        try:
+            for stored in self.store.load_outbound():
+                if stored.message_id in self.outbound:
+                    continue
+                unacked = stored.unacked()
+                if not unacked:
+                    self.store.remove_outbound(stored.message_id)
+                    continue
+                self.log(f"Resuming message {stored.message_id:08x}: {len(unacked)} of {len(stored.frames)} chunks left")
+                self.repair_responder.remember(stored.message_id, stored.frames)
+                self.queue_voice_message(stored.message_id, [(seq + 1, frame) for seq, frame in unacked])
+                resumed += 1
+        except Exception as e:
+            self.log(f"Error resuming transfers: {str(e)}")
+        return resumed
+
+    def close(self):
+        """Stop the receive workers and transmit scheduler, dropping anything still queued, and close the store"""
+        self.closing = True
+        if self.receive_pool is not None:
+            self.receive_pool.close()
+        if self.scheduler is not None:
+            self.scheduler.close()
+        if self.store is not None:
+            self.store.close()
@@ -0,0 +1,234 @@
+"""Forward error correction across chunks of a voice message
+
+A systematic Reed-Solomon erasure code over GF(256). The payload is cut into
+equal-sized data shards (the last one zero-padded for encoding only). Shards
+are grouped into blocks of up to `block_size`, and each block gets parity
+shards built from a Cauchy matrix. A block can be rebuilt from any k of its
+k + m shards, so the receiver only needs "enough" chunks, not every chunk.
+
+FEC frames set wire.FLAG_FEC and carry a 4-byte extension in front of the
+shard: block size, parity shards per full block, and the length of the last
+data shard. The header `total` counts data shards only. Parity shards follow
+the data sequence numbers, block by block.
+"""
+import functools
+import math
+import struct
+from collections import namedtuple
+
+from lazyimport import lazy_import
+
+import wire
+
+np = lazy_import("numpy")  # Imported on first use, keeping numpy out of startup
+
+FEC_EXT = struct.Struct('!BBH')
+
+DEFAULT_BLOCK_SIZE = 32
+
+# Overhead choices offered in the GUI (parity shards / data shards)
+OVERHEADS = {"Off": 0.0, "10%": 0.1, "20%": 0.2, "30%": 0.3}
+
+FecParams = namedtuple('FecParams', 'block_size parity last_len')
+Block = namedtuple('Block', 'data_start data_count parity_start parity_count')
+
+
+@functools.lru_cache(maxsize=None)
+def gf_tables():
+    """GF(256) exp and log tables, built on first use so importing fec does not load numpy"""
+    exp = np.zeros(512, dtype=np.uint8)
+    log = np.zeros(256, dtype=np.int32)
+    value = 1
+    for power in range(255):
+        exp[power] = value
+        log[value] = power
+        value <<= 1
+        if value & 0x100:
+            value ^= 0x11D
+    exp[255:510] = exp[0:255]
+    return exp, log
+
+
+def gf_mul(a, b):
+    """Multiply two GF(256) elements"""
+    if a == 0 or b == 0:
+        return 0
+    exp, log = gf_tables()
+    return int(exp[log[a] + log[b]])
+
+
+def gf_inv(a):
+    """Multiplicative inverse of a non-zero GF(256) element"""
+    if a == 0:
+        raise ZeroDivisionError("0 has no inverse in GF(256)")
+    exp, log = gf_tables()
+    return int(exp[255 - log[a]])
+
+
+def gf_scale(coefficient, vector):
+    """Multiply every byte of a uint8 vector by a GF(256) constant"""
+    if coefficient == 0:
+        return np.zeros_like(vector)
+    exp, log = gf_tables()
+    result = exp[log[coefficient] + log[vector]]
+    result[vector == 0] = 0
+    return result
+
+
+def cauchy_matrix(data_count, parity_count):
+    """Parity rows of the generator matrix: 1 / (x_j + y_i)"""
+    return [[gf_inv((data_count + j) ^ i) for i in range(data_count)] for j in range(parity_count)]
+
+
+def gf_invert_matrix(matrix):
+    """Invert a square matrix over GF(256) with Gauss-Jordan elimination"""
+    size = len(matrix)
+    work = [list(row) + [1 if i == j else 0 for j in range(size)] for i, row in enumerate(matrix)]
+    for col in range(size):
+        pivot = next((r for r in range(col, size) if work[r][col]), None)
+        if pivot is None:
+            raise ValueError("Matrix is singular")
+        work[col], work[pivot] = work[pivot], work[col]
+        scale = gf_inv(work[col][col])
+        work[col] = [gf_mul(scale, v) for v in work[col]]
+        for r in range(size):
+            factor = work[r][col]
+            if r != col and factor:
+                work[r] = [v ^ gf_mul(factor, p) for v, p in zip(work[r], work[col])]
+    return [row[size:] for row in work]
+
+
+def block_parity(data_count, params):
+    """Parity shards for a block, scaled down for a short last block"""
+    return max(1, -(-data_count * params.parity // params.block_size))
+
+
+def layout(total, params):
+    """Data and parity sequence ranges of every block of a message"""
+    blocks = []
+    parity_start = total
+    for data_start in range(0, total, params.block_size):
+        data_count = min(params.block_size, total - data_start)
+        parity_count = block_parity(data_count, params)
+        blocks.append(Block(data_start, data_count, parity_start, parity_count))
+        parity_start += parity_count
+    return blocks
+
+
+def parity_for_overhead(block_size, overhead):
+    """Parity shards per full block for an overhead ratio"""
+    return max(1, math.ceil(round(block_size * overhead, 6)))
+
+
+def encode_frames(message_id, payload, frame_size, overhead, block_size=DEFAULT_BLOCK_SIZE):
+    """Split a payload into data frames plus Reed-Solomon parity frames
+
+    Frames are ordered block by block (data shards, then that block's parity)
+    so a receiver can finish early blocks while later ones are in flight.
+    """
+    shard_size = frame_size - wire.HEADER_SIZE - FEC_EXT.size
+    if shard_size <= 0:
+        raise ValueError(f"Frame size {frame_size} leaves no room for FEC payload")
+    total = max(1, -(-len(payload) // shard_size))
+    shard_size = min(shard_size, len(payload)) or 1
+    last_len = len(payload) - (total - 1) * shard_size
+
+    params = FecParams(block_size, parity_for_overhead(block_size, overhead), last_len)
+    ext = FEC_EXT.pack(*params)
+    padded = np.zeros(total * shard_size, dtype=np.uint8)
+    padded[:len(payload)] = np.frombuffer(payload, dtype=np.uint8)
+    shards = padded.reshape(total, shard_size)
+
+    frames = []
+    for block in layout(total, params):
+        for seq in range(block.data_start, block.data_start + block.data_count):
+            shard = payload[seq * shard_size:(seq + 1) * shard_size]
+            frames.append(wire.pack_frame(message_id, seq, total, ext + shard, wire.FLAG_FEC))
+        matrix = cauchy_matrix(block.data_count, block.parity_count)
+        for j, row in enumerate(matrix):
+            parity = np.zeros(shard_size, dtype=np.uint8)
+            for i, coefficient in enumerate(row):
+                parity ^= gf_scale(coefficient, shards[block.data_start + i])
+            frames.append(wire.pack_frame(message_id, block.parity_start + j, total,
+                                          ext + parity.tobytes(), wire.FLAG_FEC | wire.FLAG_PARITY))
+    return frames
+
+
+def parse_frame_payload(payload):
+    """Split an FEC frame payload into (FecParams, shard)"""
+    if len(payload) < FEC_EXT.size:
+        raise wire.FrameError("FEC frame too short")
+    return FecParams(*FEC_EXT.unpack_from(payload)), payload[FEC_EXT.size:]
+
+
+def is_decodable(received_seqs, total, params):
+    """Check whether every block has at least as many shards as data shards"""
+    for block in layout(total, params):
+        have = sum(1 for seq in range(block.data_start, block.data_start + block.data_count)
+                   if seq in received_seqs)
+        have += sum(1 for seq in range(block.parity_start, block.parity_start + block.parity_count)
+                    if seq in received_seqs)
+        if have < block.data_count:
+            return False
+    return True
+
+
+def missing_for_decode(received_seqs, total, params):
+    """Data seqs to request so every block has enough shards to decode
+
+    For a block short by d shards this returns only its first d missing data
+    seqs rather than every missing one.
+    """
+    wanted = []
+    for block in layout(total, params):
+        seqs = list(range(block.data_start, block.data_start + block.data_count))
+        seqs += range(block.parity_start, block.parity_start + block.parity_count)
+        deficit = block.data_count - sum(1 for seq in seqs if seq in received_seqs)
+        if deficit > 0:
+            missing = [seq for seq in seqs[:block.data_count] if seq not in received_seqs]
+            wanted.extend(missing[:deficit])
+    return wanted
+
+
+def decode_payload(shards, total, params):
+    """Rebuild the original payload from a dict of seq -> shard bytes"""
+    shard_size = max(len(shard) for shard in shards.values())
+
+    def vector(seq):
+        data = np.zeros(shard_size, dtype=np.uint8)
+        shard = shards[seq]
+        data[:len(shard)] = np.frombuffer(shard, dtype=np.uint8)
+        return data
+
+    output = bytearray()
+    for block in layout(total, params):
+        data_seqs = range(block.data_start, block.data_start + block.data_count)
+        missing = [seq for seq in data_seqs if seq not in shards]
+        if missing:
+            matrix = cauchy_matrix(block.data_count, block.parity_count)
+            rows, sources = [], []
+            for i, seq in enumerate(data_seqs):
+                if seq in shards:
+                    rows.append([1 if c == i else 0 for c in range(block.data_count)])
+                    sources.append(seq)
+            for j in range(block.parity_count):
+                if len(rows) == block.data_count:
+                    break
+                seq = block.parity_start + j
+                if seq in shards:
+                    rows.append(matrix[j])
+                    sources.append(seq)
+            if len(rows) < block.data_count:
+                raise ValueError(f"Not enough shards to rebuild block at chunk {block.data_start + 1}")
+            inverse = gf_invert_matrix(rows)
+            vectors = [vector(seq) for seq in sources]
+            recovered = {}
+            for seq in missing:
+                value = np.zeros(shard_size, dtype=np.uint8)
+                for coefficient, source in zip(inverse[seq - block.data_start], vectors):
+                    value ^= gf_scale(coefficient, source)
+                recovered[seq] = value.tobytes()
+        for seq in data_seqs:
+            shard = shards[seq] if seq in shards else recovered[seq]
+            output += shard[:params.last_len] if seq == total - 1 else shard[:shard_size]
+    return bytes(output)
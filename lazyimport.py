@@ -0,0 +1,40 @@
+"""Modules imported on first use
+
+numpy takes most of the app's import time, and nothing needs it until the
+first recording is encoded or message decoded. The numeric modules bind
+`np = lazy_import("numpy")` instead of importing it: the name is a stand-in
+module that imports numpy the first time one of its attributes is read,
+then copies numpy's namespace into itself, so later lookups are ordinary
+module attribute reads with no extra cost.
+
+The real import goes through importlib, so two threads touching the module
+for the first time at once are serialized by the import lock, and code that
+imports numpy directly gets the real module as usual.
+"""
+import importlib
+import sys
+import threading
+import types
+
+
+class LazyModule(types.ModuleType):
+    """Stand-in for a module that is imported when first used"""
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.__dict__['_lazy_lock'] = threading.Lock()
+
+    def __getattr__(self, attribute):
+        # Only called for names not copied in yet, i.e. before the first load
+        with self._lazy_lock:
+            module = importlib.import_module(self.__name__)
+            for name, value in vars(module).items():
+                if name not in ('__name__', '__spec__', '__loader__'):
+                    self.__dict__.setdefault(name, value)
+        return getattr(module, attribute)
+
+
+def lazy_import(name):
+    """The module `name` if it is already imported, otherwise a LazyModule for it"""
+    module = sys.modules.get(name)
+    return module if module is not None else LazyModule(name)
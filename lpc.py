@@ -0,0 +1,306 @@
+"""LPC-10 style parametric speech codec
+
+Speech at 8 kHz is cut into fixed frames. Each frame is described by ten
+reflection coefficients, a pitch period (or "unvoiced") and an RMS gain. The
+parameters are quantized to 54 bits per frame: 2400 bit/s with 22.5 ms
+frames, or 1200 bit/s with 45 ms frames.
+
+The decoder drives an all-pole synthesis filter with a pulse train (voiced)
+or white noise (unvoiced). Analysis and bit packing are vectorized across
+frames. Synthesis filters each frame's excitation with that frame's
+truncated impulse response (FFT convolution plus overlap-add), so no step
+loops over individual samples in Python.
+
+Body layout: frame length (2 bytes) | frame count (2 bytes) | packed bits
+
+A frame count of 0 means "as many frames as the bits hold", which lets
+StreamEncoder emit the body before the length is known. It encodes groups of
+four frames (216 bits, a whole number of bytes), so the padding at the end
+is always shorter than one frame.
+"""
+import math
+import struct
+
+from lazyimport import lazy_import
+
+np = lazy_import("numpy")  # Imported on first use, keeping numpy out of startup
+
+SAMPLE_RATE = 8000
+ORDER = 10
+PRE_EMPHASIS = 0.9375
+BANDWIDTH_EXPANSION = 0.994
+
+# Bits per reflection coefficient; the low-order ones matter most
+COEFFICIENT_BITS = (6, 6, 5, 5, 4, 4, 4, 3, 3, 2)
+PITCH_BITS = 7   # 0 = unvoiced, otherwise period MIN_PITCH + code - 1
+GAIN_BITS = 5    # 0 = silence, otherwise log RMS steps
+FIELD_BITS = COEFFICIENT_BITS + (PITCH_BITS, GAIN_BITS)
+FRAME_BITS = sum(FIELD_BITS)
+
+MIN_PITCH = 20    # 400 Hz
+MAX_PITCH = MIN_PITCH + (1 << PITCH_BITS) - 2  # 146 samples, ~55 Hz
+VOICING_THRESHOLD = 0.4
+PEAK_SEARCH = 8  # lags searched past the first candidate for the peak
+
+GAIN_FLOOR_DB = 12.0
+GAIN_STEP_DB = 2.6
+
+IMPULSE_LENGTH = 256
+
+BODY_HEADER = struct.Struct('!HH')
+
+# Frames per byte-aligned group of packed bits
+GROUP_FRAMES = 8 // math.gcd(FRAME_BITS, 8)
+
+
+def bitrate(frame_length):
+    """Bits per second for a frame length in samples"""
+    return FRAME_BITS * SAMPLE_RATE / frame_length
+
+
+def _frames(signal, frame_length):
+    count = len(signal) // frame_length
+    return signal[:count * frame_length].reshape(count, frame_length)
+
+
+def _autocorrelation(frames, order):
+    window = np.hamming(frames.shape[1]).astype(np.float64)
+    windowed = frames * window
+    length = frames.shape[1]
+    r = np.stack([(windowed[:, lag:] * windowed[:, :length - lag]).sum(axis=1)
+                  for lag in range(order + 1)], axis=1)
+    # White noise correction and lag window keep the recursion well conditioned
+    r[:, 0] *= 1.0001
+    lags = np.arange(order + 1)
+    return r * np.exp(-0.5 * (2 * np.pi * 60 * lags / SAMPLE_RATE) ** 2)
+
+
+def levinson(r, order=ORDER):
+    """Levinson-Durbin recursion across frames, returning reflection coefficients"""
+    count = r.shape[0]
+    a = np.zeros((count, order + 1))
+    a[:, 0] = 1.0
+    error = r[:, 0].copy()
+    reflection = np.zeros((count, order))
+    for i in range(1, order + 1):
+        acc = r[:, i] + (a[:, 1:i] * r[:, i - 1:0:-1]).sum(axis=1)
+        k = np.where(error > 0, -acc / np.where(error > 0, error, 1), 0.0)
+        k = np.clip(k, -0.999, 0.999)
+        a[:, 1:i] = a[:, 1:i] + k[:, None] * a[:, i - 1:0:-1]
+        a[:, i] = k
+        error *= 1 - k ** 2
+        reflection[:, i - 1] = k
+    return reflection
+
+
+def reflection_to_lpc(reflection):
+    """Step-up recursion from reflection coefficients to A(z) coefficients"""
+    count, order = reflection.shape
+    a = np.zeros((count, order + 1))
+    a[:, 0] = 1.0
+    for i in range(1, order + 1):
+        k = reflection[:, i - 1]
+        a[:, 1:i] = a[:, 1:i] + k[:, None] * a[:, i - 1:0:-1]
+        a[:, i] = k
+    return a
+
+
+def _detect_pitch(signal, starts, frame_length):
+    """Pitch period per frame from normalized autocorrelation, 0 when unvoiced"""
+    # Light low-pass so formants don't dominate the correlation
+    smoothed = np.convolve(signal, np.ones(4) / 4, mode='same')
+    padded = np.concatenate([np.zeros(MAX_PITCH), smoothed])
+    squares = np.concatenate([[0.0], np.cumsum(padded ** 2)])
+
+    index = starts[:, None] + MAX_PITCH + np.arange(frame_length)
+    current = padded[index]
+    current_energy = squares[starts + MAX_PITCH + frame_length] - squares[starts + MAX_PITCH]
+
+    lags = np.arange(MIN_PITCH, MAX_PITCH + 1)
+    correlation = np.empty((len(starts), len(lags)))
+    for column, lag in enumerate(lags):
+        lagged_start = starts + MAX_PITCH - lag
+        lagged_energy = squares[lagged_start + frame_length] - squares[lagged_start]
+        numerator = (current * padded[index - lag]).sum(axis=1)
+        correlation[:, column] = numerator / np.sqrt(np.maximum(current_energy * lagged_energy, 1e-9))
+
+    best = correlation.max(axis=1)
+    # Prefer the shortest lag close to the best one to avoid pitch halving
+    first = np.argmax(correlation >= 0.85 * best[:, None], axis=1)
+    # then refine to the local maximum of that correlation peak
+    window = np.minimum(first[:, None] + np.arange(PEAK_SEARCH), len(lags) - 1)
+    peak = np.take_along_axis(correlation, window, axis=1).argmax(axis=1)
+    period = lags[window[np.arange(len(starts)), peak]]
+
+    crossings = (np.diff(np.signbit(current), axis=1) != 0).mean(axis=1)
+    voiced = (best > VOICING_THRESHOLD) & (crossings < 0.25)
+    return np.where(voiced, period, 0)
+
+
+def _quantize_reflection(reflection):
+    codes = []
+    for i, bits in enumerate(COEFFICIENT_BITS):
+        levels = 1 << bits
+        g = np.arcsin(reflection[:, i]) / (np.pi / 2)
+        codes.append(np.clip(np.floor((g + 1) / 2 * levels), 0, levels - 1).astype(np.int64))
+    return codes
+
+
+def _dequantize_reflection(codes):
+    reflection = np.empty((len(codes[0]), ORDER))
+    for i, bits in enumerate(COEFFICIENT_BITS):
+        levels = 1 << bits
+        g = (codes[i] + 0.5) / levels * 2 - 1
+        reflection[:, i] = np.sin(g * np.pi / 2)
+    return reflection
+
+
+def _pack_fields(fields):
+    bits = [((values[:, None] >> np.arange(width - 1, -1, -1)) & 1).astype(np.uint8)
+            for values, width in zip(fields, FIELD_BITS)]
+    return np.packbits(np.concatenate(bits, axis=1).ravel()).tobytes()
+
+
+def _unpack_fields(data, count):
+    bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8))[:count * FRAME_BITS]
+    bits = bits.reshape(count, FRAME_BITS).astype(np.int64)
+    fields = []
+    offset = 0
+    for width in FIELD_BITS:
+        weights = 1 << np.arange(width - 1, -1, -1)
+        fields.append(bits[:, offset:offset + width] @ weights)
+        offset += width
+    return fields
+
+
+def _analyse(signal, frame_length, context):
+    """Quantized fields for the whole frames of `signal`, which follows `context`"""
+    count = len(signal) // frame_length
+    full = np.concatenate([context, signal[:count * frame_length]])
+    offset = len(context)
+
+    frames = _frames(signal, frame_length)
+    rms = np.sqrt((frames ** 2).mean(axis=1))
+
+    emphasized = np.concatenate([full[:1], full[1:] - PRE_EMPHASIS * full[:-1]])[offset:]
+    reflection = levinson(_autocorrelation(_frames(emphasized, frame_length), ORDER))
+    starts = offset + np.arange(count) * frame_length
+    period = _detect_pitch(full, starts, frame_length)
+
+    level_db = 20 * np.log10(np.maximum(rms, 1e-9))
+    gain = np.clip(np.round((level_db - GAIN_FLOOR_DB) / GAIN_STEP_DB) + 1, 1, (1 << GAIN_BITS) - 1)
+    gain = np.where(level_db < GAIN_FLOOR_DB, 0, gain).astype(np.int64)
+    pitch = np.where(period > 0, period - MIN_PITCH + 1, 0).astype(np.int64)
+
+    return _quantize_reflection(reflection) + [pitch, gain]
+
+
+def _pad(signal, frame_length):
+    if len(signal) % frame_length:
+        signal = np.concatenate([signal, np.zeros(frame_length - len(signal) % frame_length)])
+    return signal
+
+
+def encode(samples, frame_length=180):
+    """Encode int16 (or float) 8 kHz mono samples into an LPC bitstream"""
+    signal = _pad(np.asarray(samples, dtype=np.float64), frame_length)
+    count = len(signal) // frame_length
+    if count == 0:
+        return BODY_HEADER.pack(frame_length, 0)
+    fields = _analyse(signal, frame_length, np.zeros(0))
+    return BODY_HEADER.pack(frame_length, count) + _pack_fields(fields)
+
+
+class StreamEncoder:
+    """Encode samples as they arrive into a body with an open frame count"""
+
+    def __init__(self, frame_length=180):
+        self.frame_length = frame_length
+        self.pending = np.zeros(0)
+        self.context = np.zeros(0)
+        self.started = False
+
+    def write(self, samples):
+        """Add samples and return the bytes for every completed group of frames"""
+        self.pending = np.concatenate([self.pending, np.asarray(samples, dtype=np.float64)])
+        group = GROUP_FRAMES * self.frame_length
+        usable = len(self.pending) // group * group
+        output = self._header()
+        if usable:
+            output += self._encode(self.pending[:usable])
+            self.pending = self.pending[usable:]
+        return output
+
+    def flush(self):
+        """Encode the remaining samples, padding the last frame with silence"""
+        output = self._header()
+        if len(self.pending):
+            output += self._encode(_pad(self.pending, self.frame_length))
+            self.pending = np.zeros(0)
+        return output
+
+    def _header(self):
+        if self.started:
+            return b""
+        self.started = True
+        return BODY_HEADER.pack(self.frame_length, 0)
+
+    def _encode(self, signal):
+        fields = _analyse(signal, self.frame_length, self.context)
+        self.context = np.concatenate([self.context, signal])[-(MAX_PITCH + 1):]
+        return _pack_fields(fields)
+
+
+def decode(body, seed=0):
+    """Decode an LPC bitstream into int16 8 kHz samples"""
+    frame_length, count = BODY_HEADER.unpack_from(body)
+    if count == 0:
+        # Streamed body: the count follows from the number of bits
+        count = (len(body) - BODY_HEADER.size) * 8 // FRAME_BITS
+    if count == 0:
+        return np.zeros(0, dtype=np.int16)
+    fields = _unpack_fields(body[BODY_HEADER.size:], count)
+    reflection = _dequantize_reflection(fields[:ORDER])
+    pitch, gain = fields[ORDER], fields[ORDER + 1]
+
+    period = np.where(pitch > 0, pitch + MIN_PITCH - 1, 0)
+    rms = np.where(gain > 0, 10 ** ((GAIN_FLOOR_DB + (gain - 1) * GAIN_STEP_DB) / 20), 0.0)
+
+    # Excitation: pulse trains with continuous phase for voiced frames, noise otherwise
+    rng = np.random.default_rng(seed)
+    excitation = rng.standard_normal((count, frame_length))
+    next_pulse = 0
+    for i in np.flatnonzero(period):
+        p = period[i]
+        if next_pulse >= frame_length or (i > 0 and period[i - 1] == 0):
+            next_pulse = 0
+        pulses = np.zeros(frame_length)
+        pulses[next_pulse::p] = np.sqrt(p)
+        excitation[i] = pulses
+        next_pulse = (next_pulse - frame_length) % p
+
+    # Synthesis filter 1 / (A(z) (1 - b z^-1)) includes the de-emphasis
+    a = reflection_to_lpc(reflection) * BANDWIDTH_EXPANSION ** np.arange(ORDER + 1)
+    denominator = np.zeros((count, ORDER + 2))
+    denominator[:, :-1] += a
+    denominator[:, 1:] -= PRE_EMPHASIS * a
+    response = np.zeros((count, IMPULSE_LENGTH))
+    response[:, 0] = 1.0
+    taps = ORDER + 1
+    for t in range(1, IMPULSE_LENGTH):
+        m = min(t, taps)
+        response[:, t] = -(denominator[:, 1:m + 1] * response[:, t - m:t][:, ::-1]).sum(axis=1)
+
+    length = frame_length + IMPULSE_LENGTH - 1
+    size = 1 << (length - 1).bit_length()
+    filtered = np.fft.irfft(np.fft.rfft(excitation, size) * np.fft.rfft(response, size), size)[:, :length]
+
+    # Scale each frame's contribution to the transmitted RMS
+    energy = (filtered ** 2).sum(axis=1)
+    scale = np.sqrt(rms ** 2 * frame_length / np.maximum(energy, 1e-12))
+    filtered *= scale[:, None]
+
+    # Overlap-add the ringing of each frame into the following ones
+    index = (np.arange(count) * frame_length)[:, None] + np.arange(length)
+    output = np.bincount(index.ravel(), weights=filtered.ravel(), minlength=count * frame_length + length)
+    return np.clip(output[:count * frame_length], -32768, 32767).astype(np.int16)
@@ -0,0 +1,43 @@
+"""Opening a Meshtastic interface for the engine
+
+Shared by the GUI and the command line. meshtastic, pubsub and pyserial are
+imported when a port is listed or opened, so encoding, decoding and the
+benchmarks work without them installed.
+
+A real radio publishes received packets and a lost connection on pubsub
+topics; pubsub keeps only weak references to listeners, so pass bound
+methods of objects that stay alive. The simulated port (simmesh.PORT_NAME)
+opens a one-node mesh that hears its own packets and calls on_receive
+directly.
+"""
+import simmesh
+
+
+def list_ports():
+    """Serial ports that may have a Meshtastic device, plus the built-in simulator"""
+    import serial.tools.list_ports
+    return [port.device for port in serial.tools.list_ports.comports()] + [simmesh.PORT_NAME]
+
+
+def connect(port, on_receive, on_lost=None):
+    """Open `port` and deliver received packets to on_receive(packet, interface)
+
+    on_lost(interface) is called, from a meshtastic thread, if the serial
+    link drops. Returns the interface; raises if it cannot be opened.
+    """
+    if port == simmesh.PORT_NAME:
+        return simmesh.SimMesh().add_node(on_receive=on_receive, loopback=True)
+
+    import meshtastic.serial_interface
+    from pubsub import pub
+    interface = meshtastic.serial_interface.SerialInterface(devPath=port)
+    pub.subscribe(on_receive, "meshtastic.receive")
+    if on_lost is not None:
+        pub.subscribe(on_lost, "meshtastic.connection.lost")
+    return interface
+
+
+def node_number(interface):
+    """The connected node's number, or None if the radio has not reported it"""
+    info = getattr(interface, 'myInfo', None)
+    return info.my_node_num if info else None
@@ -0,0 +1,286 @@
+"""Counters, gauges and histograms with Prometheus text export
+
+Metrics are kept in a Registry. Recording one is a dictionary-free
+increment under a per-value lock, cheap enough to leave on everywhere:
+code that records on a hot path binds the labelled value once with
+labels() and keeps it. Values that already exist elsewhere (reassembly
+buffer occupancy, duplicate filter counts) are registered as functions and
+only read when the registry is exported.
+
+The registry renders the Prometheus text exposition format, which
+MetricsServer serves on a local HTTP port and write_file writes atomically
+(for node_exporter's textfile collector, or just to look at).
+"""
+import bisect
+import os
+import threading
+import time
+
+# Seconds, from a packet handled in well under a millisecond to a whole message transfer
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+# Stages of voice_stage_seconds, from the microphone to a saved WAV file
+STAGES = ("record", "compress", "chunk", "send", "receive", "reassemble", "decode")
+
+DEFAULT_PORT = 9464  # Unassigned port commonly used for Prometheus exporters
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class CounterValue:
+    """One labelled value of a counter"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self, name):
+        return [(name, (), self.value)]
+
+
+class GaugeValue(CounterValue):
+    """One labelled value of a gauge"""
+
+    def set(self, value):
+        self.value = value
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+
+class HistogramValue:
+    """One labelled value of a histogram: bucket counts, sum and count"""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.lock = threading.Lock()
+        self.counts = [0] * (len(bounds) + 1)  # The last bucket is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self):
+        """Context manager that observes the seconds its block takes"""
+        return Timer(self)
+
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+    def samples(self, name):
+        with self.lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        samples = []
+        cumulative = 0
+        for bound, bucket in zip(list(self.bounds) + ["+Inf"], counts):
+            cumulative += bucket
+            samples.append((f"{name}_bucket", (("le", _format_value(bound)),), cumulative))
+        samples.append((f"{name}_sum", (), total))
+        samples.append((f"{name}_count", (), count))
+        return samples
+
+
+class Timer:
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+class Metric:
+    """A named metric with one value per combination of label values"""
+
+    def __init__(self, kind, name, help_text, labelnames, make_value):
+        self.kind = kind
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.make_value = make_value
+        self.lock = threading.Lock()
+        self.values = {}
+        self.default = None if self.labelnames else self.labels()
+
+    def labels(self, *labelvalues):
+        """The value for these label values, created on first use"""
+        value = self.values.get(labelvalues)
+        if value is None:
+            if len(labelvalues) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}")
+            with self.lock:
+                value = self.values.setdefault(labelvalues, self.make_value())
+        return value
+
+    # Shortcuts for metrics without labels
+
+    def inc(self, amount=1):
+        self.default.inc(amount)
+
+    def set(self, value):
+        self.default.set(value)
+
+    def observe(self, value):
+        self.default.observe(value)
+
+    def time(self):
+        return self.default.time()
+
+    def samples(self):
+        with self.lock:
+            values = list(self.values.items())
+        samples = []
+        for labelvalues, value in values:
+            labels = tuple(zip(self.labelnames, labelvalues))
+            samples += [(name, labels + extra, sample) for name, extra, sample in value.samples(self.name)]
+        return samples
+
+
+class FunctionMetric:
+    """A counter or gauge read from fn() at export time
+
+    fn returns a number, or for labelled metrics a {label values tuple: number} dict.
+    """
+
+    def __init__(self, kind, name, help_text, labelnames, fn):
+        self.kind = kind
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+
+    def samples(self):
+        result = self.fn()
+        if not self.labelnames:
+            return [(self.name, (), result)]
+        return [(self.name, tuple(zip(self.labelnames, labelvalues)), value)
+                for labelvalues, value in result.items()]
+
+
+class Registry:
+    """All metrics of one process (or one engine, in benchmarks)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def _register(self, name, create):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = create()
+            return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        """Get or create a counter; components sharing a registry share its values"""
+        return self._register(name, lambda: Metric("counter", name, help_text, labelnames, CounterValue))
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._register(name, lambda: Metric("gauge", name, help_text, labelnames, GaugeValue))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        bounds = tuple(sorted(buckets))
+        return self._register(name, lambda: Metric("histogram", name, help_text, labelnames,
+                                                   lambda: HistogramValue(bounds)))
+
+    def function(self, kind, name, help_text, fn, labelnames=()):
+        """Register a "counter" or "gauge" computed by fn() when exported, replacing any earlier one"""
+        with self.lock:
+            self.metrics[name] = FunctionMetric(kind, name, help_text, labelnames, fn)
+            return self.metrics[name]
+
+    def get(self, name):
+        return self.metrics.get(name)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                samples = metric.samples()
+            except Exception:
+                continue  # A function metric whose source is gone
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in samples:
+                if labels:
+                    label_text = ",".join(f'{key}="{_escape(label)}"' for key, label in labels)
+                    lines.append(f"{name}{{{label_text}}} {_format_value(value)}")
+                else:
+                    lines.append(f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def stage_timer(registry, stage):
+    """The voice_stage_seconds histogram value of one pipeline stage"""
+    return registry.histogram("voice_stage_seconds", "Seconds spent in each stage of the voice pipeline",
+                              ("stage",)).labels(stage)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_value(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value)) if value else "0"
+    return repr(value)
+
+
+def write_file(registry, path):
+    """Write the metrics to `path`, replacing it atomically"""
+    temporary = f"{path}.tmp"
+    with open(temporary, "w", encoding="utf-8") as f:
+        f.write(registry.render())
+    os.replace(temporary, path)
+
+
+class MetricsServer:
+    """Serve a registry as Prometheus text on http://host:port/metrics"""
+
+    def __init__(self, registry, port=DEFAULT_PORT, host="127.0.0.1"):
+        # Imported here: http.server is slow to import and only needed once serving starts
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Scrapes are not worth a log line
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, name="metrics", daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,62 @@
+"""Packet budget: how many bytes fit in one packet, and filling them
+
+Meshtastic rejects data payloads over DATA_PAYLOAD_LEN bytes, so frames are
+never cut larger than the connected interface's limit, whatever chunk size
+is selected. Header overhead is already counted: wire frames are the whole
+packet payload.
+
+A message rarely divides into full packets, and NACKs, END frames and test
+messages are small, so most of a packet can be left empty. PacketPacker lets
+the transmit scheduler top a packet up with other queued frames that fit in
+the remaining room; several frames then travel as one wire BUNDLE frame,
+which costs a header plus one length byte per frame.
+"""
+import wire
+
+DEFAULT_MAX_PAYLOAD = 233  # meshtastic.mesh_pb2.Constants.DATA_PAYLOAD_LEN
+
+
+def max_payload(interface):
+    """Largest packet payload the interface can send"""
+    limit = getattr(interface, 'max_payload', None)  # simmesh interfaces report their mesh's limit
+    if limit:
+        return limit
+    try:
+        from meshtastic.protobuf import mesh_pb2
+    except ImportError:
+        try:
+            from meshtastic import mesh_pb2  # Before meshtastic 2.3
+        except ImportError:
+            return DEFAULT_MAX_PAYLOAD
+    return mesh_pb2.Constants.DATA_PAYLOAD_LEN
+
+
+def bundle_size(sizes):
+    """Bytes of a BUNDLE frame carrying packets of the given sizes"""
+    return wire.HEADER_SIZE + sum(wire.BUNDLE_ITEM_OVERHEAD + size for size in sizes)
+
+
+class PacketPacker:
+    """Collect frames for one packet without going over the budget"""
+
+    def __init__(self, max_payload, first):
+        self.max_payload = max_payload
+        self.frames = [first]
+        self.bundled = wire.HEADER_SIZE + wire.BUNDLE_ITEM_OVERHEAD + len(first)  # Size once bundled
+
+    def room(self):
+        """Largest frame that still fits"""
+        return min(self.max_payload - self.bundled - wire.BUNDLE_ITEM_OVERHEAD, wire.MAX_BUNDLE_ITEM)
+
+    def fits(self, frame):
+        return len(frame) <= self.room()
+
+    def add(self, frame):
+        self.frames.append(frame)
+        self.bundled += wire.BUNDLE_ITEM_OVERHEAD + len(frame)
+
+    def packet(self):
+        """The packet to send: the frame itself, or a bundle of all of them"""
+        if len(self.frames) == 1:
+            return self.frames[0]
+        return wire.pack_bundle(self.frames)
@@ -0,0 +1,302 @@
+"""NumPy replacements for the audioop functions used by the encoder
+
+audioop is gone from Python 3.13. This module covers what the app needs from
+it (bit depth conversion is dsp.BitDepthConverter):
+- Resampler: a polyphase FIR resampler for any rational ratio, with state
+  so a recording can be resampled block by block
+- lin2ulaw / ulaw2lin: G.711 mu-law companding, bit-exact with audioop
+- AdpcmEncoder / adpcm_decode: 4-bit IMA ADPCM, bit-exact with audioop's
+  lin2adpcm / adpcm2lin
+
+Costs, per second of 16 kHz audio from bench_pcm.py:
+- the ADPCM encoder is a plain Python loop, since each code depends on the
+  predictor left by the previous sample. It takes about 20 ms where
+  audioop's C loop took 0.3 ms, so a minute of audio takes about 1.2 s to
+  encode (half that at the ADPCM preset's 8 kHz)
+- the decoder has no such feedback: its step index and predictor are
+  running sums clamped to a range (clamped_cumsum), so it is array
+  operations, about 1 ms against audioop's 0.1 ms. Audio that clips
+  all the time falls back to loops and costs about as much as encoding
+- the resampler is a sharper filter than audioop.ratecv and takes 1-2 ms
+  against 0.3 ms
+"""
+from math import gcd
+
+from lazyimport import lazy_import
+
+import dsp
+
+np = lazy_import("numpy")  # Imported on first use, keeping numpy out of startup
+
+TAPS_PER_PHASE = 16  # FIR taps per output sample, scaled up when decimating
+ROLLOFF = 0.9  # Cutoff as a fraction of the lower Nyquist frequency
+KAISER_BETA = 8.0  # About 80 dB stopband attenuation
+BLOCK = 8192  # Samples handled per vectorized step or Python list, to bound memory
+
+
+class Resampler:
+    """Resample float samples from one rate to another
+
+    `process` takes arrays shaped (samples,) or (samples, channels) and
+    returns the output samples that are ready; `flush` returns the rest once
+    the input has ended. Together they produce ceil(n * target / source)
+    samples for n input samples.
+    """
+
+    def __init__(self, source_rate, target_rate, channels=1, taps=TAPS_PER_PHASE):
+        divisor = gcd(source_rate, target_rate)
+        self.up = target_rate // divisor
+        self.down = source_rate // divisor
+        self.channels = channels
+        # When decimating, the filter spans `taps` periods of the lower rate, so more input samples
+        self.taps = -(-taps * max(self.up, self.down) // self.up)
+        taps = self.taps
+
+        # Windowed-sinc low-pass at the upsampled rate, split into one row of taps per phase
+        length = taps * self.up
+        cutoff = ROLLOFF * 0.5 / max(self.up, self.down)
+        n = np.arange(length) - (length - 1) / 2
+        prototype = 2 * cutoff * np.sinc(2 * cutoff * n) * np.kaiser(length, KAISER_BETA)
+        prototype *= self.up / prototype.sum()
+        self.table = prototype.reshape(taps, self.up).T.astype(np.float32)
+        self.delay = (length - 1) // 2  # Group delay in upsampled samples
+
+        self.history = np.zeros((taps - 1, channels), dtype=np.float32)
+        self.start = -(taps - 1)  # Input index of history[0]
+        self.received = 0  # Input samples so far
+        self.produced = 0  # Output samples so far
+
+    def process(self, samples):
+        """Resample the next block of input"""
+        samples = np.asarray(samples, dtype=np.float32).reshape(-1, self.channels)
+        self.received += len(samples)
+        return self._run(samples, None)
+
+    def flush(self):
+        """Return the output still held back by the filter delay"""
+        expected = -(-self.received * self.up // self.down)
+        padding = np.zeros((self.delay // self.up + self.taps + 1, self.channels), dtype=np.float32)
+        return self._run(padding, expected)
+
+    def _run(self, samples, limit):
+        buffer = np.concatenate((self.history, samples))
+        end = self.start + len(buffer)
+        # Output n sits at upsampled time n * down + delay and needs input up to that time
+        stop = max(self.produced, -(-(end * self.up - self.delay) // self.down))
+        if limit is not None:
+            stop = min(stop, limit)
+
+        blocks = []
+        offsets = np.arange(self.taps)
+        for first in range(self.produced, stop, BLOCK):
+            time = np.arange(first, min(first + BLOCK, stop), dtype=np.int64) * self.down + self.delay
+            base = time // self.up - self.start
+            window = buffer[base[:, None] - offsets]
+            blocks.append(np.einsum('nk,nkc->nc', self.table[time % self.up], window))
+        self.produced = stop
+
+        self.history = buffer[len(buffer) - (self.taps - 1):]
+        self.start = end - (self.taps - 1)
+        if not blocks:
+            return np.zeros((0, self.channels), dtype=np.float32)
+        return np.concatenate(blocks)
+
+
+def to_float(frames, sample_width, channels):
+    """PCM bytes as a (samples, channels) float array on the integer scale, centered on 0"""
+    samples = dsp.pcm_to_array(frames, sample_width)
+    samples = samples[:len(samples) // channels * channels].reshape(-1, channels).astype(np.float32)
+    if sample_width == 1:
+        samples -= 128  # 8-bit PCM is unsigned
+    return samples
+
+
+def from_float(samples, sample_width):
+    """Round and clip float samples from to_float back to PCM bytes"""
+    bits = 8 * sample_width
+    samples = np.clip(np.rint(samples), -2 ** (bits - 1), 2 ** (bits - 1) - 1)
+    if sample_width == 1:
+        return (samples + 128).astype(np.uint8).tobytes()
+    return samples.astype(dsp.SIGNED_DTYPES[sample_width]).tobytes()
+
+
+def resample(frames, sample_width, channels, source_rate, target_rate):
+    """Resample PCM bytes in one go"""
+    if source_rate == target_rate:
+        return bytes(frames)
+    resampler = Resampler(source_rate, target_rate, channels)
+    samples = to_float(frames, sample_width, channels)
+    return from_float(np.concatenate((resampler.process(samples), resampler.flush())), sample_width)
+
+
+# G.711 mu-law, as implemented by audioop (14-bit magnitude, bias 33, clip 8159)
+ULAW_SEGMENT_ENDS = (0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF, 0x1FFF)
+
+
+def lin2ulaw(samples):
+    """Compress int16 samples to mu-law bytes (uint8 array)"""
+    value = np.asarray(samples, dtype=np.int32) >> 2
+    mask = np.where(value < 0, 0x7F, 0xFF)
+    magnitude = np.minimum(np.abs(value), 8159) + 33
+    segment = np.searchsorted(ULAW_SEGMENT_ENDS, magnitude)
+    code = np.where(segment < 8, (segment << 4) | ((magnitude >> (segment + 1)) & 0xF), 0x7F)
+    return (code ^ mask).astype(np.uint8)
+
+
+def ulaw2lin(codes):
+    """Expand mu-law bytes to int16 samples"""
+    value = ~np.asarray(codes, dtype=np.int32) & 0xFF
+    magnitude = (((value & 0x0F) << 3) + 0x84) << ((value & 0x70) >> 4)
+    return np.where(value & 0x80, 0x84 - magnitude, magnitude - 0x84).astype(np.int16)
+
+
+ADPCM_INDEX_TABLE = (-1, -1, -1, -1, 2, 4, 6, 8, -1, -1, -1, -1, 2, 4, 6, 8)
+ADPCM_STEP_TABLE = (
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+    50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230,
+    253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963,
+    1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327,
+    3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442,
+    11487, 12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794,
+    32767)
+
+
+class AdpcmEncoder:
+    """IMA ADPCM encoder that keeps its state across blocks
+
+    Two 4-bit codes are packed per byte, first sample in the high nibble.
+    An odd sample is held until the next block; `flush` pads it.
+    """
+
+    def __init__(self):
+        self.predictor = 0
+        self.index = 0
+        self.pending = None  # High nibble waiting for its pair
+
+    def encode(self, samples):
+        """Encode int16 samples, returning the completed bytes"""
+        predictor = self.predictor
+        index = self.index
+        pending = self.pending
+        index_table = ADPCM_INDEX_TABLE
+        step_table = ADPCM_STEP_TABLE
+        output = bytearray()
+        for value in _values(np.asarray(samples, dtype=np.int16)):
+            step = step_table[index]
+            diff = value - predictor
+            sign = 0
+            if diff < 0:
+                sign = 8
+                diff = -diff
+            delta = 0
+            vpdiff = step >> 3
+            if diff >= step:
+                delta = 4
+                diff -= step
+                vpdiff += step
+            step >>= 1
+            if diff >= step:
+                delta |= 2
+                diff -= step
+                vpdiff += step
+            step >>= 1
+            if diff >= step:
+                delta |= 1
+                vpdiff += step
+            predictor = max(-32768, predictor - vpdiff) if sign else min(32767, predictor + vpdiff)
+            delta |= sign
+            index = min(88, max(0, index + index_table[delta]))
+            if pending is None:
+                pending = delta << 4
+            else:
+                output.append(pending | delta)
+                pending = None
+        self.predictor = predictor
+        self.index = index
+        self.pending = pending
+        return bytes(output)
+
+    def flush(self):
+        """Return the last half-filled byte, if any"""
+        if self.pending is None:
+            return b""
+        output = bytes([self.pending])
+        self.pending = None
+        return output
+
+
+def _values(array):
+    """Iterate over an array as Python ints, converting a block at a time"""
+    for start in range(0, len(array), BLOCK):
+        yield from array[start:start + BLOCK].tolist()
+
+
+def adpcm_encode(samples):
+    """Encode int16 samples to IMA ADPCM bytes from the initial state"""
+    encoder = AdpcmEncoder()
+    return encoder.encode(samples) + encoder.flush()
+
+
+def clamped_cumsum(changes, start, low, high, window=1024):
+    """Running sum of `changes` from `start`, clamped to [low, high] after every step
+
+    Clamping at one bound only is a reflection: the running sum minus its
+    furthest excursion past that bound so far. The sum is reflected at the
+    bound it last touched until it reaches the other one, where it is
+    clamped and the roles swap. The work is done over windows of changes
+    that double while no bound is crossed, so crossings only redo a window;
+    where crossings come every few steps, a window is summed in a loop.
+    """
+    changes = np.asarray(changes, dtype=np.int64)
+    result = np.empty(len(changes), dtype=np.int64)
+    position, value, size = 0, start, window
+    at_high = False  # Which bound is being reflected
+    while position < len(changes):
+        total = value + np.cumsum(changes[position:position + size])
+        if at_high:
+            clamped = total - np.maximum(np.maximum.accumulate(total) - high, 0)
+            crossed = np.flatnonzero(clamped < low)
+        else:
+            clamped = total - np.minimum(np.minimum.accumulate(total) - low, 0)
+            crossed = np.flatnonzero(clamped > high)
+        if not len(crossed):
+            result[position:position + len(clamped)] = clamped
+            position += len(clamped)
+            value = clamped[-1]
+            size *= 2
+            continue
+        stop = position + crossed[0]
+        result[position:stop] = clamped[:crossed[0]]
+        value = result[stop] = low if at_high else high
+        position = stop + 1
+        at_high = not at_high
+        size = window
+        if crossed[0] < window // 16:
+            # Crossing back and forth (clipping audio): a loop beats array calls per crossing
+            stretch = []
+            for change in _values(changes[position:position + window]):
+                value = min(high, max(low, value + change))
+                stretch.append(value)
+            result[position:position + len(stretch)] = stretch
+            position += len(stretch)
+    return result
+
+
+def adpcm_decode(data):
+    """Decode IMA ADPCM bytes to int16 samples (two per byte)"""
+    packed = np.frombuffer(data, dtype=np.uint8)
+    codes = np.empty(2 * len(packed), dtype=np.uint8)
+    codes[0::2] = packed >> 4
+    codes[1::2] = packed & 0x0F
+
+    # The step index only depends on the codes; each code uses the index left by the one before
+    indexes = np.zeros(len(codes), dtype=np.int64)
+    indexes[1:] = clamped_cumsum(np.asarray(ADPCM_INDEX_TABLE)[codes[:-1]], 0, 0, 88)
+    steps = np.asarray(ADPCM_STEP_TABLE, dtype=np.int32)[indexes]
+
+    magnitude = codes & 7
+    vpdiff = ((steps >> 3) + np.where(magnitude & 4, steps, 0) + np.where(magnitude & 2, steps >> 1, 0)
+              + np.where(magnitude & 1, steps >> 2, 0))
+    vpdiff = np.where(codes & 8, -vpdiff, vpdiff)
+
+    return clamped_cumsum(vpdiff, 0, -32768, 32767).astype(np.int16)
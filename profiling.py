@@ -0,0 +1,200 @@
+"""Opt-in profiling of the encode, send and receive hot paths
+
+Profiling is off unless the VOICE_PROFILE environment variable or the
+--profile command line flag names an output directory. When it is off
+nothing is wrapped, so the hot paths cost exactly what they did before.
+
+When it is on, instrument() replaces named methods of an object with
+wrappers that run each call under cProfile and, every `memory_every`
+calls, compare tracemalloc snapshots taken before and after it. Results
+are accumulated per operation, so a method called for every packet does
+not write a file per packet. dump() (called by close(), and at exit)
+writes for each operation:
+- <operation>.prof, pstats data for snakeviz, `python -m pstats` and the like
+- <operation>.txt, call count and time, the top functions by cumulative
+  time and the source lines that allocated the most memory
+
+Only one cProfile profiler may be active at a time: from Python 3.12 a
+second one raises ValueError even on another thread. So one profiled call
+runs under cProfile at a time, and calls that start while it runs (nested
+in it, or on other threads such as the receive workers) are only timed. A
+nested call's functions show up in the outer operation's profile. If some
+other profiling tool is active, calls are only timed as well. tracemalloc
+is process-wide, so allocations made by other threads during a sampled call
+are counted with it.
+"""
+import atexit
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+
+ENV_VAR = "VOICE_PROFILE"  # Output directory; profiling is off when unset or empty
+TOP = 25  # Functions and allocation sites listed per report
+MEMORY_EVERY = 10  # Calls per operation between tracemalloc samples
+TRACE_FRAMES = 1  # Stack depth kept by tracemalloc
+
+
+def from_environment(directory=None, log=None):
+    """A Profiler writing to `directory` (or $VOICE_PROFILE), or None when profiling is off"""
+    directory = directory or os.environ.get(ENV_VAR)
+    if not directory:
+        return None
+    return Profiler(directory, log=log)
+
+
+class OperationStats:
+    """What one operation accumulated: its profiler, timing and allocations"""
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+        self.calls = 0
+        self.profiled = 0  # Calls run under cProfile; the rest were only timed
+        self.seconds = 0.0
+        self.slowest = 0.0
+        self.memory_samples = 0
+        self.allocated = defaultdict(int)  # "file:line" -> bytes allocated and not freed during sampled calls
+
+
+class Profiler:
+    """Wrap methods to profile them and write per-operation reports"""
+
+    def __init__(self, directory, top=TOP, memory_every=MEMORY_EVERY, log=None):
+        self.directory = directory
+        self.top = top
+        self.memory_every = memory_every  # 0 disables allocation tracking
+        self.log = log or (lambda message: None)
+        self.lock = threading.Lock()
+        self.operations = defaultdict(OperationStats)
+        self.active = False  # True while a call runs under cProfile, on any thread
+        self.closed = False
+        os.makedirs(directory, exist_ok=True)
+        if self.memory_every and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACE_FRAMES)
+        atexit.register(self.close)
+
+    def instrument(self, obj, names, prefix=None):
+        """Replace obj.<name> with a profiled wrapper for each name that exists"""
+        prefix = prefix or type(obj).__name__
+        for name in names:
+            fn = getattr(obj, name, None)
+            if callable(fn):
+                setattr(obj, name, self.wrap(f"{prefix}.{name}", fn))
+
+    def wrap(self, operation, fn):
+        """Return fn wrapped to profile every call as `operation`"""
+        def profiled(*args, **kwargs):
+            if self.closed:
+                return fn(*args, **kwargs)
+            return self.call(operation, fn, args, kwargs)
+        profiled.__wrapped__ = fn
+        profiled.__name__ = getattr(fn, '__name__', operation)
+        return profiled
+
+    def call(self, operation, fn, args, kwargs):
+        with self.lock:
+            stats = self.operations[operation]
+            stats.calls += 1
+            profile = None
+            if not self.active:
+                # Claim the one profiler slot; calls starting meanwhile are only timed
+                self.active = True
+                profile = stats.profile
+        sample = False
+        if profile is not None:
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiling tool is active
+                self.release()
+                profile = None
+            else:
+                with self.lock:
+                    stats.profiled += 1
+                    sample = bool(self.memory_every) and (stats.profiled - 1) % self.memory_every == 0
+        before = tracemalloc.take_snapshot() if sample else None
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            if profile is not None:
+                profile.disable()
+            allocated = self.allocations(before) if sample else ()
+            if profile is not None:
+                self.release()
+            with self.lock:
+                stats.seconds += elapsed
+                stats.slowest = max(stats.slowest, elapsed)
+                if sample:
+                    stats.memory_samples += 1
+                    for line, size in allocated:
+                        stats.allocated[line] += size
+
+    def release(self):
+        """Free the profiler slot for the next call"""
+        with self.lock:
+            self.active = False
+
+    def allocations(self, before):
+        """(file:line, bytes) allocated since the `before` snapshot, ignoring the profilers' own"""
+        if not tracemalloc.is_tracing():
+            return []  # Closed during the call
+        after = tracemalloc.take_snapshot()
+        ignore = (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, cProfile.__file__),
+                  tracemalloc.Filter(False, __file__))
+        after, before = after.filter_traces(ignore), before.filter_traces(ignore)
+        return [(f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}", stat.size_diff)
+                for stat in after.compare_to(before, 'lineno') if stat.size_diff > 0]
+
+    def dump(self):
+        """Write a .prof and a .txt report for every operation called so far"""
+        with self.lock:
+            operations = list(self.operations.items())
+        for operation, stats in operations:
+            try:
+                self.write_report(operation, stats)
+            except Exception as e:
+                self.log(f"Error writing profile of {operation}: {str(e)}")
+        if operations:
+            self.log(f"Wrote profiles of {len(operations)} operations to {self.directory}")
+
+    def write_report(self, operation, stats):
+        with self.lock:
+            allocated = sorted(stats.allocated.items(), key=lambda item: item[1], reverse=True)[:self.top]
+            calls, profiled, seconds, slowest = stats.calls, stats.profiled, stats.seconds, stats.slowest
+            memory_samples = stats.memory_samples
+        merged = None
+        if profiled:
+            merged = pstats.Stats(stats.profile)
+        path = os.path.join(self.directory, operation)
+        text = io.StringIO()
+        text.write(f"{operation}: {calls} calls, {seconds:.3f} s total, "
+                   f"{seconds / max(calls, 1) * 1000:.2f} ms mean, {slowest * 1000:.2f} ms slowest\n")
+        if calls > profiled:
+            text.write(f"{calls - profiled} calls started while another profiled call was running "
+                       f"and were only timed\n")
+        text.write("\n")
+        if merged is not None:
+            merged.dump_stats(f"{path}.prof")
+            merged.stream = text
+            merged.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top)
+        if memory_samples:
+            text.write(f"Top allocations over {memory_samples} sampled calls (bytes still held after the call)\n")
+            for line, size in allocated:
+                text.write(f"{size / memory_samples:>12.0f} B/call  {line}\n")
+        with open(f"{path}.txt", "w", encoding="utf-8") as f:
+            f.write(text.getvalue())
+
+    def close(self):
+        """Write the reports once and stop wrapping calls"""
+        if self.closed:
+            return
+        self.closed = True
+        self.dump()
+        if self.memory_every and tracemalloc.is_tracing():
+            tracemalloc.stop()
@@ -0,0 +1,74 @@
+"""Progressive decoding of segmented voice messages
+
+A LiveAudio object follows one incoming CODEC_SEGMENTED message. The
+receiver feeds it the payload bytes of the chunks that arrived in order so
+far. Every segment that is complete is decoded at once and appended to a PCM
+buffer, which a player thread can read while the rest is still in transit.
+"""
+import threading
+
+import codec
+
+
+def is_progressive(first_chunk):
+    """Check whether a message's first payload chunk starts a segmented payload"""
+    return len(first_chunk) >= codec.AUDIO_HEADER.size and first_chunk[0] == codec.CODEC_SEGMENTED
+
+
+class LiveAudio:
+    """Decoded audio of a message that is still arriving"""
+
+    def __init__(self):
+        self.params = None
+        self.pcm = bytearray()
+        self.pending = bytearray()  # Payload bytes not yet part of a complete segment
+        self.consumed = 0  # Payload bytes fed so far
+        self.segments = 0
+        self.finished = False
+        self.complete = False
+        self.condition = threading.Condition()
+
+    @property
+    def duration(self):
+        """Seconds of audio decoded so far"""
+        if self.params is None:
+            return 0.0
+        return len(self.pcm) / (self.params.sample_rate * self.params.channels * self.params.sample_width)
+
+    def feed(self, data):
+        """Add the next in-order payload bytes, returning how many segments were decoded"""
+        self.pending += data
+        self.consumed += len(data)
+        if self.params is None:
+            if len(self.pending) < codec.AUDIO_HEADER.size:
+                return 0
+            _, self.params = codec.unpack_audio_header(self.pending)
+            del self.pending[:codec.AUDIO_HEADER.size]
+
+        segments, used = codec.split_segments(self.pending)
+        if not segments:
+            return 0
+        del self.pending[:used]
+        decoded = b"".join(codec.decode_segment(inner, body, self.params) for inner, body in segments)
+        with self.condition:
+            self.pcm += decoded
+            self.segments += len(segments)
+            self.condition.notify_all()
+        return len(segments)
+
+    def finish(self, complete=True):
+        """Mark the message as done, either fully received or given up on"""
+        with self.condition:
+            self.finished = True
+            self.complete = complete
+            self.condition.notify_all()
+
+    def read(self, offset, timeout=0.5):
+        """Return decoded PCM from `offset`, waiting briefly for more
+
+        An empty result after `finished` means the end of the message.
+        """
+        with self.condition:
+            if len(self.pcm) <= offset and not self.finished:
+                self.condition.wait(timeout)
+            return bytes(self.pcm[offset:])
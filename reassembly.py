@@ -0,0 +1,343 @@
+"""Bounded store for partially received messages
+
+Each partial message gets one preallocated bytearray divided into equal slots
+(one per chunk, parity chunks included), a received bitmap and a per-slot
+length. Chunks are copied straight into their slot, and the payload is
+joined from a single buffer once the message is complete.
+
+The store is bounded in four ways:
+- partials that received nothing for `ttl` seconds expire
+- the number of messages and the total buffer bytes are capped. To make
+  room, partials idle for `stale` seconds are evicted, least recently
+  updated first; if every partial is still receiving, the new message is
+  turned away instead, so a burst of senders cannot flush out messages
+  that are about to complete
+- each sender may hold at most `max_per_sender` partials; beyond that their
+  own oldest partial is evicted, so one node cannot push out everyone else
+- a message whose buffer alone would exceed the byte cap is rejected, also
+  when a streamed message grows past it
+
+Streamed messages arrive with an unknown total (0). Their slots start at
+STREAM_SLOTS and double as chunks arrive, until an END frame sets the total.
+"""
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from datetime import datetime
+
+import fec
+import wire
+
+STREAM_SLOTS = 32  # Initial slots for a message of unknown length
+MAX_SEQ = 0xFFFE  # Highest data seq a frame header can carry below the END seq
+
+
+def buffer_size(slots, slot_size):
+    """Bytes a PartialMessage holds: its buffer, bitmap and lengths"""
+    return slots * slot_size + (slots + 7) // 8 + 2 * slots
+
+
+class PartialMessage:
+    """One message being reassembled"""
+
+    __slots__ = ('key', 'sender', 'total', 'slots', 'slot_size', 'legacy', 'fec',
+                 'timestamp', 'last_chunk_time', 'received', 'highest', 'contiguous', 'bitmap', 'lengths',
+                 'buffer', 'nbytes')
+
+    def __init__(self, key, sender, total, slots, slot_size, legacy, fec_params, now):
+        self.key = key
+        self.sender = sender
+        self.total = total  # Data chunks, wire.TOTAL_UNKNOWN until a streamed message ends
+        self.slots = slots  # Data and parity chunks
+        self.slot_size = slot_size
+        self.legacy = legacy
+        self.fec = fec_params
+        self.timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        self.last_chunk_time = now
+        self.received = 0
+        self.highest = -1
+        self.contiguous = 0  # Data chunks received in order from the start
+        self.bitmap = bytearray((slots + 7) // 8)
+        self.lengths = array('H', bytes(2 * slots))
+        self.buffer = bytearray(slots * slot_size)
+        self.nbytes = buffer_size(slots, slot_size)
+
+    def limit(self):
+        """One past the highest seq this message accepts"""
+        if self.total == wire.TOTAL_UNKNOWN:
+            return MAX_SEQ + 1
+        return self.slots if self.fec is not None else self.total
+
+    def has(self, seq):
+        return self.bitmap[seq >> 3] >> (seq & 7) & 1
+
+    def seqs(self):
+        """Received sequence numbers (0-based)"""
+        return {seq for seq in range(self.slots) if self.has(seq)}
+
+    def missing_data(self):
+        """Data sequence numbers not received yet
+
+        With an unknown total this is every gap plus the seq after the highest
+        one received, which is either the next chunk or the END frame.
+        """
+        if self.total == wire.TOTAL_UNKNOWN:
+            return [seq for seq in range(self.highest + 2) if seq >= self.slots or not self.has(seq)]
+        return [seq for seq in range(self.total) if not self.has(seq)]
+
+    def put(self, seq, data):
+        """Copy a chunk into its slot, returning False for a duplicate"""
+        index, bit = seq >> 3, 1 << (seq & 7)
+        if seq >= self.slots:
+            self._resize(self.slot_size, max(seq + 1, 2 * self.slots))
+        elif self.bitmap[index] & bit:
+            return False
+        length = len(data)
+        if length > self.slot_size:
+            self._resize(length, self.slots)
+        start = seq * self.slot_size
+        self.buffer[start:start + length] = data
+        self.lengths[seq] = length
+        self.bitmap[index] |= bit
+        self.received += 1
+        if seq > self.highest:
+            self.highest = seq
+        if seq == self.contiguous:
+            # Only filling the first gap moves the in-order prefix
+            end = self.total or self.slots
+            while self.contiguous < end and self.has(self.contiguous):
+                self.contiguous += 1
+        return True
+
+    def _resize(self, slot_size, slots):
+        # Streamed messages grow; otherwise this only happens when the short
+        # last chunk arrived first
+        old = self.buffer
+        self.buffer = bytearray(slots * slot_size)
+        if slot_size == self.slot_size:
+            self.buffer[:len(old)] = old
+        else:
+            for seq in range(self.slots):
+                length = self.lengths[seq]
+                if length:
+                    source = seq * self.slot_size
+                    self.buffer[seq * slot_size:seq * slot_size + length] = old[source:source + length]
+        if slots > self.slots:
+            self.bitmap.extend(bytes((slots + 7) // 8 - len(self.bitmap)))
+            self.lengths.extend(bytes(2 * (slots - self.slots)))
+            self.nbytes += len(self.bitmap) - (self.slots + 7) // 8 + 2 * (slots - self.slots)
+        self.nbytes += len(self.buffer) - len(old)
+        self.slot_size = slot_size
+        self.slots = slots
+
+    def chunk(self, seq):
+        """Zero-copy view of a received chunk"""
+        start = seq * self.slot_size
+        return memoryview(self.buffer)[start:start + self.lengths[seq]]
+
+    def shards(self):
+        """Received chunks as {seq: bytes} for FEC decoding"""
+        return {seq: bytes(self.chunk(seq)) for seq in range(self.slots) if self.has(seq)}
+
+    def join(self):
+        """Concatenate the data chunks in order (all must be present)"""
+        view = memoryview(self.buffer)
+        last = self.total - 1
+        if all(self.lengths[seq] == self.slot_size for seq in range(last)):
+            # Every chunk but the last fills its slot, so the payload is contiguous
+            return bytes(view[:last * self.slot_size + self.lengths[last]])
+        return b"".join(self.chunk(seq) for seq in range(self.total))
+
+
+class ReassemblyBuffer:
+    """Partial messages keyed by message key, least recently updated first"""
+
+    def __init__(self, ttl=300.0, max_messages=256, max_bytes=4 * 1024 * 1024, max_per_sender=8,
+                 stale=60.0, on_evict=None):
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.max_per_sender = max_per_sender
+        self.stale = stale  # Idle seconds before a partial may be evicted to make room (covers the NACK rounds)
+        self.on_evict = on_evict  # Called as on_evict(message, reason) outside the lock
+        self.lock = threading.Lock()
+        self.messages = OrderedDict()
+        self.per_sender = {}
+        self.bytes_used = 0
+        self.next_expiry = 0.0  # No partial expires before this time
+        # 'rejected' is a message too large to buffer, 'full' one turned away while every partial was receiving
+        self.evictions = {'ttl': 0, 'lru': 0, 'sender': 0, 'memory': 0, 'rejected': 0, 'full': 0}
+
+    def __len__(self):
+        return len(self.messages)
+
+    def __contains__(self, key):
+        return key in self.messages
+
+    def get(self, key):
+        return self.messages.get(key)
+
+    def snapshot(self):
+        """List of (key, PartialMessage) that is safe to iterate from another thread"""
+        with self.lock:
+            return list(self.messages.items())
+
+    def add(self, key, sender, seq, total, data, legacy=False, fec_params=None, now=None):
+        """Store a chunk and return its PartialMessage, or None if it was dropped
+
+        `seq` is 0-based. Raises ValueError for a chunk outside the message.
+        """
+        now = time.time() if now is None else now
+        evicted = []
+        with self.lock:
+            if now >= self.next_expiry:
+                self._expire(now, evicted)
+            message = self.messages.get(key)
+            if message is None:
+                slots = total
+                if total == wire.TOTAL_UNKNOWN:
+                    if fec_params is not None:
+                        raise ValueError("FEC chunks need a known total")
+                    slots = STREAM_SLOTS
+                elif fec_params is not None:
+                    last = fec.layout(total, fec_params)[-1]
+                    slots = last.parity_start + last.parity_count
+                if not 0 <= seq < (MAX_SEQ + 1 if total == wire.TOTAL_UNKNOWN else slots):
+                    raise ValueError(f"Chunk {seq + 1} outside message of {slots} chunks")
+                slot_size = max(len(data), 1)
+                # Checked before allocating, as a full store turns away every chunk of a new message
+                if self._make_room(sender, buffer_size(slots, slot_size), now, evicted):
+                    message = self._insert(PartialMessage(key, sender, total, slots, slot_size, legacy, fec_params,
+                                                          now))
+            else:
+                if not 0 <= seq < message.limit():
+                    raise ValueError(f"Chunk {seq + 1} outside message of {message.limit()} chunks")
+                self.messages.move_to_end(key)
+
+            if message is not None:
+                before = message.nbytes
+                message.put(seq, data)
+                message.last_chunk_time = now
+                if message.nbytes != before:
+                    self.bytes_used += message.nbytes - before
+                    message = self._fit(message, now, evicted)
+        if evicted:
+            self._notify(evicted)
+        return message
+
+    def announce(self, key, sender, total, now=None):
+        """Set the chunk count of a streamed message from its END frame
+
+        Returns the PartialMessage (created empty if no chunk arrived yet),
+        or None if it could not be buffered.
+        """
+        now = time.time() if now is None else now
+        evicted = []
+        with self.lock:
+            self._expire(now, evicted)
+            message = self.messages.get(key)
+            if message is None:
+                if self._make_room(sender, buffer_size(max(total, 1), 1), now, evicted):
+                    message = self._insert(PartialMessage(key, sender, total, max(total, 1), 1, False, None, now))
+            else:
+                self.messages.move_to_end(key)
+            if message is not None:
+                if message.highest >= total:
+                    raise ValueError(f"END announces {total} chunks but chunk {message.highest + 1} arrived")
+                message.total = total
+                message.last_chunk_time = now
+                if total > message.slots:
+                    # Chunks still to come would otherwise land past the bitmap
+                    before = message.nbytes
+                    message._resize(message.slot_size, total)
+                    self.bytes_used += message.nbytes - before
+                    message = self._fit(message, now, evicted)
+        self._notify(evicted)
+        return message
+
+    def _insert(self, message):
+        self.messages[message.key] = message
+        self.per_sender[message.sender] = self.per_sender.get(message.sender, 0) + 1
+        self.bytes_used += message.nbytes
+        return message
+
+    def pop(self, key):
+        """Remove a message (completed or abandoned) and return it"""
+        with self.lock:
+            message = self.messages.pop(key, None)
+            if message is not None:
+                self._release(message)
+            return message
+
+    def expire(self, now=None):
+        """Drop partials that timed out, returning their keys"""
+        now = time.time() if now is None else now
+        evicted = []
+        with self.lock:
+            self._expire(now, evicted)
+        self._notify(evicted)
+        return [message.key for message, _ in evicted]
+
+    def _expire(self, now, evicted):
+        # Ordered by last update, so expired entries are at the front and
+        # nothing expires before the front entry does (add checks next_expiry
+        # itself, saving a call per chunk)
+        while self.messages:
+            key, message = next(iter(self.messages.items()))
+            if now - message.last_chunk_time < self.ttl:
+                self.next_expiry = message.last_chunk_time + self.ttl
+                return
+            self._evict(key, 'ttl', evicted)
+        self.next_expiry = now + self.ttl
+
+    def _make_room(self, sender, nbytes, now, evicted):
+        """Evict to fit a new message of `nbytes`, returning False if it has to be turned away"""
+        if nbytes > self.max_bytes:
+            self.evictions['rejected'] += 1
+            return False
+        if self.per_sender.get(sender, 0) >= self.max_per_sender:
+            oldest = next(key for key, other in self.messages.items() if other.sender == sender)
+            self._evict(oldest, 'sender', evicted)
+        while self.messages:
+            full = len(self.messages) >= self.max_messages
+            if not full and self.bytes_used + nbytes <= self.max_bytes:
+                break
+            key, oldest = next(iter(self.messages.items()))
+            if now - oldest.last_chunk_time < self.stale:
+                self.evictions['full'] += 1
+                return False
+            self._evict(key, 'lru' if full else 'memory', evicted)
+        return True
+
+    def _fit(self, message, now, evicted):
+        """Evict stale partials while a grown message puts the store over its byte cap
+
+        Returns the message, or None if it had to be dropped itself.
+        """
+        while self.bytes_used > self.max_bytes:
+            key, oldest = next(iter(self.messages.items()))
+            if message.nbytes > self.max_bytes or oldest is message or now - oldest.last_chunk_time < self.stale:
+                self._evict(message.key, 'memory', evicted)
+                return None
+            self._evict(key, 'memory', evicted)
+        return message
+
+    def _evict(self, key, reason, evicted):
+        message = self.messages.pop(key)
+        self._release(message)
+        self.evictions[reason] += 1
+        evicted.append((message, reason))
+
+    def _release(self, message):
+        self.bytes_used -= message.nbytes
+        count = self.per_sender[message.sender] - 1
+        if count:
+            self.per_sender[message.sender] = count
+        else:
+            del self.per_sender[message.sender]
+
+    def _notify(self, evicted):
+        if self.on_evict is not None:
+            for message, reason in evicted:
+                self.on_evict(message, reason)
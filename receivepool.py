@@ -0,0 +1,91 @@
+"""Receive workers that keep the radio reader thread free
+
+meshtastic calls the receive callback on its serial reader thread, and
+nothing is read from the radio while the callback runs. Reassembling and
+decoding a message and writing its WAV file can take long enough for
+packets to back up, so the callback only hands packets to a ReceivePool.
+
+Packets are spread over the workers by sender. All chunks of a message
+therefore go to the same worker, in order, and the engine's per-message
+state never sees two threads at once, while a long decode from one sender
+does not hold up the others.
+
+Each worker has a bounded queue. When it is full the packet is dropped
+instead of blocking the reader thread; a lost chunk is NACKed and repaired
+like one lost on air. Counters show how deep the queues got and how many
+packets were dropped.
+"""
+import queue
+import threading
+
+DEFAULT_WORKERS = 2
+MAX_PENDING = 512  # Packets waiting per worker
+
+
+class ReceivePool:
+    """Run handler(packet) on worker threads, one queue per worker"""
+
+    def __init__(self, handler, workers=DEFAULT_WORKERS, max_pending=MAX_PENDING, log=None):
+        self.handler = handler
+        self.log = log or (lambda message: None)
+        self.queues = [queue.Queue(maxsize=max_pending) for _ in range(workers)]
+        self.lock = threading.Lock()
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0  # Packets refused because their worker's queue was full
+        self.peak = 0  # Deepest any queue has been
+        self.threads = [threading.Thread(target=self._run, args=(packets,), name=f"receive-{index}", daemon=True)
+                        for index, packets in enumerate(self.queues)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, packet, key=None):
+        """Queue a packet for the worker that handles `key`; returns False if it was dropped"""
+        packets = self.queues[hash(key) % len(self.queues)]
+        try:
+            packets.put_nowait(packet)
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+            return False
+        depth = packets.qsize()
+        with self.lock:
+            self.received += 1
+            self.peak = max(self.peak, depth)
+        return True
+
+    def pending(self):
+        """Packets waiting in all queues"""
+        return sum(packets.qsize() for packets in self.queues)
+
+    def stats(self):
+        with self.lock:
+            return {"received": self.received, "processed": self.processed, "dropped": self.dropped,
+                    "pending": self.pending(), "peak": self.peak}
+
+    def join(self):
+        """Wait until every queued packet has been handled"""
+        for packets in self.queues:
+            packets.join()
+
+    def close(self):
+        """Handle what is queued, then stop the workers"""
+        for packets in self.queues:
+            packets.put(None)
+        for thread in self.threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout=5)
+
+    def _run(self, packets):
+        while True:
+            packet = packets.get()
+            if packet is None:
+                packets.task_done()
+                return
+            try:
+                self.handler(packet)
+            except Exception as e:
+                self.log(f"Error in receive worker: {str(e)}")
+            with self.lock:
+                self.processed += 1
+            packets.task_done()
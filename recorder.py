@@ -0,0 +1,73 @@
+"""In-memory recordings
+
+A recording is captured into one preallocated buffer sized for the maximum
+recording length. Each block read from the microphone is copied into place
+once, and the stages after it (stream encoder, final encode, WAV archive)
+all read the same memory through memoryviews instead of joining a list of
+blocks or reading the WAV file back.
+
+The WAV file is only an archive for the message list, so it is written on a
+background thread while the recording can already be encoded and sent.
+"""
+import hashlib
+import threading
+
+import codec
+
+
+class RecordBuffer:
+    """Fixed-size PCM buffer that a recording is written into"""
+
+    def __init__(self, seconds, sample_rate, channels, sample_width):
+        self.params = codec.AudioParams(sample_rate, channels, sample_width)
+        self.frame_bytes = channels * sample_width
+        self.buffer = bytearray(int(seconds * sample_rate) * self.frame_bytes)
+        self.view = memoryview(self.buffer)
+        self.length = 0  # Bytes recorded so far
+        self.hash = None  # (length, digest) of the last digest() call
+
+    def write(self, data):
+        """Copy a block of PCM into the buffer and return a view of it
+
+        Audio beyond the buffer's capacity is dropped.
+        """
+        end = min(self.length + len(data), len(self.buffer))
+        block = self.view[self.length:end]
+        block[:] = memoryview(data)[:end - self.length]
+        self.length = end
+        return block
+
+    def frames(self):
+        """The recorded PCM as a read-only view (no copy)"""
+        return self.view[:self.length].toreadonly()
+
+    def digest(self):
+        """Hash of the recorded audio, cached until more audio is written"""
+        if self.hash is None or self.hash[0] != self.length:
+            self.hash = (self.length, hashlib.blake2b(self.frames(), digest_size=16).digest())
+        return self.hash[1]
+
+    def seconds(self):
+        """Length of the recording in seconds"""
+        return self.length / (self.frame_bytes * self.params.sample_rate)
+
+
+def save_async(recording, path, on_saved=None, on_error=None):
+    """Write a recording to a WAV file on a background thread
+
+    on_saved(path) or on_error(exception) is called from that thread. Returns
+    the thread, which callers may join.
+    """
+    def save():
+        try:
+            codec.write_wav(path, recording.params, recording.frames())
+        except Exception as e:
+            if on_error:
+                on_error(e)
+            return
+        if on_saved:
+            on_saved(path)
+
+    thread = threading.Thread(target=save, daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,127 @@
+"""Receiver-driven selective repeat for chunked voice messages
+
+Receivers watch their partial messages. When one stalls they wait a random
+backoff, then broadcast a NACK bitmap of the chunks they still need. Every
+receiver also listens to the NACKs of others: chunks someone else already
+asked for recently are left out of its own request. If nothing is left, the
+NACK is suppressed entirely, so one repair serves all listeners.
+
+The sender keeps the frames of its recent messages. It merges NACKs that
+arrive close together and resends only chunks it has not repaired recently.
+"""
+import random
+import threading
+import time
+from collections import OrderedDict
+
+
+class RepairRequester:
+    """Receiver side: decide when and what to NACK for stalled messages"""
+
+    def __init__(self, stall_timeout=8.0, max_backoff=3.0, suppress_window=10.0, max_requests=5):
+        self.stall_timeout = stall_timeout
+        self.max_backoff = max_backoff
+        self.suppress_window = suppress_window
+        self.max_requests = max_requests
+        self.state = {}  # message key -> repair state
+        self.suppressed = 0
+        # NACKs are overheard on the receive thread while poll() runs on the timer
+        self.lock = threading.Lock()
+
+    def _state(self, key, message_id):
+        if key not in self.state:
+            self.state[key] = {'message_id': message_id, 'due': None, 'requests': 0, 'overheard': {}}
+        return self.state[key]
+
+    def on_overheard(self, message_id, seqs, now=None):
+        """Record a NACK sent by another receiver for a message we may hold"""
+        now = time.time() if now is None else now
+        with self.lock:
+            for state in self.state.values():
+                if state['message_id'] == message_id:
+                    for seq in seqs:
+                        state['overheard'][seq] = now
+
+    def forget(self, key):
+        """Drop repair state for a completed or abandoned message"""
+        with self.lock:
+            self.state.pop(key, None)
+
+    def poll(self, messages, now=None):
+        """Check partial messages and return (requests, abandoned)
+
+        `messages` yields (key, message_id, last_chunk_time, missing seqs).
+        `requests` is a list of (key, message_id, seqs) to NACK now and
+        `abandoned` lists keys that used up their repair attempts.
+        """
+        now = time.time() if now is None else now
+        requests, abandoned = [], []
+        with self.lock:
+            for key, message_id, last_chunk_time, missing in messages:
+                state = self._state(key, message_id)
+                if now - last_chunk_time < self.stall_timeout:
+                    # Still receiving; a new stall gets a fresh backoff
+                    state['due'] = None
+                    continue
+                if state['due'] is None:
+                    # Randomized backoff gives other receivers the chance to ask first
+                    state['due'] = now + random.uniform(0, self.max_backoff)
+                    continue
+                if now < state['due']:
+                    continue
+
+                if state['requests'] >= self.max_requests:
+                    abandoned.append(key)
+                    continue
+                state['due'] = now + self.stall_timeout + random.uniform(0, self.max_backoff)
+                overheard = state['overheard']
+                wanted = {seq for seq in missing if now - overheard.get(seq, 0) > self.suppress_window}
+                if not wanted:
+                    self.suppressed += 1
+                    continue
+                state['requests'] += 1
+                requests.append((key, message_id, wanted))
+            for key in abandoned:
+                self.state.pop(key, None)
+        return requests, abandoned
+
+
+class RepairResponder:
+    """Sender side: remember sent frames and answer NACKs"""
+
+    def __init__(self, max_messages=8, repair_holdoff=5.0):
+        self.max_messages = max_messages
+        self.repair_holdoff = repair_holdoff
+        self.messages = OrderedDict()  # message id -> {'frames': {seq: bytes}, 'repaired': {seq: time}}
+
+    def remember(self, message_id, frames_by_seq):
+        """Keep the packed frames of an outgoing message for later repair"""
+        self.messages[message_id] = {'frames': dict(frames_by_seq), 'repaired': {}}
+        self.messages.move_to_end(message_id)
+        while len(self.messages) > self.max_messages:
+            self.messages.popitem(last=False)
+
+    def add(self, message_id, seq, frame):
+        """Keep one more frame of an outgoing message (streamed messages grow as they are sent)"""
+        if message_id not in self.messages:
+            self.remember(message_id, {})
+        self.messages[message_id]['frames'][seq] = frame
+
+    def knows(self, message_id):
+        """Check whether a message id is one of ours"""
+        return message_id in self.messages
+
+    def request(self, message_id, seqs, now=None):
+        """Return (seq, frame) pairs to resend for a NACK, skipping recent repairs"""
+        now = time.time() if now is None else now
+        message = self.messages.get(message_id)
+        if message is None:
+            return []
+        resend = []
+        for seq in sorted(seqs):
+            frame = message['frames'].get(seq)
+            if frame is None or now - message['repaired'].get(seq, 0) < self.repair_holdoff:
+                continue
+            message['repaired'][seq] = now
+            resend.append((seq, frame))
+        return resend
@@ -0,0 +1,408 @@
+"""Prioritized transmit scheduler for every outgoing packet
+
+All messages leave the node through one scheduler thread, so several voice
+messages can be queued at once and small control traffic never waits behind
+a long transfer. Each message has a priority:
+- PRIORITY_CONTROL: text and test messages, NACKs
+- PRIORITY_REPAIR: chunks resent for NACKs
+- PRIORITY_VOICE: voice message chunks
+
+The next packet comes from the highest priority message that has one ready.
+Messages of equal priority take turns one chunk at a time. All messages
+share one ACK-clocked window and RTT estimate (see sender.py), since they
+share the radio channel. Each message can be paused, resumed or cancelled on
+its own.
+
+With a `max_payload`, room left in a packet is filled with the next frames
+of other ready messages, highest priority first, and the packet goes out as
+one bundle (see packer.py). A bundle is acked, lost and timed as one packet.
+
+Packets and bytes sent, retries, failed chunks and ack times are recorded
+in a metrics registry (see metrics.py).
+"""
+import queue
+import threading
+import time
+from collections import deque
+from itertools import count
+
+import metrics
+import packer
+import sender
+
+PRIORITY_CONTROL = 0
+PRIORITY_REPAIR = 1
+PRIORITY_VOICE = 2
+
+PRIORITY_NAMES = {PRIORITY_CONTROL: "control", PRIORITY_REPAIR: "repair", PRIORITY_VOICE: "voice"}
+
+POLL_INTERVAL = 0.1  # Seconds between checks for timeouts and streamed chunks while busy
+
+
+class OutboundMessage:
+    """A queued message and its transfer state"""
+
+    def __init__(self, key, items, priority, want_ack, source, on_done, name, on_ack=None):
+        self.key = key  # Unique per scheduler, in submission order
+        self.priority = priority
+        self.want_ack = want_ack
+        self.name = name
+        self.pending = deque((label, frame, 0) for label, frame in items)
+        self.in_flight = 0
+        self.stats = sender.SendStats(len(items))
+        self.source = source
+        self.source_open = source is not None
+        self.on_done = on_done
+        self.on_ack = on_ack
+        self.state = "queued"  # then "sending", "paused", "cancelled" or "done"
+        self.finished = threading.Event()
+
+    def ready(self):
+        return self.state in ("queued", "sending") and bool(self.pending)
+
+    def complete(self):
+        return not self.pending and not self.in_flight and not self.source_open
+
+    def status(self):
+        """Progress snapshot for display"""
+        total = f"{self.stats.total}+" if self.source_open else str(self.stats.total)
+        return {"key": self.key, "name": self.name, "priority": PRIORITY_NAMES[self.priority],
+                "state": self.state, "acked": self.stats.acked, "failed": self.stats.failed,
+                "total": total, "in_flight": self.in_flight}
+
+
+class TransmitScheduler:
+    """Send queued messages through one shared window
+
+    `send_fn(frame, on_response)` transmits one frame. `on_response` is None
+    for messages sent without an ack; otherwise send_fn must arrange for
+    on_response(packet) to be called with the ack/nak, or return False if
+    the transport cannot report responses (the scheduler then paces by
+    `fallback_interval`). progress(message, text) reports per-message
+    progress, with text None once the message is finished.
+    """
+
+    def __init__(self, send_fn, rtt=None, max_window=8, max_attempts=3, fallback_interval=1.0,
+                 log=None, progress=None, max_payload=None, registry=None):
+        self.send_fn = send_fn
+        self.rtt = rtt or sender.RttEstimator()
+        self.window = sender.CongestionWindow(max_window=max_window)
+        self.max_attempts = max_attempts
+        self.fallback_interval = fallback_interval
+        self.log = log or (lambda message: None)
+        self.progress = progress or (lambda message, text: None)
+        self.max_payload = max_payload  # Packet budget for bundling frames; None sends one frame per packet
+        self.condition = threading.Condition()
+        self.messages = {}  # key -> OutboundMessage, in submission order
+        self.in_flight = {}  # token -> ([(message, label, frame, attempts), ...], sent time) per packet
+        self.last_served = {}  # priority -> key of the message that sent last
+        self.keys = count(1)
+        self.tokens = count()
+        self.thread = None
+        self.closed = False
+
+        registry = registry or metrics.Registry()
+        packets = registry.counter("voice_packets_sent_total", "Packets handed to the radio by priority",
+                                   ("priority",))
+        sent_bytes = registry.counter("voice_bytes_sent_total", "Packet bytes handed to the radio by priority",
+                                      ("priority",))
+        self.packets_sent = {priority: packets.labels(name) for priority, name in PRIORITY_NAMES.items()}
+        self.bytes_sent = {priority: sent_bytes.labels(name) for priority, name in PRIORITY_NAMES.items()}
+        self.retransmissions = registry.counter("voice_retransmissions_total",
+                                                "Frames queued again after a timeout, NAK or send error",
+                                                ("reason",))
+        self.chunks_failed = registry.counter("voice_chunks_failed_total",
+                                              "Frames given up on after max_attempts", ("reason",))
+        self.ack_seconds = registry.histogram("voice_ack_seconds",
+                                              "Seconds from sending a packet to its ack, first transmissions only")
+
+    def submit(self, items, priority=PRIORITY_VOICE, want_ack=True, source=None, on_done=None, name=None,
+               on_ack=None):
+        """Queue (label, frame) items as one message and return its OutboundMessage
+
+        `source` is an optional queue.Queue of further items still being
+        produced (a message streamed while recording), ended by None.
+        on_done(message) is called from the scheduler thread when the message
+        is finished or cancelled. on_ack(message, label) is called, with the
+        scheduler locked so it must be quick, for each delivered item.
+        """
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("Transmit scheduler is closed")
+            key = next(self.keys)
+            message = OutboundMessage(key, items, priority, want_ack, source, on_done, name or f"message {key}", on_ack)
+            self.messages[key] = message
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="transmit", daemon=True)
+                self.thread.start()
+            self.condition.notify_all()
+        return message
+
+    def pause(self, message):
+        """Stop sending new chunks of a message (chunks in flight still complete)"""
+        with self.condition:
+            if message.state not in ("queued", "sending"):
+                return False
+            message.state = "paused"
+            self._report(message)
+            return True
+
+    def resume(self, message):
+        with self.condition:
+            if message.state != "paused":
+                return False
+            message.state = "sending"
+            self.condition.notify_all()
+            return True
+
+    def cancel(self, message):
+        """Drop the rest of a message; its on_done still runs"""
+        with self.condition:
+            if message.state in ("cancelled", "done"):
+                return False
+            message.state = "cancelled"
+            message.pending.clear()
+            message.source_open = False
+            for token, (parts, sent_time) in list(self.in_flight.items()):
+                others = [part for part in parts if part[0] is not message]
+                if not others:
+                    del self.in_flight[token]
+                elif len(others) < len(parts):
+                    self.in_flight[token] = (others, sent_time)
+            message.in_flight = 0
+            self.condition.notify_all()
+            return True
+
+    def cancel_all(self, priority=None):
+        """Cancel every queued message (of one priority if given); returns how many"""
+        with self.condition:
+            messages = [message for message in self.messages.values()
+                        if priority is None or message.priority == priority]
+        return sum(self.cancel(message) for message in messages)
+
+    def status(self):
+        """Progress snapshots of the queued messages in submission order"""
+        with self.condition:
+            return [message.status() for message in self.messages.values()]
+
+    def depth(self, priority=None):
+        """Number of unfinished messages (of one priority if given)"""
+        with self.condition:
+            return sum(1 for message in self.messages.values() if priority is None or message.priority == priority)
+
+    def close(self):
+        """Cancel everything and stop the scheduler thread"""
+        self.cancel_all()
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(timeout=5)
+
+    def _run(self):
+        with self.condition:
+            while True:
+                finished = self._collect_finished()
+                if finished:
+                    # Callbacks may call back into the scheduler or take other locks
+                    self.condition.release()
+                    try:
+                        for message in finished:
+                            self._finish(message)
+                    finally:
+                        self.condition.acquire()
+                    continue
+                if self.closed:
+                    return
+
+                self._pull_sources()
+                self._check_timeouts()
+                if self._send_next():
+                    continue
+
+                # Wake on submissions and responses; poll while busy so timeouts and streams stay responsive
+                self.condition.wait(POLL_INTERVAL if self.messages else None)
+
+    def _collect_finished(self):
+        finished = [message for message in self.messages.values()
+                    if message.state == "cancelled" or message.complete()]
+        for message in finished:
+            del self.messages[message.key]
+            if message.state != "cancelled":
+                message.state = "done"
+            message.stats.end_time = time.time()
+        return finished
+
+    def _finish(self, message):
+        self.progress(message, None)
+        try:
+            if message.on_done is not None:
+                message.on_done(message)
+        except Exception as e:
+            self.log(f"Error finishing {message.name}: {str(e)}")
+        finally:
+            message.finished.set()
+
+    def _pull_sources(self):
+        for message in self.messages.values():
+            while message.source_open:
+                try:
+                    item = message.source.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    message.source_open = False
+                else:
+                    message.pending.append((item[0], item[1], 0))
+                    message.stats.total += 1
+
+    def _check_timeouts(self):
+        """Retransmit chunks whose ack is overdue"""
+        now = time.time()
+        for token, (parts, sent_time) in list(self.in_flight.items()):
+            if now - sent_time > self.rtt.rto:
+                del self.in_flight[token]
+                self.window.on_loss()
+                self.rtt.backoff()
+                for message, label, frame, attempts in parts:
+                    message.in_flight -= 1
+                    self._retry(message, label, frame, attempts, "timeout")
+
+    def _next_message(self):
+        """The message to send from: highest priority first, round robin within it"""
+        window_open = len(self.in_flight) < self.window.allowed()
+        ready = [message for message in self.messages.values()
+                 if message.ready() and (window_open or not message.want_ack)]
+        if not ready:
+            return None
+        priority = min(message.priority for message in ready)
+        ready = [message for message in ready if message.priority == priority]
+        last = self.last_served.get(priority, 0)
+        return next((message for message in ready if message.key > last), ready[0])
+
+    def _send_next(self):
+        """Send one packet if the window allows; returns True if something was sent"""
+        message = self._next_message()
+        if message is None:
+            return False
+        self.last_served[message.priority] = message.key
+        parts = [self._take(message)]
+        bundle = None
+        if self.max_payload:
+            bundle = packer.PacketPacker(self.max_payload, parts[0][2])
+            parts += self._fill(bundle)
+        acked_parts = [(part[0], part[1], part[2], part[3] + 1) for part in parts if part[0].want_ack]
+        on_response = None
+        token = next(self.tokens)
+        if acked_parts:
+            self.in_flight[token] = (acked_parts, time.time())
+            for part in acked_parts:
+                part[0].in_flight += 1
+            on_response = self._make_callback(token)
+        for other in {part[0].key: part[0] for part in parts}.values():
+            self._report(other)
+
+        packet = bundle.packet() if bundle else parts[0][2]
+        try:
+            self.condition.release()
+            try:
+                has_feedback = self.send_fn(packet, on_response)
+            finally:
+                self.condition.acquire()
+        except Exception as e:
+            label = parts[0][1] if len(parts) == 1 else f"bundle of {len(parts)} frames"
+            self.log(f"Error sending chunk {label} of {message.name}: {str(e)}")
+            if self.in_flight.pop(token, None) is not None:
+                for part in acked_parts:
+                    part[0].in_flight -= 1
+            for part_message, label, frame, attempts in parts:
+                if part_message.state != "cancelled":
+                    self._retry(part_message, label, frame, attempts + 1, "error")
+            self.condition.wait(self.fallback_interval)
+            return True
+        self.packets_sent[message.priority].inc()
+        self.bytes_sent[message.priority].inc(len(packet))
+
+        for part_message, label, frame, attempts in parts:
+            if not part_message.want_ack:
+                # Sent without an ack: done as soon as it is on air
+                self._delivered(part_message, label, frame)
+        if on_response is not None and has_feedback is False and self.in_flight.pop(token, None) is not None:
+            # No ack reporting available: count as delivered and pace by time
+            for part_message, label, frame, attempts in acked_parts:
+                part_message.in_flight -= 1
+                self._delivered(part_message, label, frame)
+            self.condition.wait(self.fallback_interval)
+        return True
+
+    def _take(self, message):
+        """Pop the next frame of a message as a (message, label, frame, attempts) part"""
+        message.state = "sending"
+        label, frame, attempts = message.pending.popleft()
+        message.stats.sent += 1
+        return message, label, frame, attempts
+
+    def _fill(self, bundle):
+        """Take queued frames that fit in the room a packet has left, highest priority first"""
+        parts = []
+        for message in sorted(self.messages.values(), key=lambda message: (message.priority, message.key)):
+            while message.ready() and bundle.fits(message.pending[0][1]):
+                bundle.add(message.pending[0][1])
+                parts.append(self._take(message))
+        return parts
+
+    def _make_callback(self, token):
+        def on_response(packet):
+            with self.condition:
+                entry = self.in_flight.pop(token, None)
+                if entry is None:
+                    return  # Timed out or cancelled
+                parts, sent_time = entry
+                acked = sender.response_is_ack(packet)
+                if acked:
+                    if all(part[3] == 1 for part in parts):
+                        # Karn's algorithm: only time unambiguous transmissions
+                        elapsed = time.time() - sent_time
+                        self.rtt.sample(elapsed)
+                        self.ack_seconds.observe(elapsed)
+                    self.window.on_ack()
+                else:
+                    self.window.on_loss()
+                for message, label, frame, attempts in parts:
+                    message.in_flight -= 1
+                    if acked:
+                        self._delivered(message, label, frame)
+                    else:
+                        self._retry(message, label, frame, attempts, "nak")
+                for message in {part[0].key: part[0] for part in parts}.values():
+                    self._report(message)
+                self.condition.notify_all()
+        return on_response
+
+    def _delivered(self, message, label, frame):
+        message.stats.acked += 1
+        message.stats.payload_bytes += len(frame)
+        if message.on_ack is not None:
+            try:
+                message.on_ack(message, label)
+            except Exception as e:
+                self.log(f"Error recording ack of chunk {label} of {message.name}: {str(e)}")
+
+    def _retry(self, message, label, frame, attempts, reason):
+        if attempts < self.max_attempts:
+            message.stats.retransmissions += 1
+            self.retransmissions.labels(reason).inc()
+            message.pending.appendleft((label, frame, attempts))
+            self.log(f"Chunk {label} of {message.name} {reason}, retrying (attempt {attempts + 1}/{self.max_attempts})")
+        else:
+            message.stats.failed += 1
+            self.chunks_failed.labels(reason).inc()
+            self.log(f"Failed to send chunk {label} of {message.name} after {attempts} attempts ({reason})")
+
+    def _report(self, message):
+        status = message.status()
+        state = " (paused)" if message.state == "paused" else ""
+        queued = len(self.messages) - 1
+        waiting = f", {queued} more queued" if queued else ""
+        self.progress(message, f"Sending {message.name}: {status['acked']}/{status['total']} chunks acked"
+                               f"{state} (window {self.window.size:.1f}{waiting})")
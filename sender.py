@@ -0,0 +1,92 @@
+"""ACK-clocked sliding window sending
+
+Instead of sleeping a fixed time between chunks, the transmit scheduler
+(scheduler.py) keeps up to `window` chunks in flight and lets Meshtastic
+ack/nak responses clock new ones out. The window grows additively on acks
+and halves on loss (AIMD), and an RTT estimate (Jacobson/Karels) sets the
+retransmission timeout.
+"""
+import time
+
+
+def response_is_ack(packet):
+    """Check whether an onResponse packet is a positive routing ack"""
+    routing = packet.get('decoded', {}).get('routing', {})
+    return routing.get('errorReason', 'NONE') == 'NONE'
+
+
+class RttEstimator:
+    """Smoothed round-trip time and retransmission timeout"""
+
+    def __init__(self, initial_rto=10.0, min_rto=2.0, max_rto=60.0):
+        self.srtt = None
+        self.rttvar = None
+        self.rto = initial_rto
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+
+    def sample(self, rtt):
+        """Update the estimate with a measured round trip (seconds)"""
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = min(self.max_rto, max(self.min_rto, self.srtt + 4 * self.rttvar))
+
+    def backoff(self):
+        """Double the timeout after a retransmission timeout"""
+        self.rto = min(self.max_rto, self.rto * 2)
+
+
+class CongestionWindow:
+    """AIMD congestion window measured in chunks"""
+
+    def __init__(self, initial=1.0, max_window=8, ssthresh=4.0):
+        self.size = initial
+        self.max_window = max_window
+        self.ssthresh = ssthresh
+
+    def on_ack(self):
+        if self.size < self.ssthresh:
+            self.size += 1  # Slow start
+        else:
+            self.size += 1 / self.size  # Congestion avoidance
+        self.size = min(self.size, self.max_window)
+
+    def on_loss(self):
+        self.ssthresh = max(self.size / 2, 1.0)
+        self.size = max(self.size / 2, 1.0)
+
+    def allowed(self):
+        """Number of chunks that may be in flight"""
+        return max(1, int(self.size))
+
+
+class SendStats:
+    """Per-message transfer statistics"""
+
+    def __init__(self, total):
+        self.total = total
+        self.sent = 0
+        self.acked = 0
+        self.failed = 0
+        self.retransmissions = 0
+        self.payload_bytes = 0
+        self.start_time = time.time()
+        self.end_time = None
+
+    @property
+    def elapsed(self):
+        return (self.end_time or time.time()) - self.start_time
+
+    @property
+    def goodput(self):
+        """Acknowledged bytes per second"""
+        return self.payload_bytes / self.elapsed if self.elapsed > 0 else 0.0
+
+    def summary(self):
+        return (f"{self.acked}/{self.total} chunks acked, {self.failed} failed, "
+                f"{self.retransmissions} retransmissions, {self.sent} packets sent, "
+                f"goodput {self.goodput:.0f} B/s over {self.elapsed:.1f}s")
@@ -0,0 +1,253 @@
+"""In-process simulated mesh for testing and benchmarks
+
+SimMesh stands in for a LoRa mesh of several nodes. Each node gets a
+SimInterface with the parts of the meshtastic interface API this app uses:
+`sendData` (with wantAck and onResponse), `getLongName`, `myInfo` and
+`close`. Received packets have the shape of real meshtastic packet dicts and
+go to the node's `on_receive` callback, or are published on
+"meshtastic.receive" via pubsub like a real interface does.
+
+Every broadcast travels `hops` hops. Each hop adds `latency` plus uniform
+`jitter` seconds and drops the packet with probability `loss`, separately
+for every receiver. A delivered packet is duplicated with probability
+`duplicate` (a second copy relayed by another node). With `bitrate` set,
+packets also queue for a shared channel and occupy it for their airtime.
+
+A wantAck broadcast is acked like meshtastic's implicit ack: the sender
+hears a rebroadcast (or the delivery) one latency after the first receiver
+got it, and gets a MAX_RETRANSMIT NAK if nobody did.
+"""
+import heapq
+import itertools
+import random
+import threading
+import time
+
+import wire
+
+MAX_PAYLOAD = 233  # meshtastic.mesh_pb2.Constants.DATA_PAYLOAD_LEN
+PACKET_OVERHEAD = 32  # LoRa preamble/header plus the encrypted packet header, in bytes
+LONG_FAST_BITRATE = 1072  # Bits per second of the default LongFast preset
+
+PORT_NAME = "Simulator"  # Shown in the app's port list
+
+PORT_NAMES = {1: 'TEXT_MESSAGE_APP', wire.PORT_NUM: 'PRIVATE_APP'}
+
+
+class SimStats:
+    """Traffic counters for a SimMesh"""
+
+    def __init__(self):
+        self.packets = 0  # Packets sent by nodes
+        self.payload_bytes = 0
+        self.airtime_bytes = 0  # Bytes on air, counting every hop and the per-packet overhead
+        self.delivered = 0  # Packet copies handed to receivers
+        self.lost = 0  # Packet copies dropped before reaching a receiver
+        self.duplicated = 0
+
+    def airtime(self, bitrate=LONG_FAST_BITRATE):
+        """Seconds of channel time the traffic would take at `bitrate`"""
+        return self.airtime_bytes * 8 / bitrate
+
+    def summary(self):
+        return (f"{self.packets} packets, {self.payload_bytes} payload bytes, {self.airtime_bytes} airtime bytes, "
+                f"{self.delivered} delivered, {self.lost} lost, {self.duplicated} duplicated")
+
+
+class SimMesh:
+    """A simulated broadcast mesh connecting SimInterface nodes"""
+
+    def __init__(self, loss=0.0, latency=0.05, jitter=0.0, max_payload=MAX_PAYLOAD, duplicate=0.0, hops=1,
+                 bitrate=None, seed=None):
+        self.loss = loss
+        self.latency = latency
+        self.jitter = jitter
+        self.max_payload = max_payload
+        self.duplicate = duplicate
+        self.hops = hops
+        self.bitrate = bitrate  # Bits per second of the shared channel; None for no queuing
+        self.random = random.Random(seed)
+        self.nodes = []
+        self.stats = SimStats()
+        self.packet_ids = itertools.count(1)
+        self.channel_free = 0.0  # When the shared channel is idle again
+        self.events = []  # Heap of (due time, counter, fn, args)
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def add_node(self, node_num=None, long_name=None, on_receive=None, loopback=False):
+        """Create a node and return its interface
+
+        Without `on_receive`, packets are published on "meshtastic.receive",
+        which every subscriber sees, so use that for one node per process.
+        With `loopback`, a node also receives its own packets, so a single
+        node can talk to itself.
+        """
+        if node_num is None:
+            node_num = 0x10000000 + len(self.nodes) + 1
+        interface = SimInterface(self, node_num, long_name, on_receive, loopback)
+        with self.condition:
+            self.nodes.append(interface)
+        return interface
+
+    def close(self):
+        """Stop delivering packets"""
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+    def schedule(self, delay, fn, *args):
+        with self.condition:
+            heapq.heappush(self.events, (time.monotonic() + delay, next(self.counter), fn, args))
+            self.condition.notify()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.running and (not self.events or self.events[0][0] > time.monotonic()):
+                    timeout = self.events[0][0] - time.monotonic() if self.events else None
+                    self.condition.wait(timeout)
+                if not self.running:
+                    return
+                _, _, fn, args = heapq.heappop(self.events)
+            # Callbacks run outside the lock so they can send packets themselves
+            try:
+                fn(*args)
+            except Exception:
+                pass  # A failing receiver must not stop the mesh
+
+    def _hop_delay(self):
+        return self.latency + self.random.uniform(0, self.jitter)
+
+    def transmit(self, source, payload, port_num, want_ack, on_response):
+        """Broadcast a packet from `source` and return its packet id"""
+        if len(payload) > self.max_payload:
+            raise ValueError(f"Payload of {len(payload)} bytes exceeds the {self.max_payload}-byte maximum")
+
+        packet_id = next(self.packet_ids)
+        with self.condition:
+            stats = self.stats
+            stats.packets += 1
+            stats.payload_bytes += len(payload)
+            stats.airtime_bytes += (len(payload) + PACKET_OVERHEAD) * self.hops
+            receivers = [node for node in self.nodes if node.open and (node is not source or node.loopback)]
+
+            # Wait for the channel, then hold it for this packet's airtime at every hop
+            start = 0.0
+            if self.bitrate:
+                now = time.monotonic()
+                airtime = (len(payload) + PACKET_OVERHEAD) * 8 / self.bitrate
+                start = max(now, self.channel_free) - now
+                self.channel_free = now + start + airtime * self.hops
+                start += airtime
+
+            first = None
+            for node in receivers:
+                delay = start
+                for _ in range(self.hops):
+                    if self.random.random() < self.loss:
+                        delay = None
+                        break
+                    delay += self._hop_delay()
+                if delay is None:
+                    stats.lost += 1
+                    continue
+                copies = [delay]
+                if self.random.random() < self.duplicate:
+                    stats.duplicated += 1
+                    copies.append(delay + self._hop_delay())
+                for copy_delay in copies:
+                    stats.delivered += 1
+                    heapq.heappush(self.events, (time.monotonic() + copy_delay, next(self.counter),
+                                                 node.deliver, (source, packet_id, payload, port_num)))
+                first = delay if first is None else min(first, delay)
+            self.condition.notify()
+
+        if want_ack and on_response is not None:
+            if first is not None:
+                # The sender overhears the first rebroadcast
+                self.schedule(first + self._hop_delay(), on_response, _routing_packet(source, packet_id, 'NONE'))
+            else:
+                self.schedule(start + 2 * self.hops * self.latency, on_response,
+                              _routing_packet(source, packet_id, 'MAX_RETRANSMIT'))
+        return packet_id
+
+
+def _routing_packet(source, packet_id, error_reason):
+    return {
+        'from': source.node_num,
+        'fromId': source.node_id,
+        'decoded': {
+            'portnum': 'ROUTING_APP',
+            'requestId': packet_id,
+            'routing': {'errorReason': error_reason}
+        }
+    }
+
+
+class MyInfo:
+    def __init__(self, node_num):
+        self.my_node_num = node_num
+
+
+class SimInterface:
+    """One node on a SimMesh, usable in place of a meshtastic interface"""
+
+    def __init__(self, mesh, node_num, long_name, on_receive, loopback):
+        self.mesh = mesh
+        self.node_num = node_num
+        self.node_id = f"!{node_num:08x}"
+        self.long_name = long_name or f"Sim {node_num & 0xFFFF:04x}"
+        self.on_receive = on_receive
+        self.loopback = loopback
+        self.myInfo = MyInfo(node_num)
+        self.open = True
+
+    @property
+    def max_payload(self):
+        """Largest data payload the mesh accepts (see packer.max_payload)"""
+        return self.mesh.max_payload
+
+    def getLongName(self):
+        return self.long_name
+
+    def getShortName(self):
+        return self.long_name[:4]
+
+    def sendData(self, data, destinationId=wire.BROADCAST_ADDR, portNum=wire.PORT_NUM, wantAck=False,
+                 wantResponse=False, onResponse=None, onResponseAckPermitted=False, channelIndex=0):
+        """Broadcast `data` and return a packet dict like meshtastic does"""
+        if not self.open:
+            raise ConnectionError("Interface is closed")
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        packet_id = self.mesh.transmit(self, bytes(data), portNum, wantAck, onResponse)
+        return {'id': packet_id, 'from': self.node_num, 'to': destinationId}
+
+    def deliver(self, source, packet_id, payload, port_num):
+        if not self.open:
+            return
+        decoded = {'portnum': PORT_NAMES.get(port_num, port_num), 'payload': payload}
+        if port_num == 1:
+            decoded['text'] = payload.decode('utf-8', 'replace')
+        packet = {
+            'id': packet_id,
+            'from': source.node_num,
+            'fromId': source.node_id,
+            'to': 0xFFFFFFFF,
+            'toId': wire.BROADCAST_ADDR,
+            'hopStart': self.mesh.hops,
+            'hopLimit': 0,
+            'decoded': decoded
+        }
+        if self.on_receive is not None:
+            self.on_receive(packet, self)
+        else:
+            from pubsub import pub
+            pub.sendMessage("meshtastic.receive", packet=packet, interface=self)
+
+    def close(self):
+        self.open = False
@@ -0,0 +1,214 @@
+"""Durable outbox and inbox for transfers that survive restarts and reconnects
+
+Transfer state otherwise lives only in memory, so a restart or a dropped
+serial link loses every partial message. The store keeps it in SQLite:
+- outbox: the frames of each of our voice messages and which were acked
+- inbox: the frames received so far of each partial message (the set of
+  stored seqs is the received bitmap)
+
+Frames are stored packed, exactly as sent or received, so restoring an
+outgoing message means queueing its unacked frames again and restoring an
+incoming one means replaying its frames through the normal receive path.
+
+Writes are queued and applied by one writer thread, which commits whatever
+arrived within `flush_interval` in a single transaction. Callers (the
+receive and transmit threads) never wait for the disk; a crash loses at
+most the last interval of progress, which is simply sent or NACKed again.
+"""
+import queue
+import sqlite3
+import threading
+import time
+
+FLUSH_INTERVAL = 0.5  # Seconds the writer waits to batch more writes into one transaction
+BATCH_SIZE = 512  # Most writes per transaction
+MAX_AGE = 24 * 60 * 60  # Seconds after which stored transfers are no longer resumed
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    message_id INTEGER PRIMARY KEY,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS outbox_frames (
+    message_id INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    frame BLOB NOT NULL,
+    acked INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (message_id, seq)
+);
+CREATE TABLE IF NOT EXISTS inbox (
+    sender NOT NULL,
+    message_id INTEGER NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (sender, message_id)
+);
+CREATE TABLE IF NOT EXISTS inbox_frames (
+    sender NOT NULL,
+    message_id INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    frame BLOB NOT NULL,
+    PRIMARY KEY (sender, message_id, seq)
+);
+"""
+
+
+class StoredMessage:
+    """An outgoing message loaded from the outbox"""
+
+    def __init__(self, message_id, created):
+        self.message_id = message_id
+        self.created = created
+        self.frames = {}  # seq -> packed frame
+        self.acked = set()
+
+    def unacked(self):
+        """(seq, frame) pairs still to be sent, in seq order"""
+        return [(seq, self.frames[seq]) for seq in sorted(self.frames) if seq not in self.acked]
+
+
+class TransferStore:
+    """SQLite outbox and inbox with batched writes on a background thread"""
+
+    def __init__(self, path, flush_interval=FLUSH_INTERVAL, batch_size=BATCH_SIZE, max_age=MAX_AGE, log=None):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_age = max_age
+        self.log = log or (lambda message: None)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")  # Durable at each WAL checkpoint
+        self.connection.executescript(SCHEMA)
+        self.lock = threading.Lock()  # Serializes use of the connection
+        self.writes = queue.Queue()  # (sql, parameters), a threading.Event to flush, or None to stop
+        self.batches = 0  # Transactions committed
+        self.written = 0  # Statements written
+        self.thread = threading.Thread(target=self._run, name="transfer-store", daemon=True)
+        self.thread.start()
+
+    # Outbox
+
+    def save_outbound(self, message_id, frames_by_seq, now=None):
+        """Store a new outgoing message and its frames"""
+        now = time.time() if now is None else now
+        self.writes.put(("INSERT OR REPLACE INTO outbox VALUES (?, ?)", (message_id, now)))
+        for seq, frame in frames_by_seq.items():
+            self.add_outbound_frame(message_id, seq, frame)
+
+    def add_outbound_frame(self, message_id, seq, frame):
+        """Store one more frame of an outgoing message (streamed messages grow as they are sent)"""
+        self.writes.put(("INSERT OR REPLACE INTO outbox_frames VALUES (?, ?, ?, 0)", (message_id, seq, bytes(frame))))
+
+    def mark_acked(self, message_id, seq):
+        self.writes.put(("UPDATE outbox_frames SET acked = 1 WHERE message_id = ? AND seq = ?", (message_id, seq)))
+
+    def remove_outbound(self, message_id):
+        """Forget a message that was fully sent or cancelled"""
+        self.writes.put(("DELETE FROM outbox_frames WHERE message_id = ?", (message_id,)))
+        self.writes.put(("DELETE FROM outbox WHERE message_id = ?", (message_id,)))
+
+    def load_outbound(self, now=None):
+        """Stored outgoing messages, oldest first, dropping those older than max_age"""
+        now = time.time() if now is None else now
+        self.flush()
+        self._expire(now)
+        messages = {}
+        with self.lock:
+            for message_id, created in self.connection.execute("SELECT message_id, created FROM outbox ORDER BY created"):
+                messages[message_id] = StoredMessage(message_id, created)
+            for message_id, seq, frame, acked in self.connection.execute(
+                    "SELECT message_id, seq, frame, acked FROM outbox_frames"):
+                message = messages.get(message_id)
+                if message is not None:
+                    message.frames[seq] = frame
+                    if acked:
+                        message.acked.add(seq)
+        return list(messages.values())
+
+    # Inbox
+
+    def add_inbound(self, key, seq, frame, now=None):
+        """Store a received frame of the partial message key = (sender, message id)"""
+        now = time.time() if now is None else now
+        sender, message_id = key
+        self.writes.put(("INSERT OR REPLACE INTO inbox VALUES (?, ?, ?)", (sender, message_id, now)))
+        self.writes.put(("INSERT OR IGNORE INTO inbox_frames VALUES (?, ?, ?, ?)",
+                         (sender, message_id, seq, bytes(frame))))
+
+    def remove_inbound(self, key):
+        """Forget a partial message that was rebuilt, evicted or abandoned"""
+        self.writes.put(("DELETE FROM inbox_frames WHERE sender = ? AND message_id = ?", key))
+        self.writes.put(("DELETE FROM inbox WHERE sender = ? AND message_id = ?", key))
+
+    def load_inbound(self, now=None):
+        """Stored partial messages as (key, [frame, ...] in seq order), least recently updated first"""
+        now = time.time() if now is None else now
+        self.flush()
+        self._expire(now)
+        messages = {}
+        with self.lock:
+            for sender, message_id in self.connection.execute("SELECT sender, message_id FROM inbox ORDER BY updated"):
+                messages[(sender, message_id)] = []
+            for sender, message_id, frame in self.connection.execute(
+                    "SELECT sender, message_id, frame FROM inbox_frames ORDER BY sender, message_id, seq"):
+                frames = messages.get((sender, message_id))
+                if frames is not None:
+                    frames.append(frame)
+        return list(messages.items())
+
+    # Writing
+
+    def flush(self):
+        """Wait until every write queued so far is committed"""
+        done = threading.Event()
+        self.writes.put(done)
+        done.wait()
+
+    def close(self):
+        """Commit queued writes and close the database"""
+        if self.thread.is_alive():
+            self.writes.put(None)
+            self.thread.join()
+        self.connection.close()
+
+    def _expire(self, now):
+        cutoff = now - self.max_age
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM outbox_frames WHERE message_id IN "
+                                    "(SELECT message_id FROM outbox WHERE created < ?)", (cutoff,))
+            self.connection.execute("DELETE FROM outbox WHERE created < ?", (cutoff,))
+            self.connection.execute("DELETE FROM inbox_frames WHERE (sender, message_id) IN "
+                                    "(SELECT sender, message_id FROM inbox WHERE updated < ?)", (cutoff,))
+            self.connection.execute("DELETE FROM inbox WHERE updated < ?", (cutoff,))
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = [self.writes.get()]
+            deadline = time.monotonic() + self.flush_interval
+            # Gather more writes until the interval ends, unless someone is waiting for them
+            while len(batch) < self.batch_size and isinstance(batch[-1], tuple):
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.writes.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            statements = [item for item in batch if isinstance(item, tuple)]
+            if statements:
+                try:
+                    with self.lock, self.connection:
+                        for sql, parameters in statements:
+                            self.connection.execute(sql, parameters)
+                    self.batches += 1
+                    self.written += len(statements)
+                except sqlite3.Error as e:
+                    # Losing a batch only costs a resend or a NACK after a restart
+                    self.log(f"Error writing transfer store: {str(e)}")
+            for item in batch:
+                if item is None:
+                    stopping = True
+                elif isinstance(item, threading.Event):
+                    item.set()
@@ -0,0 +1,49 @@
+"""Thread-safe channel for UI updates
+
+Worker threads (meshtastic receive, recording, sending) must not touch Tk
+widgets directly. They post log lines, progress text and callables here, and
+the Tk main loop drains everything in one batch with `after`.
+
+Pending log lines are kept in a bounded deque that drops the oldest lines
+when full. Progress updates are coalesced per key, so only the latest text
+for each transfer reaches the widgets.
+"""
+import threading
+from collections import deque
+
+
+class UIUpdateQueue:
+    """Collect UI updates from any thread for batched application on the main loop"""
+
+    def __init__(self, max_pending_logs=1000):
+        self.lock = threading.Lock()
+        self.logs = deque(maxlen=max_pending_logs)
+        self.progress = {}
+        self.calls = deque()
+        self.dropped_logs = 0
+
+    def log(self, line):
+        """Queue a log line"""
+        with self.lock:
+            if len(self.logs) == self.logs.maxlen:
+                self.dropped_logs += 1
+            self.logs.append(line)
+
+    def set_progress(self, key, text):
+        """Replace the progress text for a key; None clears it"""
+        with self.lock:
+            self.progress[key] = text
+
+    def call(self, fn, *args):
+        """Run fn(*args) on the main loop"""
+        with self.lock:
+            self.calls.append((fn, args))
+
+    def drain(self):
+        """Take everything queued so far: (log lines, dropped count, progress, calls)"""
+        with self.lock:
+            logs, self.logs = list(self.logs), deque(maxlen=self.logs.maxlen)
+            dropped, self.dropped_logs = self.dropped_logs, 0
+            progress, self.progress = self.progress, {}
+            calls, self.calls = list(self.calls), deque()
+        return logs, dropped, progress, calls
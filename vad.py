@@ -0,0 +1,89 @@
+"""Energy and zero-crossing voice activity detection
+
+The signal is cut into short frames. A frame is speech when its energy is
+well above the recording's noise floor. A quieter frame still counts as
+speech when its zero-crossing rate is high, which catches unvoiced sounds
+like "s" and "f". Speech decisions are extended by a short hangover so word
+endings are not clipped. Everything is computed on whole arrays of frames.
+
+speech_spans turns the decisions into the sample ranges worth sending.
+Silence before the first and after the last span is trimmed, and pauses
+shorter than `min_pause` stay inside a span. The encoder replaces each
+remaining gap with a silence marker.
+"""
+from lazyimport import lazy_import
+
+np = lazy_import("numpy")  # Imported on first use, keeping numpy out of startup
+
+FRAME_SECONDS = 0.02
+FLOOR_PERCENTILE = 10  # Frame energy percentile taken as the noise floor
+PEAK_PERCENTILE = 95  # ... and as the speech level
+MIN_LEVEL_DB = -60.0  # Frames quieter than this (dB full scale) are always silence
+MARGIN_DB = 12.0  # Speech is at least this far above the noise floor
+DYNAMIC_RANGE_DB = 30.0  # Frames within this of the speech level are always speech
+UNVOICED_MARGIN_DB = 6.0  # Quieter frames with a high zero-crossing rate still count
+UNVOICED_ZCR = 0.25  # Zero crossings per sample
+HANGOVER_SECONDS = 0.15
+MIN_PAUSE_SECONDS = 0.4  # Shorter pauses are sent as they are
+KEEP_SECONDS = 0.1  # Silence kept before and after each span
+
+
+def frame_features(samples, frame_length):
+    """Per-frame energy (dB full scale) and zero-crossing rate of int16-scale samples"""
+    count = len(samples) // frame_length
+    frames = np.asarray(samples[:count * frame_length], dtype=np.float32).reshape(count, frame_length) / 32768
+    energy = np.mean(frames * frames, axis=1)
+    energy_db = 10 * np.log10(np.maximum(energy, 1e-10))
+    signs = np.signbit(frames)
+    zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / frame_length
+    return energy_db, zcr
+
+
+def detect(samples, frame_length, hangover=0):
+    """Boolean speech decision for each whole frame"""
+    energy_db, zcr = frame_features(samples, frame_length)
+    if not len(energy_db):
+        return np.zeros(0, dtype=bool)
+    floor = np.percentile(energy_db, FLOOR_PERCENTILE)
+    peak = np.percentile(energy_db, PEAK_PERCENTILE)
+    threshold = max(MIN_LEVEL_DB, min(floor + MARGIN_DB, peak - DYNAMIC_RANGE_DB))
+    speech = energy_db > threshold
+    speech |= (energy_db > max(MIN_LEVEL_DB, threshold - MARGIN_DB + UNVOICED_MARGIN_DB)) & (zcr > UNVOICED_ZCR)
+    if hangover:
+        # Each speech frame also marks the `hangover` frames after it
+        speech = np.convolve(speech, np.ones(hangover + 1), mode='full')[:len(speech)] > 0
+    return speech
+
+
+def speech_spans(samples, sample_rate, frame_length=None, min_pause=MIN_PAUSE_SECONDS, keep=KEEP_SECONDS):
+    """Sample ranges [(start, stop), ...] to send, in order
+
+    Returns [(0, len(samples))] when nothing can be removed, including when
+    no speech is found at all (quiet speech beats an empty message).
+    """
+    total = len(samples)
+    frame_length = frame_length or max(1, int(sample_rate * FRAME_SECONDS))
+    frame_seconds = frame_length / sample_rate
+    speech = detect(samples, frame_length, int(round(HANGOVER_SECONDS / frame_seconds)))
+    if not speech.any():
+        return [(0, total)]
+
+    # Runs of speech frames, widened by `keep` frames of silence on each side
+    edges = np.diff(np.concatenate(([0], speech.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    stops = np.flatnonzero(edges == -1)
+    pad = int(round(keep / frame_seconds))
+    starts = np.maximum(starts - pad, 0)
+    stops = np.minimum(stops + pad, len(speech))
+
+    # Merge runs separated by less than the minimum pause
+    gap = int(round(min_pause / frame_seconds))
+    merged = np.concatenate(([True], starts[1:] - stops[:-1] >= gap))
+    starts = starts[merged]
+    stops = np.concatenate((stops[np.flatnonzero(merged[1:])], stops[-1:]))
+
+    spans = [(int(start) * frame_length, int(stop) * frame_length) for start, stop in zip(starts, stops)]
+    if spans[-1][1] == len(speech) * frame_length:
+        # Keep the partial frame at the end
+        spans[-1] = (spans[-1][0], total)
+    return spans
@@ -0,0 +1,214 @@
+"""Binary framing for voice message chunks on PRIVATE_APP
+
+Every packet starts with a fixed 13-byte header followed by raw payload bytes:
+
+    magic | version | flags | message id (4) | seq (2) | total (2) | CRC-16 (2)
+
+The low nibble of `flags` is the frame type, the high nibble holds flag bits.
+`seq` is zero-based. The CRC is CRC-16/CCITT over the header (with the CRC
+field zeroed) and the payload. Legacy JSON packets always start with "{", so
+the magic byte tells the two formats apart.
+
+A NACK frame reuses the header of the message it repairs: `seq` is the first
+missing sequence number and the payload is a bitmap where bit i (LSB first)
+marks `seq + i` as missing.
+
+Messages sent while recording don't know their length up front: their data
+frames carry `total` 0, and an END frame with `seq` and `total` set to the
+chunk count follows the last one. END takes the sequence number after the
+last chunk, so a receiver that misses it can NACK that seq like any other.
+
+A BUNDLE frame carries several small packets in one (see packer.py): its
+payload is each packet prefixed with a length byte, and `seq` and `total`
+are the number of packets. Receivers that predate bundles ignore them as an
+unknown frame type.
+"""
+import binascii
+import random
+import struct
+from collections import namedtuple
+
+PORT_NUM = 256  # PRIVATE_APP
+BROADCAST_ADDR = "^all"  # meshtastic.BROADCAST_ADDR
+
+MAGIC = 0xA5
+VERSION = 1
+
+FRAME_HEADER = struct.Struct('!BBBIHHH')
+HEADER_SIZE = FRAME_HEADER.size
+IDENTITY = struct.Struct('!IH')  # message id and seq, at IDENTITY_OFFSET in the header
+IDENTITY_OFFSET = 3
+
+# Frame types (low nibble of flags)
+TYPE_DATA = 0x0
+TYPE_NACK = 0x1  # receiver asks for missing chunks; seq is the bitmap base
+TYPE_END = 0x2   # end of a streamed message; seq and total are the chunk count
+TYPE_BUNDLE = 0x3  # several packets in one; seq and total are the packet count
+TYPE_MASK = 0x0F
+
+# Flag bits (high nibble of flags)
+FLAG_FEC = 0x10     # payload starts with an FEC extension (see fec.py)
+FLAG_PARITY = 0x20  # FEC parity shard rather than a data shard
+
+TOTAL_UNKNOWN = 0  # `total` of data frames in a streamed message
+BUNDLE_ITEM_OVERHEAD = 1  # Length byte before each packet in a bundle
+MAX_BUNDLE_ITEM = 255
+
+Frame = namedtuple('Frame', 'flags message_id seq total payload')
+
+
+class FrameError(ValueError):
+    """Raised when a packet is not a valid binary frame"""
+
+
+def is_binary_frame(data):
+    """Check whether a packet payload uses the binary framing"""
+    return len(data) >= HEADER_SIZE and data[0] == MAGIC
+
+
+def frame_type(frame):
+    """Return the frame type of an unpacked frame"""
+    return frame.flags & TYPE_MASK
+
+
+def chunk_identity(data):
+    """(message id, seq) of a DATA or END frame read from its header alone, otherwise None
+
+    The CRC is not checked; this is only for spotting duplicates cheaply.
+    """
+    if not is_binary_frame(data) or data[2] & TYPE_MASK not in (TYPE_DATA, TYPE_END):
+        return None
+    return IDENTITY.unpack_from(data, IDENTITY_OFFSET)
+
+
+def new_message_id():
+    """Generate a random 32-bit message id"""
+    return random.getrandbits(32)
+
+
+def _crc(header, payload):
+    return binascii.crc_hqx(payload, binascii.crc_hqx(header, 0xFFFF))
+
+
+def pack_frame(message_id, seq, total, payload, flags=TYPE_DATA):
+    """Pack a frame header and payload into packet bytes"""
+    header = FRAME_HEADER.pack(MAGIC, VERSION, flags, message_id, seq, total, 0)
+    crc = _crc(header, payload)
+    return header[:-2] + struct.pack('!H', crc) + bytes(payload)
+
+
+def unpack_frame(data):
+    """Unpack packet bytes into a Frame, validating magic, version and CRC"""
+    if not is_binary_frame(data):
+        raise FrameError("Not a binary voice frame")
+    magic, version, flags, message_id, seq, total, crc = FRAME_HEADER.unpack_from(data)
+    if version != VERSION:
+        raise FrameError(f"Unsupported frame version {version}")
+    header = FRAME_HEADER.pack(magic, version, flags, message_id, seq, total, 0)
+    payload = bytes(data[HEADER_SIZE:])
+    if _crc(header, payload) != crc:
+        raise FrameError("Frame CRC mismatch")
+    return Frame(flags, message_id, seq, total, payload)
+
+
+def split_payload(message_id, payload, frame_size):
+    """Split a payload into packed data frames no larger than frame_size bytes"""
+    chunk_size = frame_size - HEADER_SIZE
+    if chunk_size <= 0:
+        raise ValueError(f"Frame size {frame_size} leaves no room for payload")
+    total = max(1, -(-len(payload) // chunk_size))
+    return [pack_frame(message_id, seq, total, payload[seq * chunk_size:(seq + 1) * chunk_size])
+            for seq in range(total)]
+
+
+def pack_end(message_id, count):
+    """Pack the END frame announcing the chunk count of a streamed message"""
+    return pack_frame(message_id, count, count, b"", TYPE_END)
+
+
+class StreamSplitter:
+    """Cut a payload that is still being produced into data frames"""
+
+    def __init__(self, message_id, frame_size):
+        self.message_id = message_id
+        self.chunk_size = frame_size - HEADER_SIZE
+        if self.chunk_size <= 0:
+            raise ValueError(f"Frame size {frame_size} leaves no room for payload")
+        self.pending = bytearray()
+        self.count = 0
+
+    def feed(self, data):
+        """Add payload bytes and return the frames for every full chunk"""
+        self.pending += data
+        frames = []
+        while len(self.pending) >= self.chunk_size:
+            frames.append(self._frame(self.pending[:self.chunk_size]))
+            del self.pending[:self.chunk_size]
+        return frames
+
+    def finish(self):
+        """Return the frame for the last partial chunk (if any) and the END frame"""
+        frames = []
+        if self.pending or self.count == 0:
+            frames.append(self._frame(self.pending))
+            self.pending = bytearray()
+        frames.append(pack_end(self.message_id, self.count))
+        return frames
+
+    def _frame(self, chunk):
+        frame = pack_frame(self.message_id, self.count, TOTAL_UNKNOWN, chunk)
+        self.count += 1
+        return frame
+
+
+def pack_bundle(packets):
+    """Pack several packets (binary frames or JSON) into one BUNDLE frame"""
+    payload = bytearray()
+    for packet in packets:
+        if len(packet) > MAX_BUNDLE_ITEM:
+            raise ValueError(f"Packet of {len(packet)} bytes is too large to bundle")
+        payload.append(len(packet))
+        payload += packet
+    return pack_frame(0, len(packets), len(packets), payload, TYPE_BUNDLE)
+
+
+def unpack_bundle(frame):
+    """Return the packets carried by an unpacked BUNDLE frame"""
+    packets = []
+    payload = frame.payload
+    offset = 0
+    while offset < len(payload):
+        end = offset + BUNDLE_ITEM_OVERHEAD + payload[offset]
+        if end > len(payload):
+            raise FrameError("Truncated packet in bundle")
+        packets.append(payload[offset + BUNDLE_ITEM_OVERHEAD:end])
+        offset = end
+    if len(packets) != frame.total:
+        raise FrameError(f"Bundle holds {len(packets)} packets, header says {frame.total}")
+    return packets
+
+
+def pack_nack(message_id, total, missing, frame_size):
+    """Pack a NACK frame for as many missing seqs as fit in frame_size bytes"""
+    missing = sorted(missing)
+    base = missing[0]
+    max_bits = (frame_size - HEADER_SIZE) * 8
+    bitmap = bytearray()
+    for seq in missing:
+        offset = seq - base
+        if offset >= max_bits:
+            break
+        while len(bitmap) <= offset // 8:
+            bitmap.append(0)
+        bitmap[offset // 8] |= 1 << (offset % 8)
+    return pack_frame(message_id, base, total, bytes(bitmap), TYPE_NACK)
+
+
+def unpack_nack(frame):
+    """Return the set of missing seqs requested by an unpacked NACK frame"""
+    missing = set()
+    for index, byte in enumerate(frame.payload):
+        for bit in range(8):
+            if byte & (1 << bit):
+                missing.add(frame.seq + index * 8 + bit)
+    return missing